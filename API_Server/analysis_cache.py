@@ -0,0 +1,134 @@
+import asyncio
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Optional
+
+
+def message_digest(msg: dict) -> str:
+    # 発言の内容から決まるダイジェスト（Python の hash() と違いプロセスや再起動で変わらない）
+    normalized = [
+        str(msg.get("author", "")),
+        unicodedata.normalize("NFKC", str(msg.get("content", ""))).strip(),
+        str(msg.get("timestamp", "")),
+    ]
+    data = json.dumps(normalized, ensure_ascii=False).encode("utf-8")
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def cache_key(messages: list[dict], model: str, prompt_version: str) -> str:
+    h = hashlib.blake2b(digest_size=20)
+    h.update(f"{model}\0{prompt_version}\0".encode("utf-8"))
+    for msg in messages:
+        h.update(message_digest(msg).encode("ascii"))
+    return h.hexdigest()
+
+
+class AnalysisCache:
+    """発言の並びをキーにした分析結果のキャッシュ
+
+    メモリ上は LRU で max_entries 件まで保持し、ttl 秒を過ぎた結果は使わない。
+    path を指定すると SQLite にも書き込み、再起動後や他のワーカープロセスからも再利用できる。
+    """
+
+    def __init__(self, max_entries: int = 1024, ttl: float = 3600.0, path: Optional[str] = None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.path = path
+        self._entries: OrderedDict[str, tuple[float, dict]] = OrderedDict()
+        self._db: Optional[sqlite3.Connection] = None
+        self._db_lock = threading.Lock()
+        if path is not None:
+            self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS analysis_cache (key TEXT PRIMARY KEY, result TEXT, created REAL)"
+            )
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._puts = 0
+
+    async def get(self, key: str) -> Optional[dict]:
+        now = time.time()
+        item = self._entries.get(key)
+        if item is not None:
+            created, result = item
+            if now - created <= self.ttl:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return result
+            del self._entries[key]
+
+        if self._db is not None:
+            row = await asyncio.to_thread(self._db_get, key, now - self.ttl)
+            if row is not None:
+                created, result = row[0], json.loads(row[1])
+                self._remember(key, created, result)
+                self.hits += 1
+                self.disk_hits += 1
+                return result
+
+        self.misses += 1
+        return None
+
+    async def put(self, key: str, result: dict):
+        created = time.time()
+        self._remember(key, created, result)
+        if self._db is not None:
+            self._puts += 1
+            # 期限切れの行はときどきまとめて消す
+            purge = self._puts % 100 == 0
+            await asyncio.to_thread(self._db_put, key, json.dumps(result, ensure_ascii=False), created, purge)
+
+    async def warm(self) -> int:
+        # SQLite に保存済みの有効期限内の結果を、新しいものから max_entries 件までメモリに読み込む
+        if self._db is None:
+            return 0
+        rows = await asyncio.to_thread(self._db_recent, time.time() - self.ttl)
+        for key, created, result in reversed(rows):
+            if key not in self._entries:
+                self._remember(key, created, json.loads(result))
+        return len(rows)
+
+    def _remember(self, key: str, created: float, result: dict):
+        self._entries[key] = (created, result)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _db_get(self, key: str, oldest: float):
+        with self._db_lock:
+            return self._db.execute(
+                "SELECT created, result FROM analysis_cache WHERE key = ? AND created >= ?", (key, oldest)
+            ).fetchone()
+
+    def _db_recent(self, oldest: float):
+        with self._db_lock:
+            return self._db.execute(
+                "SELECT key, created, result FROM analysis_cache WHERE created >= ? ORDER BY created DESC LIMIT ?",
+                (oldest, self.max_entries)
+            ).fetchall()
+
+    def _db_put(self, key: str, result: str, created: float, purge: bool):
+        with self._db_lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO analysis_cache (key, result, created) VALUES (?, ?, ?)",
+                (key, result, created)
+            )
+            if purge:
+                self._db.execute("DELETE FROM analysis_cache WHERE created < ?", (created - self.ttl,))
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+        }
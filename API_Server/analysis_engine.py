@@ -0,0 +1,251 @@
+import asyncio
+import time
+from collections import OrderedDict, deque
+from typing import Awaitable, Callable, Optional
+
+# 分析結果のフィールドが完成するたびに (キー, 値) で呼ばれる
+FieldCallback = Callable[[str, object], Awaitable[None]]
+
+
+def estimate_tokens(text: str) -> int:
+    # 概算のトークン数。日本語は1文字≒1トークン、英数字は4文字≒1トークンとして数える
+    ascii_chars = sum(1 for c in text if c.isascii())
+    return (len(text) - ascii_chars) + (ascii_chars + 3) // 4
+
+
+def truncate_to_tokens(text: str, budget: int, marker: str = "…") -> str:
+    # 概算トークン数が budget 以内になるよう末尾を切り詰め、切り詰めたら marker を付ける
+    if estimate_tokens(text) <= budget:
+        return text
+    budget -= estimate_tokens(marker)
+    used = ascii_chars = 0
+    for end, c in enumerate(text):
+        if c.isascii():
+            # 英数字は4文字ごとに1トークン増える
+            ascii_chars += 1
+            cost = 1 if ascii_chars % 4 == 1 else 0
+        else:
+            cost = 1
+        if used + cost > budget:
+            return text[:end] + marker if end else ""
+        used += cost
+    return text
+
+
+def format_message(msg: dict) -> str:
+    return f"{msg['author']}: {msg['content']}"
+
+
+class DebateState:
+    """討論ごとのローリングコンテキスト（直前の要約と直近の発言）"""
+
+    def __init__(self, concurrency: int = 1):
+        self.summary = ""
+        self.recent: deque = deque()
+        self.analyses = 0
+        self.last_used = time.monotonic()
+        # 次の分析に含める発言と、まだ開始していない次の分析
+        self.pending: list[dict] = []
+        self.next_run: Optional[asyncio.Task] = None
+        # 実行中の分析と、最後に成功した分析の結果
+        self.current: Optional[asyncio.Task] = None
+        self.last_result: Optional[dict] = None
+        # 次の分析の途中経過（完成したフィールド）を受け取る関数
+        self.listeners: list = []
+        self.running = 0
+        self.semaphore = asyncio.Semaphore(concurrency)
+
+
+class RollingAnalysisEngine:
+    """差分だけを送る逐次分析
+
+    毎回すべての発言を送り直す代わりに、前回までの要約・直近の発言・新しい発言だけで
+    プロンプトを組み立て、全体を token_budget（概算トークン数）以内に収める。
+    分析が返ってきたら要約と直近の発言を状態に取り込む。
+
+    LLM の同時呼び出しは全体で max_concurrency、討論ごとに per_debate_concurrency までに
+    制限する。同じ討論の分析が実行中に届いた発言は、並行して呼び出さずに次の1回にまとめる。
+    同じ発言の重複は呼び出し側（AnalysisHub）で除くので、渡された発言はすべて新しいものとして扱う。
+    """
+
+    def __init__(self, complete: Callable[[list, Optional[FieldCallback]], Awaitable[dict]], system_prompt: str,
+                 token_budget: int = 3000, window_messages: int = 20, max_debates: int = 1000,
+                 max_concurrency: int = 8, per_debate_concurrency: int = 1):
+        self.complete = complete
+        self.system_prompt = system_prompt
+        self.token_budget = token_budget
+        self.window_messages = window_messages
+        self.max_debates = max_debates
+        self.per_debate_concurrency = per_debate_concurrency
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self._states: OrderedDict[str, DebateState] = OrderedDict()
+        self.in_flight = 0
+        self.coalesced = 0
+        self.cancelled = 0
+        self.calls = 0
+        self.prompt_tokens = 0
+        self.truncated_messages = 0
+        self.shortened_messages = 0
+
+    def state(self, debate_id: str) -> DebateState:
+        state = self._states.get(debate_id)
+        if state is None:
+            state = self._states[debate_id] = DebateState(self.per_debate_concurrency)
+            # 長く使われていない討論の状態から捨てる
+            for old_id in list(self._states):
+                if len(self._states) <= self.max_debates:
+                    break
+                old = self._states[old_id]
+                if old_id != debate_id and old.next_run is None and not old.running:
+                    del self._states[old_id]
+        self._states.move_to_end(debate_id)
+        state.last_used = time.monotonic()
+        return state
+
+    def build_messages(self, state: DebateState, new_lines: list[str]) -> tuple[list[dict], int]:
+        remaining = self.token_budget - estimate_tokens(self.system_prompt)
+
+        # 要約は予算の1/4まで（超える分は末尾を残す）
+        summary = state.summary
+        summary_limit = self.token_budget // 4
+        while summary and estimate_tokens(summary) > summary_limit:
+            summary = summary[len(summary) // 10 + 1:]
+        remaining -= estimate_tokens(summary)
+
+        # 新しい発言は新しいものを優先して入れる
+        new_part = []
+        for line in reversed(new_lines):
+            cost = estimate_tokens(line) + 1
+            if cost > remaining:
+                if not new_part and remaining > 1:
+                    # 最新の発言だけで予算を超える場合は、発言を捨てずに入る分だけ送る
+                    line = truncate_to_tokens(line, remaining - 1)
+                    new_part.append(line)
+                    remaining -= estimate_tokens(line) + 1
+                    self.shortened_messages += 1
+                break
+            new_part.append(line)
+            remaining -= cost
+        new_part.reverse()
+        self.truncated_messages += len(new_lines) - len(new_part)
+
+        # 残りの予算で直近の発言を文脈として入れる
+        recent_part = []
+        for line in reversed(state.recent):
+            cost = estimate_tokens(line) + 1
+            if cost > remaining:
+                break
+            recent_part.append(line)
+            remaining -= cost
+        recent_part.reverse()
+
+        sections = []
+        if summary:
+            sections.append(f"これまでの議論の要約：\n{summary}")
+        if recent_part:
+            sections.append("直近の発言：\n" + "\n".join(recent_part))
+        omitted = len(new_lines) - len(new_part)
+        header = "新しい発言" + (f"（古い{omitted}件は省略）" if omitted else "")
+        sections.append(f"{header}：\n" + "\n".join(new_part))
+
+        content = "次の議論を分析してください：\n" + "\n\n".join(sections)
+        messages = [
+            {"role": "system", "content": self.system_prompt},
+            {"role": "user", "content": content},
+        ]
+        return messages, estimate_tokens(self.system_prompt) + estimate_tokens(content)
+
+    async def analyze(self, debate_id: str, new_messages: list[dict],
+                      on_field: Optional[FieldCallback] = None) -> dict:
+        # 開始前の分析があればそこに発言を加え、その結果を待つ
+        # on_field を渡すと、ストリーミングで完成したフィールドを順に受け取れる
+        state = self.state(debate_id)
+        fresh = list(new_messages)
+        if not fresh and state.next_run is None:
+            # 新しい発言がなければ、実行中か最後の分析の結果を返す
+            if state.current is not None:
+                return await asyncio.shield(state.current)
+            if state.last_result is not None:
+                return state.last_result
+            # 分析する発言がなければ LLM は呼ばずに空の結果を返す
+            return {}
+        state.pending.extend(fresh)
+        if on_field is not None:
+            state.listeners.append(on_field)
+        if state.next_run is None:
+            state.next_run = asyncio.create_task(self._run(state))
+        else:
+            self.coalesced += 1
+        # 呼び出し元が切断されても、同じ分析を待つ他の呼び出し元のために分析は続ける
+        return await asyncio.shield(state.next_run)
+
+    async def _run(self, state: DebateState) -> dict:
+        async with state.semaphore, self.semaphore:
+            # ここから先に届いた発言は次の分析に回す
+            state.current, state.next_run = state.next_run, None
+            batch, listeners = state.pending, state.listeners
+            state.pending, state.listeners = [], []
+            new_lines = [format_message(msg) for msg in batch]
+            messages, tokens = self.build_messages(state, new_lines)
+            self.calls += 1
+            self.prompt_tokens += tokens
+
+            self.in_flight += 1
+            state.running += 1
+            try:
+                result = await self.complete(messages, self._dispatch(listeners) if listeners else None)
+            except asyncio.CancelledError:
+                # 取り消された分析の発言は次の分析に含める
+                state.pending[:0] = batch
+                state.listeners[:0] = listeners
+                raise
+            finally:
+                self.in_flight -= 1
+                state.running -= 1
+                if state.running == 0:
+                    state.current = None
+            if "error" not in result:
+                self.fold(state, new_lines, result)
+            return result
+
+    def cancel(self, debate_id: str) -> bool:
+        # 実行中の分析を取り消す（新しい発言で結果が古くなる場合に使う）
+        state = self._states.get(debate_id)
+        if state is None or state.current is None or state.current.done():
+            return False
+        state.current.cancel()
+        self.cancelled += 1
+        return True
+
+    @staticmethod
+    def _dispatch(listeners: list) -> FieldCallback:
+        async def on_field(key: str, value: object):
+            for listener in listeners:
+                try:
+                    await listener(key, value)
+                except Exception as e:
+                    # 送信先が切断されていても他の受け取り手には送り続ける
+                    print(f"分析途中経過の送信エラー: {str(e)}")
+        return on_field
+
+    def fold(self, state: DebateState, new_lines: list[str], result: dict):
+        # 分析結果の要約と新しい発言を状態に取り込む
+        if result.get("summary"):
+            state.summary = result["summary"]
+        state.recent.extend(new_lines)
+        while len(state.recent) > self.window_messages:
+            state.recent.popleft()
+        state.analyses += 1
+        state.last_result = result
+
+    def stats(self) -> dict:
+        return {
+            "debates": len(self._states),
+            "calls": self.calls,
+            "in_flight": self.in_flight,
+            "coalesced": self.coalesced,
+            "cancelled": self.cancelled,
+            "avg_prompt_tokens": round(self.prompt_tokens / self.calls, 1) if self.calls else 0.0,
+            "truncated_messages": self.truncated_messages,
+            "shortened_messages": self.shortened_messages,
+        }
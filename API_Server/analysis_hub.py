@@ -0,0 +1,158 @@
+import asyncio
+from collections import OrderedDict
+from datetime import datetime
+from typing import Awaitable, Callable, Hashable, Optional
+
+from analysis_cache import AnalysisCache, message_digest
+from analysis_scheduler import AnalysisScheduler
+from pre_analysis import PreAnalyzer
+
+# 購読者にメッセージを送る関数（WebSocket.send_json など）
+SendCallback = Callable[[dict], Awaitable[None]]
+
+# 購読者のいない討論を、最新の結果の再送用に残しておく数
+IDLE_DEBATES_KEPT = 1000
+# 討論ごとに覚えておく分析済み発言のダイジェストの数
+SEEN_MESSAGES_PER_DEBATE = 10000
+
+
+class DebateHub:
+    """1つの討論の分析結果を購読している接続と、最新の結果"""
+
+    def __init__(self):
+        # キー -> (send, stream)
+        self.subscribers: dict = {}
+        self.latest: Optional[dict] = None
+        # この討論で分析に回した発言のダイジェスト
+        self.seen: OrderedDict[str, None] = OrderedDict()
+
+
+class AnalysisHub:
+    """討論ごとに1つの分析を全ての閲覧者に配信する
+
+    同じ討論の分析パネルを何人が開いていても、発言は討論単位で重複を除いてから
+    スケジューラーに渡すので、LLM の呼び出し数は閲覧者数ではなく討論数に比例する。
+    分析結果は購読中の全接続に送り、後から接続した閲覧者には最新の結果をすぐに送る。
+    pre_analyzer を渡すと、新しい発言ごとにローカルの事前分析の結果（警告と発言者の統計）を
+    すぐに配信し、短い発言だけなら次の発言が届くまでスケジューラーに渡すのを待つ。
+    """
+
+    def __init__(self, scheduler: AnalysisScheduler, cache: Optional[AnalysisCache] = None,
+                 pre_analyzer: Optional[PreAnalyzer] = None):
+        self.scheduler = scheduler
+        self.cache = cache
+        self.pre_analyzer = pre_analyzer
+        self._hubs: OrderedDict[str, DebateHub] = OrderedDict()
+        self.broadcasts = 0
+        self.replays = 0
+        self.deduplicated = 0
+
+    def _hub(self, debate_id: str) -> DebateHub:
+        hub = self._hubs.get(debate_id)
+        if hub is None:
+            hub = self._hubs[debate_id] = DebateHub()
+            # 購読者のいない古い討論から捨てる
+            idle = [d for d, h in self._hubs.items() if not h.subscribers and d != debate_id]
+            for old_id in idle[:max(0, len(idle) - IDLE_DEBATES_KEPT)]:
+                del self._hubs[old_id]
+        self._hubs.move_to_end(debate_id)
+        return hub
+
+    async def join(self, debate_id: str, key: Hashable, send: SendCallback, stream: bool = False):
+        hub = self._hub(debate_id)
+        hub.subscribers[key] = (send, stream)
+        if hub.latest is not None:
+            # 後から接続した閲覧者には最新の分析結果をすぐに送る
+            self.replays += 1
+            await send(hub.latest)
+
+    def leave(self, debate_id: str, key: Hashable):
+        hub = self._hubs.get(debate_id)
+        if hub is not None:
+            hub.subscribers.pop(key, None)
+
+    def latest(self, debate_id: str) -> Optional[dict]:
+        hub = self._hubs.get(debate_id)
+        return hub.latest["result"] if hub is not None and hub.latest is not None else None
+
+    def mark_seen(self, debate_id: str, messages: list[dict]) -> list[dict]:
+        # 討論内でまだ分析に回していない発言だけを返し、分析済みとして記録する
+        hub = self._hub(debate_id)
+        fresh = []
+        for msg in messages:
+            digest = message_digest(msg)
+            if digest in hub.seen:
+                continue
+            hub.seen[digest] = None
+            fresh.append(msg)
+        while len(hub.seen) > SEEN_MESSAGES_PER_DEBATE:
+            hub.seen.popitem(last=False)
+        self.deduplicated += len(messages) - len(fresh)
+        return fresh
+
+    async def publish(self, debate_id: str, messages: list[dict], key: Optional[str] = None) -> int:
+        # 発言を討論の分析待ちに加える。他の閲覧者が送った発言と重複する分は除く
+        fresh = self.mark_seen(debate_id, messages)
+        if not fresh:
+            return 0
+        hub = self._hubs[debate_id]
+        if self.pre_analyzer is not None:
+            warnings, fresh = self.pre_analyzer.analyze(debate_id, fresh)
+            await self._broadcast(hub, {
+                "type": "pre_analysis",
+                "warnings": warnings,
+                "stats": self.pre_analyzer.stats_for(debate_id).snapshot(),
+                "timestamp": datetime.now().isoformat()
+            }, count=False)
+            if not fresh:
+                return 0
+        stream = any(s for _, s in hub.subscribers.values())
+
+        async def on_result(result: dict, cache_key: Optional[str]):
+            await self._on_result(debate_id, hub, result, cache_key)
+
+        async def on_field(field: str, value: object):
+            await self._broadcast(hub, {
+                "type": "analysis_field",
+                "field": field,
+                "value": value,
+                "timestamp": datetime.now().isoformat()
+            }, stream_only=True)
+
+        # スケジューラーから見た受け取り手は討論ごとに1つ
+        # 結果は、分析した発言の並びのキー（スケジューラーがまとめた分の最後のキー）で保存する
+        self.scheduler.submit(debate_id, fresh, hub, on_result, on_field if stream else None, cache_key=key)
+        return len(fresh)
+
+    async def _on_result(self, debate_id: str, hub: DebateHub, result: dict, cache_key: Optional[str]):
+        if not result:
+            # 分析する発言がなかった（LLM を呼んでいない）
+            return
+        if "error" not in result and self.cache is not None and cache_key is not None:
+            await self.cache.put(cache_key, result)
+        hub.latest = {
+            "type": "analysis",
+            "result": result,
+            "timestamp": datetime.now().isoformat()
+        }
+        print(f"ディベート {debate_id} の分析を{len(hub.subscribers)}件の接続に送信")
+        await self._broadcast(hub, hub.latest)
+
+    async def _broadcast(self, hub: DebateHub, message: dict, stream_only: bool = False, count: bool = True):
+        targets = [(key, send) for key, (send, stream) in list(hub.subscribers.items()) if stream or not stream_only]
+        results = await asyncio.gather(*(send(message) for _, send in targets), return_exceptions=True)
+        for (key, _), result in zip(targets, results):
+            if isinstance(result, Exception):
+                # 送れなかった接続は購読から外す
+                hub.subscribers.pop(key, None)
+        if count and not stream_only:
+            self.broadcasts += 1
+
+    def stats(self) -> dict:
+        return {
+            "debates": len(self._hubs),
+            "subscribers": sum(len(h.subscribers) for h in self._hubs.values()),
+            "broadcasts": self.broadcasts,
+            "replays": self.replays,
+            "deduplicated_messages": self.deduplicated,
+        }
@@ -0,0 +1,174 @@
+import asyncio
+import time
+from collections import deque
+from typing import Awaitable, Callable, Hashable, Optional
+
+from analysis_engine import FieldCallback, RollingAnalysisEngine
+
+# 分析結果と、分析した発言の並びのキャッシュキーを受け取る関数
+ResultCallback = Callable[[dict, Optional[str]], Awaitable[None]]
+
+
+class DebateQueue:
+    """討論ごとの、分析待ちの発言と受け取り手"""
+
+    def __init__(self):
+        self.buffer: list[dict] = []
+        # 溜まっている発言を最後に送ってきた発言の並びのキャッシュキー（次の分析の結果をこのキーで保存する）
+        self.cache_key: Optional[str] = None
+        # 溜まっている最初の発言 / 最後の発言を受け取った時刻
+        self.first_at: Optional[float] = None
+        self.last_at: Optional[float] = None
+        # 結果をまだ返していない最も古い発言を受け取った時刻
+        self.oldest_waiting: Optional[float] = None
+        # 次の分析の受け取り手と、実行中の分析の受け取り手（キー -> (on_result, on_field)）
+        self.listeners: dict = {}
+        self.run_listeners: dict = {}
+        self.timer: Optional[asyncio.Task] = None
+        self.run: Optional[asyncio.Task] = None
+        # 実行中の分析が終わったらすぐ次を始めるか
+        self.flush_after_run = False
+        self.completed: deque = deque()
+        self.analyses = 0
+        self.cancelled = 0
+
+
+class AnalysisScheduler:
+    """討論ごとに発言を溜めてから分析を始めるスケジューラー
+
+    発言が届くたびに分析するのではなく、次のいずれかで溜まった発言をまとめて分析する。
+    - 溜まった発言が trigger_messages 件になった
+    - 最後の発言から idle_seconds 秒、新しい発言がない
+    - 最初の発言から max_delay 秒経った
+    分析中に新しい発言で分析が始まる場合、実行中の分析は古くなるので取り消し、
+    その発言も新しい分析に含める。ただし結果を max_delay 秒以上待たせている場合は取り消さない。
+    """
+
+    def __init__(self, engine: RollingAnalysisEngine, trigger_messages: int = 5, idle_seconds: float = 2.0,
+                 max_delay: float = 10.0, cancel_stale: bool = True):
+        self.engine = engine
+        self.trigger_messages = trigger_messages
+        self.idle_seconds = idle_seconds
+        self.max_delay = max_delay
+        self.cancel_stale = cancel_stale
+        self._queues: dict[str, DebateQueue] = {}
+
+    def submit(self, debate_id: str, messages: list[dict], key: Hashable,
+               on_result: ResultCallback, on_field: Optional[FieldCallback] = None, cache_key: Optional[str] = None):
+        # key は受け取り手の識別子（接続ごとに1つ）。同じ key の受け取り手は1回だけ結果を受け取る
+        # cache_key は messages を含む発言の並び全体のキャッシュキー。分析結果と一緒に on_result に渡す
+        if not messages:
+            return
+        now = time.monotonic()
+        queue = self._queues.get(debate_id)
+        if queue is None:
+            self._sweep(now)
+            queue = self._queues[debate_id] = DebateQueue()
+        queue.listeners[key] = (on_result, on_field)
+        queue.buffer.extend(messages)
+        if cache_key is not None:
+            queue.cache_key = cache_key
+        if queue.first_at is None:
+            queue.first_at = now
+        if queue.oldest_waiting is None:
+            queue.oldest_waiting = now
+        queue.last_at = now
+
+        if len(queue.buffer) >= self.trigger_messages:
+            self._flush(debate_id, queue)
+        elif queue.timer is None or queue.timer.done():
+            queue.timer = asyncio.create_task(self._wait(debate_id, queue))
+
+    def forget(self, debate_id: str, key: Hashable):
+        # 切断した受け取り手を外す（溜まっている発言は他の受け取り手のために分析を続ける）
+        queue = self._queues.get(debate_id)
+        if queue is not None:
+            queue.listeners.pop(key, None)
+            queue.run_listeners.pop(key, None)
+
+    async def _wait(self, debate_id: str, queue: DebateQueue):
+        while queue.buffer:
+            deadline = min(queue.last_at + self.idle_seconds, queue.first_at + self.max_delay)
+            delay = deadline - time.monotonic()
+            if delay <= 0:
+                self._flush(debate_id, queue)
+                return
+            await asyncio.sleep(delay)
+
+    def _flush(self, debate_id: str, queue: DebateQueue):
+        if queue.run is not None and not queue.run.done():
+            stale = self.cancel_stale and time.monotonic() - queue.oldest_waiting < self.max_delay
+            if not stale or not self.engine.cancel(debate_id):
+                # 実行中の分析が終わってから、溜まった発言をまとめて分析する
+                queue.flush_after_run = True
+                return
+            # 取り消した分析の受け取り手は新しい分析で結果を受け取る
+            queue.cancelled += 1
+            queue.listeners = {**queue.run_listeners, **queue.listeners}
+
+        batch, queue.buffer = queue.buffer, []
+        cache_key, queue.cache_key = queue.cache_key, None
+        queue.first_at = None
+        queue.flush_after_run = False
+        listeners, queue.listeners = queue.listeners, {}
+        queue.run_listeners = listeners
+        queue.run = asyncio.create_task(self._run(debate_id, queue, batch, listeners, cache_key))
+
+    async def _run(self, debate_id: str, queue: DebateQueue, batch: list[dict], listeners: dict,
+                   cache_key: Optional[str] = None):
+        async def forward_field(key, value):
+            for _, field in list(queue.run_listeners.values()):
+                if field is not None:
+                    await field(key, value)
+
+        streaming = any(field is not None for _, field in listeners.values())
+        try:
+            result = await self.engine.analyze(debate_id, batch, forward_field if streaming else None)
+        except asyncio.CancelledError:
+            if queue.run is asyncio.current_task():
+                # 新しい分析に置き換えられずに取り消された場合は、受け取り手を次の分析に戻す
+                queue.listeners = {**queue.run_listeners, **queue.listeners}
+                queue.run_listeners = {}
+                if queue.cache_key is None:
+                    queue.cache_key = cache_key
+            return
+        if queue.run is not asyncio.current_task():
+            return
+
+        now = time.monotonic()
+        queue.analyses += 1
+        queue.completed.append(now)
+        while queue.completed and now - queue.completed[0] > 60:
+            queue.completed.popleft()
+        queue.oldest_waiting = queue.first_at
+        listeners, queue.run_listeners = queue.run_listeners, {}
+        for on_result, _ in listeners.values():
+            try:
+                await on_result(result, cache_key)
+            except Exception as e:
+                print(f"分析結果の送信エラー [{debate_id}]: {str(e)}")
+
+        if queue.buffer and queue.flush_after_run:
+            # この分析は終わっているので、_flush で実行中として扱わないようにする
+            queue.run = None
+            self._flush(debate_id, queue)
+
+    def _sweep(self, now: float):
+        # 5分以上発言のない討論のキューを片付ける
+        for debate_id, queue in list(self._queues.items()):
+            idle = not queue.buffer and not queue.listeners and (queue.run is None or queue.run.done())
+            if idle and now - queue.last_at > 300:
+                del self._queues[debate_id]
+
+    def stats(self) -> dict:
+        now = time.monotonic()
+        return {
+            debate_id: {
+                "queued_messages": len(queue.buffer),
+                "running": queue.run is not None and not queue.run.done(),
+                "analyses": queue.analyses,
+                "cancelled": queue.cancelled,
+                "analyses_per_minute": sum(1 for t in queue.completed if now - t <= 60),
+            }
+            for debate_id, queue in self._queues.items()
+        }
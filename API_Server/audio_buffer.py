@@ -0,0 +1,66 @@
+import numpy as np
+
+
+class AudioRingBuffer:
+    """セッションごとの受信音声バッファ
+
+    事前確保した領域に受信データを1回だけコピーし、固定長チャンクをコピーせずに
+    float32 のビューとして取り出す。容量はチャンク長の整数倍で、読み出し位置は常に
+    チャンク境界にあるため、取り出すチャンクが領域の終端をまたぐことはない。
+    """
+
+    def __init__(self, chunk_size: int, chunks: int = 16):
+        if chunk_size % 4:
+            raise ValueError("チャンク長は float32 のサンプル境界（4バイトの倍数）である必要があります")
+        self.chunk_size = chunk_size
+        self.capacity = chunk_size * chunks
+        self._data = np.empty(self.capacity, dtype=np.uint8)
+        self._bytes = memoryview(self._data)
+        # チャンクごとの float32 ビュー。取り出すたびに配列をスライスしないよう最初に作っておく
+        self._chunks = [self._data[i:i + chunk_size].view(np.float32) for i in range(0, self.capacity, chunk_size)]
+        self._head = 0
+        self._size = 0
+        # 溢れて捨てた音声のバイト数
+        self.overrun_bytes = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def write(self, data) -> None:
+        n = len(data)
+        tail = self._head + self._size
+        if tail >= self.capacity:
+            tail -= self.capacity
+        if n <= self.capacity - self._size and tail + n <= self.capacity and isinstance(data, bytes):
+            # 溢れず終端もまたがない場合（ほとんどの受信）は1回のコピーで済ませる
+            self._bytes[tail:tail + n] = data
+            self._size += n
+            return
+
+        src = memoryview(data).cast("B")
+        offset = 0
+        while offset < len(src):
+            free = self.capacity - self._size
+            if free == 0:
+                # 満杯なら最も古いチャンクを捨てて空ける
+                self._advance()
+                self.overrun_bytes += self.chunk_size
+                continue
+
+            tail = (self._head + self._size) % self.capacity
+            n = min(free, len(src) - offset, self.capacity - tail)
+            self._bytes[tail:tail + n] = src[offset:offset + n]
+            self._size += n
+            offset += n
+
+    def pop_chunk(self):
+        # 1チャンク分の float32 ビューを返す。次の write までに使い終えること
+        if self._size < self.chunk_size:
+            return None
+        chunk = self._chunks[self._head // self.chunk_size]
+        self._advance()
+        return chunk
+
+    def _advance(self):
+        self._head = (self._head + self.chunk_size) % self.capacity
+        self._size -= self.chunk_size
@@ -0,0 +1,84 @@
+"""分析結果の配信（ハブ）の試験
+
+--debates 件の討論それぞれに --viewers 人の閲覧者が接続し、全員が同じ発言の履歴を送る
+（フロントエンドは分析パネルごとに履歴を送るため）。
+スタブの LLM サーバーへの呼び出し数が閲覧者数によらず討論数に比例すること、
+全閲覧者に同じ結果が届くこと、後から接続した閲覧者に最新の結果が再送されることを確かめる。
+
+    python benchmarks/analysis_fanout_test.py [--debates 5] [--viewers 1 10 50]
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from analysis_stub_server import start_stub_server  # noqa: E402
+from analysis_token_bench import make_messages  # noqa: E402
+from openai import AsyncOpenAI  # noqa: E402
+
+import debate_analysis_API  # noqa: E402
+from analysis_engine import RollingAnalysisEngine  # noqa: E402
+from analysis_hub import AnalysisHub  # noqa: E402
+from analysis_scheduler import AnalysisScheduler  # noqa: E402
+
+
+async def run(debates: int, viewers: int, messages: int, server) -> dict:
+    engine = RollingAnalysisEngine(debate_analysis_API.request_analysis, debate_analysis_API.SYSTEM_PROMPT)
+    hub = AnalysisHub(AnalysisScheduler(engine, trigger_messages=5, idle_seconds=0.1, max_delay=1.0))
+    received = {}
+
+    def inbox(debate_id: str, viewer: int):
+        async def send(message: dict):
+            if message["type"] == "analysis":
+                received.setdefault((debate_id, viewer), []).append(message["result"]["summary"])
+        return send
+
+    before = server.requests
+    for d in range(debates):
+        for v in range(viewers):
+            await hub.join(f"debate-{d}", v, inbox(f"debate-{d}", v))
+    history = {d: make_messages(messages, seed=d) for d in range(debates)}
+    for i in range(1, messages + 1):
+        for d in range(debates):
+            for v in range(viewers):
+                await hub.publish(f"debate-{d}", history[d][:i])
+        await asyncio.sleep(0.02)
+    await asyncio.sleep(1.5)
+
+    # 後から接続した閲覧者には最新の結果がすぐに届く
+    await hub.join("debate-0", "late", inbox("debate-0", "late"))
+    consistent = all(
+        received.get((f"debate-{d}", v)) == received.get((f"debate-{d}", 0))
+        for d in range(debates) for v in range(viewers)
+    )
+    return {
+        "llm_calls": server.requests - before,
+        "deliveries": sum(len(r) for r in received.values()),
+        "consistent": consistent,
+        "late_replay": bool(received.get(("debate-0", "late"))),
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--debates", type=int, default=5)
+    parser.add_argument("--viewers", type=int, nargs="+", default=[1, 10, 50])
+    parser.add_argument("--messages", type=int, default=20)
+    args = parser.parse_args()
+
+    server = start_stub_server(latency=0.05)
+    debate_analysis_API.client.set(AsyncOpenAI(api_key="stub", base_url=server.base_url))
+    print(f"{'閲覧者/討論':>10} {'LLM呼出':>8} {'配信数':>8} {'結果一致':>8} {'途中参加':>8} {'所要秒':>7}")
+    for viewers in args.viewers:
+        started = time.perf_counter()
+        r = await run(args.debates, viewers, args.messages, server)
+        print(f"{viewers:>10} {r['llm_calls']:>8} {r['deliveries']:>8} {str(r['consistent']):>8} "
+              f"{str(r['late_replay']):>8} {time.perf_counter() - started:>7.1f}")
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
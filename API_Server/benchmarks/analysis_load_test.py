@@ -0,0 +1,72 @@
+"""議論分析の負荷試験
+
+--debates 件の討論それぞれに --senders 本の送信元から新しい発言を --interval 秒ごとに送り、
+スタブの LLM サーバーへの呼び出し数・同時呼び出し数の最大値・分析の応答時間を調べる。
+同じ討論の分析が実行中に届いた発言は次の1回にまとめられるため、
+LLM の呼び出し数は analyze() の呼び出し数より少なくなる。
+
+    python benchmarks/analysis_load_test.py [--debates 20] [--senders 3] [--max-concurrency 8]
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from analysis_stub_server import start_stub_server  # noqa: E402
+from analysis_token_bench import make_messages  # noqa: E402
+from openai import AsyncOpenAI  # noqa: E402
+
+import debate_analysis_API  # noqa: E402
+from analysis_engine import RollingAnalysisEngine  # noqa: E402
+
+
+async def sender(engine: RollingAnalysisEngine, debate_id: str, messages: list[dict],
+                 interval: float, latencies: list[float]):
+    for msg in messages:
+        started = time.perf_counter()
+        await engine.analyze(debate_id, [msg])
+        latencies.append(time.perf_counter() - started)
+        await asyncio.sleep(interval)
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--debates", type=int, default=20)
+    parser.add_argument("--senders", type=int, default=3)
+    parser.add_argument("--messages", type=int, default=10, help="送信元ごとの発言数")
+    parser.add_argument("--interval", type=float, default=0.05)
+    parser.add_argument("--max-concurrency", type=int, default=8)
+    parser.add_argument("--per-debate-concurrency", type=int, default=1)
+    parser.add_argument("--latency", type=float, default=0.2, help="スタブサーバーの固定遅延（秒）")
+    args = parser.parse_args()
+
+    server = start_stub_server(latency=args.latency)
+    debate_analysis_API.client.set(AsyncOpenAI(api_key="stub", base_url=server.base_url))
+    engine = RollingAnalysisEngine(debate_analysis_API.request_analysis, debate_analysis_API.SYSTEM_PROMPT,
+                                   max_concurrency=args.max_concurrency,
+                                   per_debate_concurrency=args.per_debate_concurrency)
+
+    latencies: list[float] = []
+    started = time.perf_counter()
+    await asyncio.gather(*(
+        sender(engine, f"debate-{d}", make_messages(args.messages, seed=d * 100 + s), args.interval, latencies)
+        for d in range(args.debates) for s in range(args.senders)
+    ))
+    elapsed = time.perf_counter() - started
+
+    stats = engine.stats()
+    latencies.sort()
+    print(f"討論: {args.debates}, 送信元: {args.senders}/討論, 上限: 全体{args.max_concurrency} 討論ごと{args.per_debate_concurrency}")
+    print(f"analyze() 呼び出し: {len(latencies)}, LLM 呼び出し: {server.requests} (まとめた回数: {stats['coalesced']})")
+    print(f"LLM の同時呼び出し数の最大: {server.max_in_flight}")
+    print(f"応答時間 p50: {statistics.median(latencies) * 1000:.0f}ms, "
+          f"p95: {latencies[int(len(latencies) * 0.95) - 1] * 1000:.0f}ms, 所要時間: {elapsed:.1f}秒")
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
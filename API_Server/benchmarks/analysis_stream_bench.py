@@ -0,0 +1,63 @@
+"""分析結果のストリーミングのベンチマーク
+
+スタブの LLM サーバーに対して同じプロンプトで request_analysis を呼び、
+ストリーミングなし（完成した結果を一度に受け取る）とストリーミングあり
+（完成したフィールドから順に受け取る）で、最初のフィールドが届くまでの時間と完了までの時間を比べる。
+
+    python benchmarks/analysis_stream_bench.py [--runs 10] [--latency 0.3] [--gen-interval 0.02]
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from analysis_stub_server import start_stub_server  # noqa: E402
+from openai import AsyncOpenAI  # noqa: E402
+
+import debate_analysis_API  # noqa: E402
+
+
+async def measure(stream: bool, chat: list[dict]) -> tuple[float, float, list[str]]:
+    started = time.perf_counter()
+    first = None
+    fields = []
+
+    async def on_field(key, value):
+        nonlocal first
+        if first is None:
+            first = time.perf_counter() - started
+        fields.append(key)
+
+    result = await debate_analysis_API.request_analysis(chat, on_field if stream else None)
+    total = time.perf_counter() - started
+    assert "error" not in result, result
+    return (first if stream else total), total, fields or list(result)
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--latency", type=float, default=0.3, help="スタブサーバーの最初の応答までの遅延（秒）")
+    parser.add_argument("--gen-interval", type=float, default=0.02, help="引数の断片1つを生成する時間（秒）")
+    args = parser.parse_args()
+
+    server = start_stub_server(latency=args.latency, per_token_ms=0.0, gen_interval=args.gen_interval)
+    debate_analysis_API.client.set(AsyncOpenAI(api_key="stub", base_url=server.base_url))
+    chat = [{"role": "system", "content": debate_analysis_API.SYSTEM_PROMPT},
+            {"role": "user", "content": "次の議論を分析してください：\n田中: 税金を上げるべきです\n佐藤: 反対です"}]
+
+    print(f"{'方式':<8} {'最初のフィールドms':>18} {'完了ms':>10}  フィールドの順")
+    for stream in (False, True):
+        results = [await measure(stream, chat) for _ in range(args.runs)]
+        first = statistics.median(r[0] for r in results) * 1000
+        total = statistics.median(r[1] for r in results) * 1000
+        print(f"{'stream' if stream else 'batch':<8} {first:>18.0f} {total:>10.0f}  {','.join(results[-1][2])}")
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,166 @@
+"""ベンチマーク用の OpenAI 互換スタブサーバー
+
+/v1/chat/completions に対して analyze_discussion のツール呼び出しを返す。
+応答までの待ち時間は「固定の遅延 + プロンプトのトークン数に比例する遅延」で模擬し、
+その後の生成時間は引数の JSON を --piece-chars 文字ずつ --gen-interval 秒ごとに出力する想定で模擬する。
+stream=true のリクエストには Server-Sent Events で引数の断片を順に返す。
+analysis_conf.json の OPENAI.BASE_URL に http://127.0.0.1:<port>/v1 を指定すれば
+分析サーバーを実際の API を使わずに動かせる。
+
+    python benchmarks/analysis_stub_server.py --port 8900 --latency 0.2 --per-token-ms 0.05 --gen-interval 0.02
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from analysis_engine import estimate_tokens  # noqa: E402
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self.send_error(404)
+            return
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+        prompt_tokens = sum(estimate_tokens(m.get("content") or "") for m in body.get("messages", []))
+        server = self.server
+        with server.lock:
+            server.requests += 1
+            server.prompt_tokens += prompt_tokens
+            server.in_flight += 1
+            server.max_in_flight = max(server.max_in_flight, server.in_flight)
+        try:
+            self._respond(body, prompt_tokens)
+        except (BrokenPipeError, ConnectionResetError):
+            # 分析が取り消されてクライアントが切断した
+            pass
+        finally:
+            with server.lock:
+                server.in_flight -= 1
+
+    def _respond(self, body: dict, prompt_tokens: int):
+        server = self.server
+        time.sleep(server.latency + prompt_tokens * server.per_token_ms / 1000)
+        user = body["messages"][-1]["content"]
+        last_line = user.strip().splitlines()[-1]
+        arguments = {
+            "summary": f"{server.requests}回目の分析。最新の発言: {last_line[:60]}",
+            "suggestions": "根拠となるデータを示してください。",
+            "criticisms": "反論の前提が共有されていません。",
+            "evaluations": "論点は明確です。",
+            "warnings": [],
+        }
+        arguments = json.dumps(arguments, ensure_ascii=False)
+        pieces = [arguments[i:i + server.piece_chars] for i in range(0, len(arguments), server.piece_chars)]
+        if body.get("stream"):
+            self._stream(body, pieces)
+            return
+
+        time.sleep(len(pieces) * server.gen_interval)
+        response = {
+            "id": f"chatcmpl-stub-{server.requests}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "stub"),
+            "choices": [{
+                "index": 0,
+                "finish_reason": "tool_calls",
+                "message": {
+                    "role": "assistant",
+                    "content": None,
+                    "tool_calls": [{
+                        "id": "call_stub",
+                        "type": "function",
+                        "function": {"name": "analyze_discussion", "arguments": arguments},
+                    }],
+                },
+            }],
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": len(pieces),
+                      "total_tokens": prompt_tokens + len(pieces)},
+        }
+        data = json.dumps(response, ensure_ascii=False).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _stream(self, body: dict, pieces: list[str]):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        def chunk(delta: dict, finish_reason=None):
+            event = {
+                "id": "chatcmpl-stub-stream",
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": body.get("model", "stub"),
+                "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+            }
+            data = f"data: {json.dumps(event, ensure_ascii=False)}\n\n".encode("utf-8")
+            self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+            self.wfile.flush()
+
+        chunk({"role": "assistant", "content": None, "tool_calls": [{
+            "index": 0, "id": "call_stub", "type": "function",
+            "function": {"name": "analyze_discussion", "arguments": ""}}]})
+        for piece in pieces:
+            time.sleep(self.server.gen_interval)
+            chunk({"tool_calls": [{"index": 0, "function": {"arguments": piece}}]})
+        chunk({}, "tool_calls")
+        done = b"data: [DONE]\n\n"
+        self.wfile.write(f"{len(done):x}\r\n".encode() + done + b"\r\n0\r\n\r\n")
+        self.wfile.flush()
+
+
+def start_stub_server(port: int = 0, latency: float = 0.05, per_token_ms: float = 0.02,
+                      gen_interval: float = 0.0, piece_chars: int = 8) -> ThreadingHTTPServer:
+    # バックグラウンドのスレッドで起動し、サーバーを返す（URL は server.base_url）
+    server = ThreadingHTTPServer(("127.0.0.1", port), StubHandler)
+    server.daemon_threads = True
+    server.latency = latency
+    server.per_token_ms = per_token_ms
+    server.gen_interval = gen_interval
+    server.piece_chars = piece_chars
+    server.lock = threading.Lock()
+    server.requests = 0
+    server.prompt_tokens = 0
+    # 同時に処理中のリクエスト数と、その最大値
+    server.in_flight = 0
+    server.max_in_flight = 0
+    server.base_url = f"http://127.0.0.1:{server.server_address[1]}/v1"
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--latency", type=float, default=0.2, help="固定の応答遅延（秒）")
+    parser.add_argument("--per-token-ms", type=float, default=0.05, help="プロンプト1トークンあたりの遅延（ミリ秒）")
+    parser.add_argument("--gen-interval", type=float, default=0.02, help="引数の断片1つを生成する時間（秒）")
+    parser.add_argument("--piece-chars", type=int, default=8)
+    args = parser.parse_args()
+    server = start_stub_server(args.port, args.latency, args.per_token_ms, args.gen_interval, args.piece_chars)
+    print(f"スタブサーバー起動: {server.base_url}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
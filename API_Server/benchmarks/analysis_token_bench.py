@@ -0,0 +1,100 @@
+"""議論分析のトークン数・遅延のベンチマーク
+
+合成した討論（--messages 件の発言）を --batch 件ずつ分析サーバーに届いた想定で、
+スタブの LLM サーバーに対して次の2通りの送り方を比較する。
+
+- naive: 従来どおり、毎回それまでの発言をすべて1つのプロンプトに入れて送る
+- incremental: RollingAnalysisEngine で、要約・直近の発言・新しい発言の差分だけを送る
+
+    python benchmarks/analysis_token_bench.py [--messages 300] [--batch 5] [--budget 3000]
+"""
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from analysis_stub_server import start_stub_server  # noqa: E402
+from openai import AsyncOpenAI  # noqa: E402
+
+import debate_analysis_API  # noqa: E402
+from analysis_engine import RollingAnalysisEngine, estimate_tokens, format_message  # noqa: E402
+
+WORDS = (
+    "議論 賛成 反対 意見 理由 根拠 環境 経済 教育 政策 税金 制度 社会 若者 高齢者 "
+    "地域 企業 技術 安全 自由 責任 問題 解決 必要 重要 影響 効果 データ 調査 結果 "
+    "です ます という ので から しかし つまり 例えば 確かに 一方"
+).split()
+
+
+def make_messages(count: int, seed: int = 0) -> list[dict]:
+    rng = random.Random(seed)
+    authors = ["田中", "佐藤", "鈴木", "高橋"]
+    return [
+        {"author": rng.choice(authors), "content": "".join(rng.choice(WORDS) for _ in range(rng.randint(8, 30))),
+         "timestamp": f"2024-01-01T00:{i // 60:02d}:{i % 60:02d}"}
+        for i in range(count)
+    ]
+
+
+async def run_naive(messages: list[dict], batch: int) -> list[tuple[int, float]]:
+    results = []
+    for end in range(batch, len(messages) + 1, batch):
+        content = "次の議論を分析してください：\n" + "\n".join(format_message(m) for m in messages[:end])
+        chat = [{"role": "system", "content": debate_analysis_API.SYSTEM_PROMPT},
+                {"role": "user", "content": content}]
+        tokens = estimate_tokens(debate_analysis_API.SYSTEM_PROMPT) + estimate_tokens(content)
+        started = time.perf_counter()
+        await debate_analysis_API.request_analysis(chat)
+        results.append((tokens, time.perf_counter() - started))
+    return results
+
+
+async def run_incremental(messages: list[dict], batch: int, budget: int, window: int) -> list[tuple[int, float]]:
+    engine = RollingAnalysisEngine(debate_analysis_API.request_analysis, debate_analysis_API.SYSTEM_PROMPT,
+                                   token_budget=budget, window_messages=window)
+    results = []
+    for end in range(batch, len(messages) + 1, batch):
+        state = engine.state("bench")
+        new_lines = [format_message(m) for m in messages[end - batch:end]]
+        _, tokens = engine.build_messages(state, new_lines)
+        started = time.perf_counter()
+        await engine.analyze("bench", messages[end - batch:end])
+        results.append((tokens, time.perf_counter() - started))
+    return results
+
+
+def report(name: str, results: list[tuple[int, float]]):
+    tokens = [t for t, _ in results]
+    latencies = [l * 1000 for _, l in results]
+    print(f"{name:<12} {len(results):>6} {sum(tokens):>10} {max(tokens):>8} "
+          f"{statistics.mean(latencies):>9.1f} {max(latencies):>9.1f}")
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=300)
+    parser.add_argument("--batch", type=int, default=5)
+    parser.add_argument("--budget", type=int, default=3000)
+    parser.add_argument("--window", type=int, default=20)
+    parser.add_argument("--latency", type=float, default=0.02, help="スタブサーバーの固定遅延（秒）")
+    parser.add_argument("--per-token-ms", type=float, default=0.02)
+    args = parser.parse_args()
+
+    server = start_stub_server(latency=args.latency, per_token_ms=args.per_token_ms)
+    debate_analysis_API.client.set(AsyncOpenAI(api_key="stub", base_url=server.base_url))
+    messages = make_messages(args.messages)
+
+    print(f"発言数: {args.messages}, バッチ: {args.batch}, 予算: {args.budget}トークン")
+    print(f"{'方式':<12} {'呼出数':>6} {'合計トークン':>10} {'最大':>8} {'平均ms':>9} {'最大ms':>9}")
+    report("naive", await run_naive(messages, args.batch))
+    report("incremental", await run_incremental(messages, args.batch, args.budget, args.window))
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
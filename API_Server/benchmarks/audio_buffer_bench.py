@@ -0,0 +1,112 @@
+"""受信バッファのマイクロベンチマーク
+
+従来の bytearray 方式（extend → スライス → bytes() → np.frombuffer）と AudioRingBuffer で、
+音声1秒あたりのコピー量・メモリ確保回数・処理時間を比較する。
+コピー量と確保回数は、それぞれの実装のコピー／確保箇所で数えている。
+
+    python benchmarks/audio_buffer_bench.py [--message-bytes 4096] [--seconds 60]
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from audio_buffer import AudioRingBuffer  # noqa: E402
+
+SAMPLE_RATE = 16000
+BYTES_PER_SECOND = SAMPLE_RATE * 4
+CHUNK_SIZE = 32768
+
+
+class Counter:
+    def __init__(self):
+        self.copied = 0
+        self.allocations = 0
+
+    def copy(self, n: int, allocate: bool = True):
+        self.copied += n
+        self.allocations += allocate
+
+
+def legacy_counted(messages, counter: Counter):
+    buffer = bytearray()
+    for data in messages:
+        buffer.extend(data)
+        # extend は追記分をコピーし、容量が足りなければ再確保する
+        counter.copy(len(data), allocate=False)
+        if len(buffer) >= CHUNK_SIZE:
+            chunk = buffer[:CHUNK_SIZE]
+            counter.copy(CHUNK_SIZE)
+            rest = len(buffer) - CHUNK_SIZE
+            buffer = buffer[CHUNK_SIZE:]
+            counter.copy(rest)
+            np.frombuffer(chunk, dtype=np.float32)
+            bytes(chunk)
+            counter.copy(CHUNK_SIZE)
+
+
+def ring_counted(messages, counter: Counter):
+    buffer = AudioRingBuffer(CHUNK_SIZE)
+    counter.allocations += 1
+    for data in messages:
+        buffer.write(data)
+        counter.copy(len(data), allocate=False)
+        while buffer.pop_chunk() is not None:
+            pass
+
+
+def legacy(messages):
+    buffer = bytearray()
+    for data in messages:
+        buffer.extend(data)
+        if len(buffer) >= CHUNK_SIZE:
+            chunk = buffer[:CHUNK_SIZE]
+            buffer = buffer[CHUNK_SIZE:]
+            float_data = np.frombuffer(chunk, dtype=np.float32)
+            handoff = bytes(chunk)
+    return float_data, handoff
+
+
+def ring(messages):
+    buffer = AudioRingBuffer(CHUNK_SIZE)
+    for data in messages:
+        buffer.write(data)
+        while (float_data := buffer.pop_chunk()) is not None:
+            handoff = float_data
+    return handoff
+
+
+def timed(fn, messages, repeat: int = 5) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn(messages)
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--message-bytes", type=int, default=4096, help="1回の WebSocket メッセージの大きさ")
+    parser.add_argument("--seconds", type=int, default=60, help="流す音声の長さ")
+    args = parser.parse_args()
+
+    payload = os.urandom(args.message_bytes)
+    messages = [payload] * (BYTES_PER_SECOND * args.seconds // args.message_bytes)
+
+    print(f"メッセージ {args.message_bytes} バイト × {len(messages)} 件（音声 {args.seconds} 秒）")
+    print(f"{'':10} {'コピー KB/秒':>14} {'確保 回/秒':>12} {'処理 µs/秒':>12}")
+    for name, counted, plain in (("bytearray", legacy_counted, legacy), ("ring", ring_counted, ring)):
+        counter = Counter()
+        counted(messages, counter)
+        elapsed = timed(plain, messages)
+        print(f"{name:10} {counter.copied / args.seconds / 1024:>14.1f} "
+              f"{counter.allocations / args.seconds:>12.2f} {elapsed / args.seconds * 1e6:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
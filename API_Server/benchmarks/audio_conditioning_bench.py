@@ -0,0 +1,100 @@
+"""音声補正のベンチマークと旧実装との一致確認
+
+旧実装（エンドポイントでの無音検出用RMS + process_audio_data）と AudioConditioner の
+出力がビット単位で一致することを確認してから、1チャンクあたりの処理時間を比較する。
+
+    python benchmarks/audio_conditioning_bench.py [--chunks 2000]
+    python benchmarks/audio_conditioning_bench.py --check   # 一致確認だけを行う
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from audio_conditioning import AudioConditioner  # noqa: E402
+
+CHUNK_SAMPLES = 8192
+
+
+def legacy_process_audio_data(data: bytes) -> bytes:
+    # 置き換え前の process_audio_data（ログ出力を除く）
+    if len(data) < 32768:
+        return data
+    float_data = np.frombuffer(data, dtype=np.float32).copy()
+    rms = np.sqrt(np.mean(float_data**2))
+    if rms < 0.01:
+        gain = min(20.0, 1.0 / (rms + 0.0001))
+        float_data *= gain
+    elif rms < 0.05:
+        gain = min(10.0, 0.5 / (rms + 0.001))
+        float_data *= gain
+    post_gain_rms = np.sqrt(np.mean(float_data**2))  # noqa: F841
+    max_amplitude = np.max(np.abs(float_data))
+    if max_amplitude > 0:
+        float_data = np.clip(float_data / max_amplitude * 0.99, -0.99, 0.99)
+    int_data = (float_data * 32767).astype(np.int16)
+    return int_data.tobytes()
+
+
+def legacy(chunk: np.ndarray) -> bytes:
+    # エンドポイント側の無音検出も含めた旧来の1チャンク分の処理
+    rms = np.sqrt(np.mean(chunk**2))  # noqa: F841
+    return legacy_process_audio_data(bytes(chunk))
+
+
+def make_chunks(count: int) -> list:
+    rng = np.random.default_rng(0)
+    # 無音・小音量・中音量・通常音量・ゼロ・クリップ気味の入力を混ぜる
+    levels = [0.0005, 0.005, 0.02, 0.04, 0.2, 0.0, 3.0]
+    chunks = []
+    for i in range(count):
+        level = levels[i % len(levels)]
+        chunks.append((rng.standard_normal(CHUNK_SAMPLES) * level).astype(np.float32))
+    return chunks
+
+
+def check(chunks: list, conditioner: AudioConditioner):
+    # 固定の入力で旧実装と出力がビット単位で一致することを確かめる
+    for i, chunk in enumerate(chunks):
+        expected = legacy(chunk)
+        actual = conditioner.condition(chunk, conditioner.rms(chunk)).tobytes()
+        assert actual == expected, f"{i} 番目のチャンクで旧実装と出力が一致しません"
+    print(f"{len(chunks)} チャンクで旧実装と出力が一致しました")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--chunks", type=int, default=2000)
+    parser.add_argument("--check", action="store_true", help="一致確認だけを行い、処理時間は測らない")
+    args = parser.parse_args()
+
+    chunks = make_chunks(args.chunks)
+    conditioner = AudioConditioner(CHUNK_SAMPLES, debug=False)
+    check(chunks, conditioner)
+    if args.check:
+        return
+
+    results = {}
+    for name, fn in (
+        ("legacy", legacy),
+        ("conditioner", lambda c: conditioner.condition(c, conditioner.rms(c)).tobytes()),
+    ):
+        best = float("inf")
+        for _ in range(3):
+            started = time.perf_counter()
+            for chunk in chunks:
+                fn(chunk)
+            best = min(best, time.perf_counter() - started)
+        results[name] = best / len(chunks) * 1e6
+
+    for name, us in results.items():
+        print(f"{name:12} {us:8.1f} µs/チャンク")
+    print(f"高速化: {results['legacy'] / results['conditioner']:.2f}倍")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+"""チャットのブロードキャストの負荷試験
+
+1部屋に --clients 人の模擬クライアントを接続し、そのうち --slow 人は1メッセージの受信に
+--slow-delay 秒かかる遅いクライアント、--stalled 人は受信が止まったクライアントとする。
+--messages 件のメッセージを --interval 秒ごとにブロードキャストし、通常のクライアントに
+届くまでの遅延（ブロードキャスト開始から受信まで）を比べる。
+
+- sequential: 従来の ConnectionManager.broadcast と同じく、1接続ずつ send_json を待つ
+- outbox: 接続ごとの送信キューと送信タスク（ConnectionOutbox）を使う現在の実装
+
+    python benchmarks/chat_broadcast_load_test.py [--clients 100 500] [--slow 5] [--stalled 2]
+    python benchmarks/chat_broadcast_load_test.py --max-pending 16 --policy disconnect
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class FakeWebSocket:
+    def __init__(self, delay: float = 0.0, stalled: bool = False):
+        self.delay = delay
+        self.stalled = stalled
+        self.latencies: list[float] = []
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, text: str):
+        if self.stalled:
+            await asyncio.Event().wait()
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        self.latencies.append(time.perf_counter() - json.loads(text)["sent_at"])
+
+    async def send_json(self, message: dict):
+        await self.send_text(json.dumps(message, separators=(",", ":"), ensure_ascii=False))
+
+    async def close(self, code: int = 1000):
+        pass
+
+
+def make_clients(count: int, slow: int, stalled: int, delay: float) -> list[FakeWebSocket]:
+    return (
+        [FakeWebSocket(stalled=True) for _ in range(stalled)]
+        + [FakeWebSocket(delay=delay) for _ in range(slow)]
+        + [FakeWebSocket() for _ in range(count - slow - stalled)]
+    )
+
+
+async def run_sequential(clients, messages: int, interval: float, timeout: float):
+    # 従来の実装: 送信が終わるまで次の接続に進まない（止まった接続はタイムアウトで切断したとみなす）
+    connections = set(clients)
+    for i in range(messages):
+        message = {"username": "bench", "content": f"メッセージ{i}", "sent_at": time.perf_counter()}
+        for connection in connections.copy():
+            try:
+                await asyncio.wait_for(connection.send_json(message), timeout)
+            except asyncio.TimeoutError:
+                connections.discard(connection)
+        await asyncio.sleep(interval)
+
+
+async def run_outbox(clients, messages: int, interval: float):
+    import chat_websocket
+    manager = chat_websocket.ConnectionManager()
+    for client in clients:
+        await manager.connect(client, "bench")
+    for i in range(messages):
+        message = {"username": "bench", "content": f"メッセージ{i}", "sent_at": time.perf_counter()}
+        await manager.broadcast(message, "bench", None)
+        await asyncio.sleep(interval)
+    await asyncio.sleep(0.2)
+    stats = manager.stats()
+    for client in list(manager.active_connections.get("bench", {})):
+        await manager.disconnect(client, "bench")
+    return stats
+
+
+def report(name: str, clients, elapsed: float):
+    normal = [l * 1000 for c in clients if not c.delay and not c.stalled for l in c.latencies]
+    normal.sort()
+    print(f"{name:<11} {len(normal):>9} {statistics.median(normal):>8.2f} "
+          f"{normal[int(len(normal) * 0.99) - 1]:>8.2f} {normal[-1]:>8.2f} {elapsed:>7.2f}")
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--clients", type=int, nargs="+", default=[100, 500])
+    parser.add_argument("--slow", type=int, default=5)
+    parser.add_argument("--slow-delay", type=float, default=0.05)
+    parser.add_argument("--stalled", type=int, default=2)
+    parser.add_argument("--messages", type=int, default=50)
+    parser.add_argument("--interval", type=float, default=0.02)
+    parser.add_argument("--timeout", type=float, default=1.0, help="sequential で止まった接続を諦めるまでの秒数")
+    parser.add_argument("--max-pending", type=int, default=None, help="接続ごとの送信待ちの上限（OUTBOX_MAX_PENDING）")
+    parser.add_argument("--policy", choices=["drop_oldest", "disconnect"], default=None)
+    args = parser.parse_args()
+    # 送信キューの設定は chat_websocket を読み込む前に環境変数で渡す
+    if args.max_pending is not None:
+        os.environ["OUTBOX_MAX_PENDING"] = str(args.max_pending)
+    if args.policy is not None:
+        os.environ["OUTBOX_OVERFLOW_POLICY"] = args.policy
+
+    print(f"遅いクライアント: {args.slow}人（{args.slow_delay * 1000:.0f}ms/件）, 停止: {args.stalled}人, "
+          f"メッセージ: {args.messages}件")
+    for count in args.clients:
+        print(f"\n部屋の人数: {count}")
+        print(f"{'方式':<11} {'受信数':>9} {'p50ms':>8} {'p99ms':>8} {'最大ms':>8} {'所要秒':>7}")
+        clients = make_clients(count, args.slow, args.stalled, args.slow_delay)
+        started = time.perf_counter()
+        await run_sequential(clients, args.messages, args.interval, args.timeout)
+        report("sequential", clients, time.perf_counter() - started)
+
+        clients = make_clients(count, args.slow, args.stalled, args.slow_delay)
+        started = time.perf_counter()
+        stats = await run_outbox(clients, args.messages, args.interval)
+        report("outbox", clients, time.perf_counter() - started)
+        print(f"  破棄したメッセージ: {stats['dropped_messages']}, 切断: {stats['slow_disconnects']}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,78 @@
+"""チャット履歴のメモリ使用量の計測
+
+10,000件のメッセージを履歴に残したときのメモリ使用量を tracemalloc で計る。
+
+- dict: 受信したメッセージの dict をそのまま残した場合
+- ChatHistory: 送信済みの JSON 文字列を __slots__ のレコードに残す現在の実装
+
+    python benchmarks/chat_history_memory.py [--messages 10000] [--debates 1 20] [--content-chars 40]
+"""
+import argparse
+import gc
+import os
+import sys
+import tracemalloc
+from collections import deque
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import relay_messaging
+from chat_history import ChatHistory
+
+
+def make_message(i: int, content_chars: int) -> dict:
+    # 受信したメッセージと同じく、文字列を共有しない dict を JSON から作る
+    content = ("その主張には根拠となるデータが不足していると思います。" * 10)[:content_chars]
+    return relay_messaging.decode(relay_messaging.encode(
+        {"username": f"参加者{i % 6}", "content": f"{content}{i}", "timestamp": "2025/01/05 15:11:58"}
+    ))
+
+
+def measure(build) -> int:
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    kept = build()
+    gc.collect()
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    del kept
+    return used
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=10000)
+    parser.add_argument("--debates", type=int, nargs="+", default=[1, 20])
+    parser.add_argument("--content-chars", type=int, default=40)
+    args = parser.parse_args()
+
+    print(f"メッセージ: {args.messages}件, 本文: {args.content_chars}文字")
+    print(f"{'方式':<12} {'討論数':>6} {'合計KB':>9} {'1万件あたりKB':>14} {'1件あたりB':>11}")
+    for debates in args.debates:
+        per_debate = args.messages // debates
+
+        def build_dicts():
+            rooms = [deque(maxlen=per_debate) for _ in range(debates)]
+            for i in range(args.messages):
+                message = make_message(i, args.content_chars)
+                message["seq"] = i + 1
+                rooms[i % debates].append(message)
+            return rooms
+
+        def build_history():
+            history = ChatHistory(max_messages=per_debate, max_debates=debates)
+            for i in range(args.messages):
+                message = make_message(i, args.content_chars)
+                message["seq"] = history.next_seq()
+                history.append(f"debate-{i % debates}", message["seq"], relay_messaging.encode(message))
+            return history
+
+        for name, build in [("dict", build_dicts), ("ChatHistory", build_history)]:
+            used = measure(build)
+            print(f"{name:<12} {debates:>6} {used / 1024:>9.1f} {used / args.messages * 10000 / 1024:>14.1f} "
+                  f"{used / args.messages:>11.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+"""デコードエンジンの負荷試験
+
+同時に何本の音声ストリームを1プロセスでリアルタイム処理できるかを調べる。
+各ストリームは 0.512 秒分のチャンク（既定のCHUNK_SIZE相当）を実時間の間隔で投入する。
+
+    python benchmarks/decoder_load_test.py                      # 合成デコーダ（1チャンク60ms相当のCPU負荷）
+    python benchmarks/decoder_load_test.py --model model-large-ja  # 実際のVoskモデル
+"""
+import argparse
+import asyncio
+import hashlib
+import os
+import statistics
+import struct
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from decoding_engine import DecodingEngine  # noqa: E402
+
+SAMPLE_RATE = 16000
+CHUNK_SAMPLES = 8192
+CHUNK_SECONDS = CHUNK_SAMPLES / SAMPLE_RATE
+
+
+class SyntheticRecognizer:
+    # GILを解放するハッシュ計算で KaldiRecognizer 相当のCPU時間を消費する
+    _block = os.urandom(1 << 20)
+
+    def __init__(self, cost_ms: float):
+        self.cost = cost_ms / 1000
+        self.calls = 0
+
+    def AcceptWaveform(self, data: bytes) -> bool:
+        deadline = time.thread_time() + self.cost
+        while time.thread_time() < deadline:
+            hashlib.sha256(self._block).digest()
+        self.calls += 1
+        return self.calls % 4 == 0
+
+    def Result(self) -> str:
+        return '{"text": "final"}'
+
+    def PartialResult(self) -> str:
+        return '{"partial": "partial"}'
+
+
+class TimedRecognizer:
+    # チャンク先頭8バイトに埋め込んだ送信時刻から、投入〜認識完了までの遅延を測る
+    def __init__(self, inner, latencies: list):
+        self.inner = inner
+        self.latencies = latencies
+        self.lock = threading.Lock()
+
+    def AcceptWaveform(self, data: bytes) -> bool:
+        sent_at, = struct.unpack_from("d", data)
+        accepted = self.inner.AcceptWaveform(data)
+        with self.lock:
+            self.latencies.append(time.perf_counter() - sent_at)
+        return accepted
+
+    def Result(self) -> str:
+        return self.inner.Result()
+
+    def PartialResult(self) -> str:
+        return self.inner.PartialResult()
+
+
+def make_recognizer(args):
+    if args.model:
+        from vosk import KaldiRecognizer, Model
+        if not hasattr(make_recognizer, "model"):
+            make_recognizer.model = Model(args.model)
+        return KaldiRecognizer(make_recognizer.model, SAMPLE_RATE)
+    return SyntheticRecognizer(args.cost_ms)
+
+
+async def monitor_loop_lag(lags: list, stop: asyncio.Event):
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(0.01)
+        lags.append(time.perf_counter() - started - 0.01)
+
+
+async def run_stream(engine: DecodingEngine, args, latencies: list, duration: float):
+    async def on_result(result_type: str, text: str, queued_at: float):
+        pass
+
+    session = engine.open_session(TimedRecognizer(make_recognizer(args), latencies), on_result)
+    pcm = bytearray(os.urandom(CHUNK_SAMPLES * 2))
+    # 各ストリームの開始位相をずらす
+    await asyncio.sleep(CHUNK_SECONDS * (hash(id(session)) % 100) / 100)
+    next_at = time.perf_counter()
+    end_at = next_at + duration
+    while next_at < end_at:
+        struct.pack_into("d", pcm, 0, time.perf_counter())
+        await session.feed(bytes(pcm))
+        next_at += CHUNK_SECONDS
+        await asyncio.sleep(max(0.0, next_at - time.perf_counter()))
+    await session.close()
+    return session.dropped_chunks
+
+
+async def run_level(streams: int, args) -> dict:
+    engine = DecodingEngine(max_workers=args.workers, overflow_policy=args.policy)
+    latencies, lags = [], []
+    stop = asyncio.Event()
+    monitor = asyncio.create_task(monitor_loop_lag(lags, stop))
+    dropped = await asyncio.gather(*(run_stream(engine, args, latencies, args.duration) for _ in range(streams)))
+    stop.set()
+    await monitor
+    engine.shutdown()
+    latencies.sort()
+    return {
+        "streams": streams,
+        "p50_ms": statistics.median(latencies) * 1000,
+        "p95_ms": latencies[int(len(latencies) * 0.95) - 1] * 1000,
+        "dropped": sum(dropped),
+        "loop_lag_max_ms": max(lags) * 1000,
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 2)
+    parser.add_argument("--policy", choices=["drop_oldest", "block"], default="drop_oldest")
+    parser.add_argument("--cost-ms", type=float, default=60.0, help="合成デコーダの1チャンクあたりCPU時間")
+    parser.add_argument("--model", help="Voskモデルのディレクトリ（指定時は実際に認識する）")
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--max-streams", type=int, default=256)
+    args = parser.parse_args()
+
+    print(f"workers={args.workers} policy={args.policy} chunk={CHUNK_SECONDS:.3f}s")
+    print(f"{'streams':>8} {'p50 ms':>9} {'p95 ms':>9} {'dropped':>8} {'loop lag ms':>12}")
+    sustained = 0
+    streams = 1
+    while streams <= args.max_streams:
+        r = await run_level(streams, args)
+        print(f"{r['streams']:>8} {r['p50_ms']:>9.1f} {r['p95_ms']:>9.1f} {r['dropped']:>8} {r['loop_lag_max_ms']:>12.1f}")
+        # 遅延がチャンク長を超える・音声を捨てた時点でリアルタイム処理の限界とみなす
+        if r["dropped"] or r["p95_ms"] > CHUNK_SECONDS * 1000:
+            break
+        sustained = streams
+        streams *= 2
+    print(f"リアルタイムで処理できた最大ストリーム数: {sustained}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
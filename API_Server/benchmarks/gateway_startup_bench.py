@@ -0,0 +1,93 @@
+"""従来の起動方法とゲートウェイの起動時間・メモリ使用量の比較
+
+- today: start_servers.py --reload と同じく、サービスごとに uvicorn --reload を起動する
+  （監視用の親プロセスとサーバーのプロセスがサービスごとにできる）
+- gateway: gateway.py でパスの接頭辞にまとめて起動する
+
+起動から全サービスが応答するまでの秒数と、起動したプロセス全体の RSS/PSS の合計を表示する。
+model-large-ja がなければ speech（音声認識）を除いて比べる。
+
+    python benchmarks/gateway_startup_bench.py [--web-workers 1] [--speech-workers 1] [--settle 2]
+"""
+import argparse
+import os
+import signal
+import subprocess
+import sys
+import time
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+import gateway
+import speech_prefork
+import start_servers
+
+
+def measure(commands: list[str], probes: list[tuple[int, str]], settle: float) -> tuple[float, int, int, int]:
+    # (全サービスが応答するまでの秒数, プロセス数, RSS KB, PSS KB)
+    started = time.perf_counter()
+    processes = [
+        subprocess.Popen(command, shell=True, cwd=ROOT_DIR, start_new_session=True,
+                         stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        for command in commands
+    ]
+    try:
+        for port, path in probes:
+            if not speech_prefork.wait_until_ready("127.0.0.1", port, timeout=120, path=path):
+                raise RuntimeError(f"ポート {port} の {path} が応答しません")
+        elapsed = time.perf_counter() - started
+        # 起動直後の一時的な確保が落ち着くのを待ってから測る
+        time.sleep(settle)
+        pids = [pid for p in processes for pid in gateway.process_tree(p.pid)]
+        rss = pss = 0
+        for pid in pids:
+            r, s = speech_prefork.read_memory_kb(pid)
+            rss, pss = rss + r, pss + s
+        return elapsed, len(pids), rss, pss
+    finally:
+        for p in processes:
+            try:
+                os.killpg(p.pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        for p in processes:
+            p.wait()
+        # ゲートウェイのプロセスグループ（web / speech）はゲートウェイが止める
+        time.sleep(1)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--web-workers", type=int, default=1)
+    parser.add_argument("--speech-workers", type=int, default=1)
+    parser.add_argument("--settle", type=float, default=2.0, help="応答してからメモリを測るまでの秒数")
+    args = parser.parse_args()
+
+    services = list(gateway.SERVICES)
+    if not os.path.isdir(os.path.join(ROOT_DIR, "model-large-ja")):
+        print("model-large-ja がないため speech を除いて比べます")
+        services.remove("speech")
+
+    today = measure(
+        [start_servers.dev_command(s) for s in services],
+        [(start_servers.DEV_SERVERS[s][2], gateway.SERVICES[s][2]) for s in services],
+        args.settle,
+    )
+    speech_port = gateway.SPEECH_PORT if args.speech_workers else gateway.GATEWAY_PORT
+    unified = measure(
+        [f"{sys.executable} gateway.py --log-level warning --web-workers {args.web_workers} "
+         f"--speech-workers {args.speech_workers} --services {' '.join(services)}"],
+        [(speech_port if s == "speech" else gateway.GATEWAY_PORT, gateway.SERVICES[s][0] + gateway.SERVICES[s][2])
+         for s in services],
+        args.settle,
+    )
+
+    print(f"サービス: {', '.join(services)}, CPU コア数: {os.cpu_count()}")
+    print(f"{'起動方法':<10} {'起動秒':>8} {'プロセス':>8} {'RSS MB':>8} {'PSS MB':>8}")
+    for name, (elapsed, count, rss, pss) in (("today", today), ("gateway", unified)):
+        print(f"{name:<10} {elapsed:>8.2f} {count:>8} {rss / 1024:>8.1f} {pss / 1024:>8.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""ローカルの事前分析のスループット
+
+合成した発言（--messages 件、一部にポリシー違反の語句を含む）に対して、
+語句の検出方法ごとの1秒あたりの処理発言数を比べる。
+
+- naive: 語句ごとに `word in text` を繰り返す
+- regex: 全語句を1つの正規表現（選択）にまとめる
+- aho-corasick: PolicyChecker（語句は Aho-Corasick、パターンは結合した正規表現）
+- pre-analyzer: PreAnalyzer.analyze（検出 + 発言者の統計 + LLM に送るかの判定）
+
+    python benchmarks/pre_analysis_bench.py [--messages 20000] [--extra-words 0 500]
+"""
+import argparse
+import os
+import random
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from analysis_token_bench import make_messages  # noqa: E402
+from pre_analysis import PolicyChecker, PreAnalyzer, normalize  # noqa: E402
+
+POLICY_WORDS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "policy_words.json")
+
+
+def build_categories(extra_words: int) -> dict:
+    import json
+    with open(POLICY_WORDS, encoding="utf-8") as f:
+        categories = json.load(f)
+    # 実運用の語句リストの規模を想定して、出現しない語句を追加する
+    rng = random.Random(1)
+    kana = "アイウエオカキクケコサシスセソタチツテトナニヌネノ"
+    categories["extra"] = {"label": "追加", "words": [
+        "".join(rng.choice(kana) for _ in range(rng.randint(3, 6))) for _ in range(extra_words)
+    ]}
+    return categories
+
+
+def throughput(fn, texts: list[str]) -> float:
+    started = time.perf_counter()
+    for text in texts:
+        fn(text)
+    return len(texts) / (time.perf_counter() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=20000)
+    parser.add_argument("--extra-words", type=int, nargs="+", default=[0, 500])
+    args = parser.parse_args()
+
+    messages = make_messages(args.messages)
+    rng = random.Random(2)
+    for msg in messages:
+        if rng.random() < 0.05:
+            msg["content"] += rng.choice(["バカじゃないの", "お前は黙れ", "電話番号は090-1234-5678"])
+        if rng.random() < 0.2:
+            msg["content"] = rng.choice(["はい", "うん", "そうですね", "なるほど"])
+    texts = [msg["content"] for msg in messages]
+
+    print(f"発言数: {len(texts)}")
+    print(f"{'語句数':>6} {'naive':>10} {'regex':>10} {'aho-corasick':>13} {'pre-analyzer':>13}  (発言/秒)")
+    for extra in args.extra_words:
+        categories = build_categories(extra)
+        words = [normalize(w) for c in categories.values() for w in c.get("words", [])]
+        patterns = [re.compile(p) for c in categories.values() for p in c.get("patterns", [])]
+        alternation = re.compile("|".join(sorted(map(re.escape, words), key=len, reverse=True)))
+        checker = PolicyChecker(categories)
+
+        def naive(text):
+            text = normalize(text)
+            return [w for w in words if w in text] + [m.group() for p in patterns for m in p.finditer(text)]
+
+        def regex(text):
+            text = normalize(text)
+            return alternation.findall(text) + [m.group() for p in patterns for m in p.finditer(text)]
+
+        pre_analyzer = PreAnalyzer(checker)
+        rates = [
+            throughput(naive, texts),
+            throughput(regex, texts),
+            throughput(checker.check, texts),
+        ]
+        started = time.perf_counter()
+        for i in range(0, len(messages), 5):
+            pre_analyzer.analyze(f"debate-{i % 50}", messages[i:i + 5])
+        rates.append(len(messages) / (time.perf_counter() - started))
+        print(f"{len(words):>6} {rates[0]:>10.0f} {rates[1]:>10.0f} {rates[2]:>13.0f} {rates[3]:>13.0f}")
+        print(f"       次の分析に持ち越した短い発言: {pre_analyzer.deferred}/{len(messages)}, 警告: {pre_analyzer.warnings}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+"""バックプレーンのワーカー数ごとのメッセージ配信数の計測
+
+ブローカーと --workers 個のワーカープロセスを起動し、各ワーカーは --rooms 個の部屋に
+--clients 人ずつの模擬クライアント（送信処理が何もしない接続）を持つ。全ての部屋は全てのワーカーに
+またがり、各ワーカーが --messages 件ずつブロードキャストする。全てのワーカーが他のワーカーの
+メッセージを受け取り終えるまでの、クライアントへの配信数/秒を比べる。
+workers=1 (local) はバックプレーンを使わない1プロセスの場合。
+
+    python benchmarks/relay_backplane_bench.py [--workers 1 2 4] [--rooms 20] [--clients 5] [--messages 5000]
+"""
+import argparse
+import asyncio
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import relay_backplane
+import relay_messaging
+
+
+class FakeWebSocket:
+    def __init__(self):
+        self.received = 0
+
+    async def send_text(self, text: str):
+        self.received += 1
+
+
+def run_broker(path: str, ready):
+    async def main():
+        server = await relay_backplane.RelayBroker(path).start()
+        ready.set()
+        async with server:
+            await server.serve_forever()
+    asyncio.run(main())
+
+
+def run_worker(index: int, path, workers: int, rooms: int, clients: int, messages: int, barrier, results):
+    async def main():
+        if path is None:
+            backplane = relay_backplane.LocalBackplane("bench")
+        else:
+            backplane = relay_backplane.UnixSocketBackplane("bench", path)
+        sockets = {f"room{r}": [FakeWebSocket() for _ in range(clients)] for r in range(rooms)}
+        expected = messages * (workers - 1)
+        received = 0
+        done = asyncio.Event()
+
+        async def on_message(room, text, meta):
+            nonlocal received
+            await relay_messaging.broadcast_text(sockets[room], text)
+            received += 1
+            if received >= expected:
+                done.set()
+
+        backplane.on_message = on_message
+        await backplane.start()
+        await backplane.wait_connected(5)
+        for room, members in sockets.items():
+            for i in range(len(members)):
+                backplane.join(room, f"{index}-{i}")
+        await asyncio.get_running_loop().run_in_executor(None, barrier.wait)
+
+        started = time.perf_counter()
+        for i in range(messages):
+            room = f"room{i % rooms}"
+            text = relay_messaging.encode({"username": f"worker{index}", "content": f"メッセージ{i}", "seq": i})
+            await relay_messaging.broadcast_text(sockets[room], text)
+            await backplane.publish(room, text, seq=i)
+            if i % 100 == 0:
+                await asyncio.sleep(0)
+        if expected:
+            await asyncio.wait_for(done.wait(), 120)
+        elapsed = time.perf_counter() - started
+        results.put((sum(s.received for members in sockets.values() for s in members), elapsed))
+        await backplane.stop()
+    asyncio.run(main())
+
+
+def run(workers: int, use_broker: bool, args) -> tuple[int, float]:
+    path = os.path.join(tempfile.mkdtemp(), "relay.sock") if use_broker else None
+    broker = None
+    if use_broker:
+        ready = multiprocessing.Event()
+        broker = multiprocessing.Process(target=run_broker, args=(path, ready), daemon=True)
+        broker.start()
+        ready.wait(10)
+    barrier = multiprocessing.Barrier(workers)
+    results = multiprocessing.Queue()
+    processes = [
+        multiprocessing.Process(target=run_worker, args=(i, path, workers, args.rooms, args.clients,
+                                                          args.messages, barrier, results))
+        for i in range(workers)
+    ]
+    for p in processes:
+        p.start()
+    collected = [results.get(timeout=180) for _ in processes]
+    for p in processes:
+        p.join()
+    if broker is not None:
+        broker.terminate()
+    return sum(d for d, _ in collected), max(e for _, e in collected)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--rooms", type=int, default=20)
+    parser.add_argument("--clients", type=int, default=5, help="ワーカーごとの1部屋あたりのクライアント数")
+    parser.add_argument("--messages", type=int, default=5000, help="ワーカーごとのブロードキャスト数")
+    args = parser.parse_args()
+
+    print(f"CPU コア数: {os.cpu_count()}, 部屋: {args.rooms}, クライアント: {args.clients}/部屋/ワーカー, "
+          f"メッセージ: {args.messages}/ワーカー")
+    print(f"{'ワーカー':<12} {'配信数':>10} {'所要秒':>8} {'配信/秒':>10} {'メッセージ/秒':>12}")
+    for workers in args.workers:
+        modes = [("local", False)] if workers == 1 else []
+        modes.append(("unix", True))
+        for mode, use_broker in modes:
+            delivered, elapsed = run(workers, use_broker, args)
+            print(f"{f'{workers} ({mode})':<12} {delivered:>10} {elapsed:>8.2f} {delivered / elapsed:>10.0f} "
+                  f"{workers * args.messages / elapsed:>12.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""ブロードキャスト1回あたりの CPU 時間の比較
+
+chat / voice / video の各サービスが送るメッセージ（チャットの発言、ICE candidate、
+SDP を含む offer）を、部屋の人数ごとに次の方式で全員に送ったときの CPU 時間を計る。
+送信先は送信処理が何もしない starlette の WebSocket で、JSON の変換と送信呼び出しの分だけを計る。
+
+- send_json: 従来の実装。接続ごとに send_json で標準の json による変換をやり直す
+- relay(json): relay_messaging.broadcast で1回だけ標準の json で変換する
+- relay(orjson): relay_messaging.broadcast で1回だけ orjson で変換する（orjson がある場合）
+
+    python benchmarks/relay_broadcast_bench.py [--rooms 2 10 100] [--iterations 2000]
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from starlette.websockets import WebSocket, WebSocketState
+
+import relay_messaging
+
+SDP = "\r\n".join(
+    ["v=0", "o=- 4611731400430051336 2 IN IP4 127.0.0.1", "s=-", "t=0 0", "a=group:BUNDLE 0 1"]
+    + [f"a=rtpmap:{96 + i} VP8/90000\r\na=rtcp-fb:{96 + i} nack pli\r\na=fmtp:{96 + i} apt={100 + i}" for i in range(30)]
+)
+
+MESSAGES = {
+    "chat": {"username": "参加者1", "content": "その主張には根拠となるデータが不足していると思います。", "timestamp": "2025/01/05 15:11:58"},
+    "ice_candidate": {
+        "type": "ice_candidate",
+        "candidate": {"candidate": "candidate:842163049 1 udp 1677729535 203.0.113.7 54321 typ srflx raddr 192.168.1.10 rport 54321 generation 0", "sdpMid": "0", "sdpMLineIndex": 0},
+        "sender": "参加者1",
+    },
+    "offer": {"type": "offer", "sdp": {"type": "offer", "sdp": SDP}, "sender": "参加者1"},
+}
+
+
+async def _discard(message):
+    pass
+
+
+def make_socket() -> WebSocket:
+    websocket = WebSocket({"type": "websocket", "path": "/", "headers": []}, receive=None, send=_discard)
+    websocket.client_state = WebSocketState.CONNECTED
+    websocket.application_state = WebSocketState.CONNECTED
+    return websocket
+
+
+async def send_json_each(connections, message):
+    for connection in connections:
+        await connection.send_json(message)
+
+
+async def measure(broadcast, connections, message, iterations: int) -> float:
+    # ブロードキャスト1回あたりの CPU 時間（マイクロ秒）
+    started = time.process_time()
+    for _ in range(iterations):
+        await broadcast(connections, message)
+    return (time.process_time() - started) / iterations * 1e6
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rooms", type=int, nargs="+", default=[2, 10, 100])
+    parser.add_argument("--iterations", type=int, default=2000)
+    args = parser.parse_args()
+
+    methods = [("send_json", send_json_each, None), ("relay(json)", relay_messaging.broadcast, False)]
+    if relay_messaging.orjson is not None:
+        methods.append(("relay(orjson)", relay_messaging.broadcast, True))
+
+    print(f"{'メッセージ':<14} {'バイト':>6} {'人数':>4} " + " ".join(f"{name + ' µs':>16}" for name, _, _ in methods))
+    for name, message in MESSAGES.items():
+        size = len(relay_messaging.encode(message).encode())
+        for room in args.rooms:
+            connections = [make_socket() for _ in range(room)]
+            row = []
+            for _, broadcast, use_orjson in methods:
+                if use_orjson is not None:
+                    relay_messaging._use_orjson = use_orjson
+                await measure(broadcast, connections, message, args.iterations // 10)
+                row.append(await measure(broadcast, connections, message, args.iterations))
+            print(f"{name:<14} {size:>6} {room:>4} " + " ".join(f"{us:>16.1f}" for us in row))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,67 @@
+"""リソースの読み込み方法（RESOURCE_LOADING）ごとの起動時間の計測
+
+サービスを uvicorn で起動し、最初の応答（/ や /metrics）が返るまでと、/ready が 200 を
+返すまで（全てのリソースが使えるようになるまで）の秒数を比べる。eager は従来と同じく
+読み込み終えてから応答する。model-large-ja がなければ speech を除く。
+
+    python benchmarks/startup_readiness_bench.py [--services analysis speech] [--runs 3]
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+import gateway
+import speech_prefork
+
+PORT = 8099
+
+
+def measure(service: str, loading: str) -> tuple[float, float]:
+    # (最初の応答までの秒数, /ready が 200 になるまでの秒数)
+    _, module, health = gateway.SERVICES[service]
+    started = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", f"{module}:app", "--port", str(PORT), "--log-level", "warning"],
+        cwd=ROOT_DIR, env={**os.environ, "RESOURCE_LOADING": loading},
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        if not speech_prefork.wait_until_ready("127.0.0.1", PORT, timeout=120, path=health):
+            raise RuntimeError(f"{service} が応答しません")
+        healthy = time.perf_counter() - started
+        if not speech_prefork.wait_until_ready("127.0.0.1", PORT, timeout=120, path="/ready"):
+            raise RuntimeError(f"{service} の準備が終わりません")
+        return healthy, time.perf_counter() - started
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--services", nargs="+", choices=["analysis", "speech"], default=["analysis", "speech"])
+    parser.add_argument("--runs", type=int, default=3)
+    args = parser.parse_args()
+
+    services = list(args.services)
+    if "speech" in services and not os.path.isdir(os.path.join(ROOT_DIR, "model-large-ja")):
+        print("model-large-ja がないため speech を除きます")
+        services.remove("speech")
+
+    print(f"{'サービス':<10} {'読み込み':<12} {'最初の応答 秒':>14} {'/ready 秒':>10}  (中央値, {args.runs}回)")
+    for service in services:
+        for loading in ("eager", "background", "lazy"):
+            results = [measure(service, loading) for _ in range(args.runs)]
+            healthy = statistics.median(r[0] for r in results)
+            ready = statistics.median(r[1] for r in results)
+            print(f"{service:<10} {loading:<12} {healthy:>14.2f} {ready:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""文字起こし検索のベンチマーク
+
+合成した討論（1討論あたり --segments 件のセグメント）をストアに書き込み、
+転置インデックスでの検索と全記録の線形走査の応答時間を、討論数を変えて比較する。
+
+    python benchmarks/transcript_search_bench.py [--debates 100 1000 5000] [--segments 40]
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from transcript_index import TranscriptIndex, normalize  # noqa: E402
+from transcript_store import TranscriptStore  # noqa: E402
+
+WORDS = (
+    "議論 賛成 反対 意見 理由 根拠 環境 経済 教育 政策 税金 制度 社会 若者 高齢者 "
+    "地域 企業 技術 安全 自由 責任 問題 解決 必要 重要 影響 効果 データ 調査 結果 "
+    "です ます でし た という ので から けど しかし つまり 例えば 確かに 一方 ただ"
+).split()
+
+
+def make_text(rng: random.Random) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(rng.randint(5, 20)))
+
+
+def build_store(directory: str, debates: int, segments: int) -> TranscriptStore:
+    rng = random.Random(debates)
+    store = TranscriptStore(directory)
+    records = []
+    for d in range(debates):
+        for seq in range(segments):
+            records.append({
+                "debate_id": f"debate-{d:05d}",
+                "timestamp": f"2025-01-{1 + d % 28:02d}T{seq // 60 % 24:02d}:{seq % 60:02d}:00",
+                "seq": seq,
+                "text": make_text(rng),
+            })
+    store.append_many(records)
+    return store
+
+
+def linear_search(store: TranscriptStore, query: str, limit: int) -> int:
+    query = normalize(query)
+    hits = 0
+    for _, record in store.scan():
+        if query in normalize(record["text"]):
+            hits += 1
+            if hits >= limit:
+                break
+    return hits
+
+
+def measure(fn, queries) -> tuple[float, float]:
+    times = []
+    for q in queries:
+        started = time.perf_counter()
+        fn(q)
+        times.append((time.perf_counter() - started) * 1000)
+    times.sort()
+    return statistics.median(times), times[int(len(times) * 0.95) - 1]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--debates", type=int, nargs="+", default=[100, 1000, 5000])
+    parser.add_argument("--segments", type=int, default=40)
+    parser.add_argument("--queries", type=int, default=50)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    # 2語の連続（ヒットが少ない）と1語（ヒットが多い）を混ぜる
+    queries = [f"{rng.choice(WORDS)}{rng.choice(WORDS)}" if i % 2 else rng.choice(WORDS) for i in range(args.queries)]
+
+    print(f"{'討論数':>8} {'記録数':>8} {'索引構築 s':>10} {'索引 p50 ms':>12} {'索引 p95 ms':>12} {'走査 p50 ms':>12}")
+    for debates in args.debates:
+        with tempfile.TemporaryDirectory() as directory:
+            store = build_store(directory, debates, args.segments)
+            started = time.perf_counter()
+            index = TranscriptIndex(store)
+            build = time.perf_counter() - started
+            p50, p95 = measure(lambda q: index.search(q, limit=50), queries)
+            scan_p50, _ = measure(lambda q: linear_search(store, q, 50), queries[:5])
+            print(f"{debates:>8} {len(index):>8} {build:>10.2f} {p50:>12.2f} {p95:>12.2f} {scan_p50:>12.2f}")
+
+
+if __name__ == "__main__":
+    main()
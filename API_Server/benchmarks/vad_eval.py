@@ -0,0 +1,153 @@
+"""録音済みWAVファイルに対するVADのオフライン評価
+
+各ファイルをエンドポイントと同じチャンク長で StreamingVAD に流し、発話率・セグメント数・
+処理速度を表示する。--model を指定すると、全チャンクをデコードした場合と
+VADで非発話フレームを落とした場合のデコーダCPU時間と、最初の確定結果が出た位置を比較する。
+
+    python benchmarks/vad_eval.py recordings/*.wav [--model model-large-ja]
+
+入力は 16kHz・モノラルの PCM WAV（16bit または 32bit float）。
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import sys
+import time
+import wave
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from audio_conditioning import AudioConditioner  # noqa: E402
+from vad import StreamingVAD  # noqa: E402
+
+SAMPLE_RATE = 16000
+CHUNK_SAMPLES = 8192
+MIN_SILENCE_DURATION = 0.5
+
+
+def load_wav(path: Path) -> np.ndarray:
+    with wave.open(str(path), "rb") as f:
+        if f.getframerate() != SAMPLE_RATE or f.getnchannels() != 1:
+            raise ValueError(f"{path}: 16kHz・モノラルのみ対応しています")
+        raw = f.readframes(f.getnframes())
+        width = f.getsampwidth()
+    if width == 2:
+        return np.frombuffer(raw, dtype=np.int16).astype(np.float32) / 32768
+    if width == 4:
+        return np.frombuffer(raw, dtype=np.float32).copy()
+    raise ValueError(f"{path}: 未対応のサンプル幅です ({width}バイト)")
+
+
+def chunks_of(samples: np.ndarray):
+    for start in range(0, len(samples) - CHUNK_SAMPLES + 1, CHUNK_SAMPLES):
+        yield start, samples[start:start + CHUNK_SAMPLES]
+
+
+def evaluate_vad(samples: np.ndarray) -> dict:
+    vad = StreamingVAD()
+    segments = 0
+    in_segment = False
+    started = time.perf_counter()
+    for _, chunk in chunks_of(samples):
+        speech = vad.process(chunk)
+        if speech.any():
+            if not in_segment:
+                segments += 1
+            in_segment = True
+        elif vad.silence_seconds >= MIN_SILENCE_DURATION:
+            in_segment = False
+    elapsed = time.perf_counter() - started
+    duration = len(samples) / SAMPLE_RATE
+    return {
+        "duration_s": duration,
+        "speech_ratio": vad.stats()["speech_ratio"],
+        "segments": segments,
+        "realtime_factor": duration / elapsed if elapsed else float("inf"),
+    }
+
+
+def decode(samples: np.ndarray, model, use_vad: bool) -> dict:
+    from vosk import KaldiRecognizer
+
+    rec = KaldiRecognizer(model, SAMPLE_RATE)
+    conditioner = AudioConditioner(CHUNK_SAMPLES)
+    vad = StreamingVAD()
+    cpu = 0.0
+    first_final = None
+    texts = []
+    segment_has_speech = False
+
+    def accept(data: bytes, position: int, finalize: bool = False):
+        nonlocal cpu, first_final
+        started = time.process_time()
+        if finalize:
+            text = json.loads(rec.FinalResult()).get("text", "")
+            rec.Reset()
+        elif rec.AcceptWaveform(data):
+            text = json.loads(rec.Result()).get("text", "")
+        else:
+            text = ""
+        cpu += time.process_time() - started
+        if text.strip():
+            texts.append(text.strip())
+            if first_final is None:
+                first_final = position / SAMPLE_RATE
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        for start, chunk in chunks_of(samples):
+            end = start + CHUNK_SAMPLES
+            if use_vad:
+                speech = vad.process(chunk)
+                if not speech.any():
+                    if segment_has_speech and vad.silence_seconds >= MIN_SILENCE_DURATION:
+                        accept(b"", end, finalize=True)
+                        segment_has_speech = False
+                    continue
+                segment_has_speech = True
+                data = conditioner.condition(chunk, conditioner.rms(chunk))
+                data = data.reshape(-1, vad.frame_samples)[speech]
+            else:
+                data = conditioner.condition(chunk, conditioner.rms(chunk))
+            accept(data.tobytes(), end)
+        accept(b"", len(samples), finalize=True)
+
+    return {"cpu_s": cpu, "first_final_s": first_final, "text": " ".join(texts)}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("paths", nargs="+", help="WAVファイルまたはそれを含むディレクトリ")
+    parser.add_argument("--model", help="Voskモデルのディレクトリ（指定時はデコードも比較する）")
+    args = parser.parse_args()
+
+    files = []
+    for p in map(Path, args.paths):
+        files.extend(sorted(p.glob("*.wav")) if p.is_dir() else [p])
+
+    model = None
+    if args.model:
+        from vosk import Model
+        model = Model(args.model)
+
+    for path in files:
+        samples = load_wav(path)
+        r = evaluate_vad(samples)
+        print(f"{path.name}: {r['duration_s']:.1f}秒 発話率 {r['speech_ratio']:.1%} "
+              f"セグメント {r['segments']} 処理速度 {r['realtime_factor']:.0f}倍速")
+        if model is not None:
+            full = decode(samples, model, use_vad=False)
+            gated = decode(samples, model, use_vad=True)
+            for name, d in (("VADなし", full), ("VADあり", gated)):
+                first = f"{d['first_final_s']:.2f}秒" if d["first_final_s"] is not None else "なし"
+                print(f"  {name}: デコーダCPU {d['cpu_s']:.2f}秒 最初の確定結果 {first}")
+            print(f"  VADなし: {full['text']}")
+            print(f"  VADあり: {gated['text']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""ビデオ通話の参加1回あたりのシグナリングメッセージ数の計測
+
+N-1人がいる部屋に1人が参加し、メッシュ接続を作るまでのメッセージを模擬する。
+参加者は既存の全員に offer を送り、既存の全員が answer を返し、双方が相手ごとに
+--candidates 個の ICE 候補を送る。全クライアントが受信したメッセージ（フレーム）の数を比べる。
+
+- broadcast: 従来の実装。target を付けず、全てのメッセージを部屋の全員に送る
+- targeted: target を付けて相手だけに送る
+- targeted+batch: さらに ice_batch を有効にして ICE 候補をまとめて受け取る
+
+    python benchmarks/video_signaling_bench.py [--sizes 2 5 10 20] [--candidates 8]
+"""
+import argparse
+import asyncio
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import video_call_API
+
+
+class FakeWebSocket:
+    def __init__(self):
+        self.received = 0
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, text: str):
+        self.received += 1
+
+
+async def run(size: int, candidates: int, targeted: bool, ice_batch: bool) -> int:
+    manager = video_call_API.ConnectionManager()
+    sockets = {}
+    for i in range(size - 1):
+        sockets[f"user{i}"] = FakeWebSocket()
+        await manager.connect(sockets[f"user{i}"], "bench", f"user{i}", ice_batch)
+    before = sum(ws.received for ws in sockets.values())
+
+    newcomer = "newcomer"
+    sockets[newcomer] = FakeWebSocket()
+    await manager.connect(sockets[newcomer], "bench", newcomer, ice_batch)
+    peers = [user for user in sockets if user != newcomer]
+
+    def message(message_type: str, sender: str, target: str, **fields) -> dict:
+        data = {"type": message_type, **fields, "sender": sender}
+        if targeted:
+            data["target"] = target
+        return data
+
+    for peer in peers:
+        await manager.router.route("bench", newcomer, message("offer", newcomer, peer, sdp="v=0"))
+    for peer in peers:
+        await manager.router.route("bench", peer, message("answer", peer, newcomer, sdp="v=0"))
+    for i in range(candidates):
+        for peer in peers:
+            await manager.router.route("bench", newcomer, message("ice_candidate", newcomer, peer, candidate=f"c{i}"))
+            await manager.router.route("bench", peer, message("ice_candidate", peer, newcomer, candidate=f"c{i}"))
+    await asyncio.sleep(manager.router.window * 2 + 0.01)
+    return sum(ws.received for ws in sockets.values()) - before
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[2, 3, 5, 10, 15, 20])
+    parser.add_argument("--candidates", type=int, default=8, help="相手ごとに送る ICE 候補の数")
+    args = parser.parse_args()
+
+    modes = [("broadcast", False, False), ("targeted", True, False), ("targeted+batch", True, True)]
+    print(f"ICE 候補: {args.candidates}個/相手")
+    print(f"{'人数':>4} " + " ".join(f"{name:>15}" for name, _, _ in modes))
+    for size in args.sizes:
+        counts = [await run(size, args.candidates, targeted, ice_batch) for _, targeted, ice_batch in modes]
+        print(f"{size:>4} " + " ".join(f"{count:>15}" for count in counts))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
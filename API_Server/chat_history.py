@@ -0,0 +1,100 @@
+import os
+import time
+from collections import OrderedDict, deque
+from typing import Container, Optional
+
+# 討論ごとに残しておくメッセージの数
+CHAT_HISTORY_MAX_MESSAGES = int(os.environ.get("CHAT_HISTORY_MAX_MESSAGES", 500))
+# 履歴を残しておく討論の数
+CHAT_HISTORY_MAX_DEBATES = int(os.environ.get("CHAT_HISTORY_MAX_DEBATES", 1000))
+# 接続がなくなってからこの秒数だけ新しいメッセージのない討論の履歴を捨てる
+CHAT_HISTORY_TTL = float(os.environ.get("CHAT_HISTORY_TTL", 3600))
+
+
+class HistoryRecord:
+    """履歴の1メッセージ。送信した JSON 文字列をそのまま持ち、再送時に変換し直さない"""
+
+    __slots__ = ("seq", "text")
+
+    def __init__(self, seq: int, text: str):
+        self.seq = seq
+        self.text = text
+
+
+class DebateHistory:
+    __slots__ = ("records", "last_used")
+
+    def __init__(self, max_messages: int):
+        self.records: deque[HistoryRecord] = deque(maxlen=max_messages)
+        self.last_used = time.monotonic()
+
+
+class ChatHistory:
+    """討論ごとの直近のメッセージのリングバッファ
+
+    メッセージには討論やプロセスをまたいで単調に増える通し番号 seq を付ける。途中から参加した
+    クライアントや再接続したクライアントには、受け取った最後の seq（since）より後の
+    メッセージだけを送り直す。接続のない古い討論の履歴から捨てる。
+    """
+
+    def __init__(self, max_messages: int = CHAT_HISTORY_MAX_MESSAGES,
+                 max_debates: int = CHAT_HISTORY_MAX_DEBATES, ttl: float = CHAT_HISTORY_TTL):
+        self.max_messages = max_messages
+        self.max_debates = max_debates
+        self.ttl = ttl
+        self._debates: OrderedDict[str, DebateHistory] = OrderedDict()
+        self._seq = 0
+        self.replayed = 0
+        self.evicted = 0
+
+    def next_seq(self) -> int:
+        # マイクロ秒単位の時刻を元にするので、複数のプロセスで付けた番号も大小を比べられる
+        self._seq = max(self._seq + 1, time.time_ns() // 1000)
+        return self._seq
+
+    def observe(self, seq: int):
+        # 他のプロセスで付けた番号より後の番号を付けるようにする
+        self._seq = max(self._seq, seq)
+
+    def append(self, debate_id: str, seq: int, text: str, active: Container = ()):
+        history = self._debates.get(debate_id)
+        if history is None:
+            history = self._debates[debate_id] = DebateHistory(self.max_messages)
+        history.records.append(HistoryRecord(seq, text))
+        history.last_used = time.monotonic()
+        self._debates.move_to_end(debate_id)
+        self.evict(active)
+
+    def since(self, debate_id: str, since: Optional[int] = None) -> list[str]:
+        # since より後のメッセージを古い順に返す（since がなければ残っている全て）
+        history = self._debates.get(debate_id)
+        if history is None:
+            return []
+        history.last_used = time.monotonic()
+        self._debates.move_to_end(debate_id)
+        # 他のプロセスから届いたメッセージは seq の順に並ぶとは限らないので、全て確かめる
+        texts = [r.text for r in history.records if since is None or r.seq > since]
+        self.replayed += len(texts)
+        return texts
+
+    def evict(self, active: Container = ()):
+        # 接続中の討論（active に含まれる討論）は残す
+        now = time.monotonic()
+        over = len(self._debates) - self.max_debates
+        for debate_id, history in list(self._debates.items()):
+            if over <= 0 and now - history.last_used < self.ttl:
+                break
+            if debate_id in active:
+                continue
+            del self._debates[debate_id]
+            self.evicted += 1
+            over -= 1
+
+    def stats(self) -> dict:
+        return {
+            "debates": len(self._debates),
+            "messages": sum(len(h.records) for h in self._debates.values()),
+            "last_seq": self._seq,
+            "replayed": self.replayed,
+            "evicted_debates": self.evicted,
+        }
@@ -1,10 +1,20 @@
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect, HTTPException
+from fastapi import FastAPI, WebSocket, WebSocketDisconnect, HTTPException, Query
 from fastapi.middleware.cors import CORSMiddleware
-from typing import Dict, Set
+from starlette.websockets import WebSocketState
+from typing import Dict, Optional
+import asyncio
 import json
 import logging
+import time
 from datetime import datetime
 
+import relay_backplane
+import relay_messaging
+from chat_history import ChatHistory
+from connection_registry import ConnectionRegistry
+from connection_outbox import ConnectionOutbox
+from metrics import LatencyHistogram
+
 # ロギングの設定
 logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
@@ -22,22 +32,51 @@ app.add_middleware(
 
 class ConnectionManager:
     def __init__(self):
-        self.active_connections: Dict[str, Set[WebSocket]] = {}
+        # 接続ごとに送信キューと送信タスクを持ち、遅い接続が他の接続への配信を遅らせないようにする
+        self.active_connections: Dict[str, Dict[WebSocket, ConnectionOutbox]] = {}
+        # 討論ごとの、ブロードキャストから各接続への送信完了までの遅延
+        self.fanout_latency: Dict[str, LatencyHistogram] = {}
+        # 討論ごとの直近のメッセージ。途中から参加・再接続したクライアントに送り直す
+        self.history = ChatHistory()
+        # 同じ討論の、他のワーカープロセスの接続とメッセージをやり取りする
+        self.backplane = relay_backplane.create_backplane("chat")
+        self.backplane.on_message = self._on_remote_message
+        # 切断の後始末など、送信の失敗から始めたタスク（参照を持たないと実行中に消えることがある）
+        self._tasks: set = set()
+        self.dropped_messages = 0
+        self.slow_disconnects = 0
 
-    async def connect(self, websocket: WebSocket, debate_id: str):
+    async def connect(self, websocket: WebSocket, debate_id: str, since: Optional[int] = None):
         await websocket.accept()
+        await self.backplane.start()
         if debate_id not in self.active_connections:
-            self.active_connections[debate_id] = set()
-        self.active_connections[debate_id].add(websocket)
-        logger.info(f"Client connected to debate {debate_id}. Total connections: {len(self.active_connections[debate_id])}")
+            self.active_connections[debate_id] = {}
+            self.fanout_latency[debate_id] = LatencyHistogram()
+
+        def on_error(outbox, error):
+            logger.error(f"Error broadcasting to client: {error}")
+            self._spawn(self.disconnect(websocket, debate_id))
+
+        # 見逃したメッセージ（since より後、since がなければ残っている全て）を先に送る
+        backlog = self.history.since(debate_id, since)
+        self.active_connections[debate_id][websocket] = ConnectionOutbox(
+            websocket, self.fanout_latency[debate_id], on_error=on_error, backlog=backlog
+        )
+        self.backplane.join(debate_id, str(id(websocket)))
+        logger.info(f"Client connected to debate {debate_id}. Total connections: {len(self.active_connections[debate_id])}, replayed: {len(backlog)}")
 
     async def disconnect(self, websocket: WebSocket, debate_id: str):
         try:
             if debate_id in self.active_connections:
-                self.active_connections[debate_id].discard(websocket)
+                outbox = self.active_connections[debate_id].pop(websocket, None)
+                if outbox is not None:
+                    self.backplane.leave(debate_id, str(id(websocket)))
+                    self.dropped_messages += outbox.dropped
+                    await outbox.close()
                 if not self.active_connections[debate_id]:
                     del self.active_connections[debate_id]
-                logger.info(f"Client disconnected from debate {debate_id}. Remaining connections: {len(self.active_connections.get(debate_id, set()))}")
+                    self.fanout_latency.pop(debate_id, None)
+                logger.info(f"Client disconnected from debate {debate_id}. Remaining connections: {len(self.active_connections.get(debate_id, {}))}")
         except Exception as e:
             logger.error(f"Error in disconnect: {e}")
 
@@ -47,61 +86,117 @@ class ConnectionManager:
             return
 
         if debate_id in self.active_connections:
-            dead_connections = set()
-            for connection in self.active_connections[debate_id].copy():
-                if connection != sender_socket:  # 送信者には送り返さない
-                    try:
-                        await connection.send_json(message)
-                    except WebSocketDisconnect:
-                        dead_connections.add(connection)
-                    except Exception as e:
-                        logger.error(f"Error broadcasting to client: {e}")
-                        dead_connections.add(connection)
-
-            # 切断された接続を削除
-            for dead_connection in dead_connections:
-                await self.disconnect(dead_connection, debate_id)
+            # 再接続時の since に使う通し番号
+            message["seq"] = self.history.next_seq()
+            # 全員に同じ文字列を送るので、JSON への変換は1回だけ行う（send_json と同じ形式）
+            text = relay_messaging.encode(message)
+            self.history.append(debate_id, message["seq"], text, active=self.active_connections)
+            await self._deliver(text, debate_id, sender_socket)
+            await self.backplane.publish(debate_id, text, seq=message["seq"])
+
+    async def _on_remote_message(self, debate_id: str, text: str, meta: dict):
+        # 他のワーカープロセスで受け取ったメッセージ。このプロセスの履歴にも残す
+        self.history.observe(meta["seq"])
+        self.history.append(debate_id, meta["seq"], text, active=self.active_connections)
+        await self._deliver(text, debate_id, None)
+
+    async def _deliver(self, text: str, debate_id: str, sender_socket: Optional[WebSocket]):
+        if debate_id not in self.active_connections:
+            return
+        queued_at = time.perf_counter()
+        lagging = [
+            connection
+            for connection, outbox in list(self.active_connections[debate_id].items())
+            if connection != sender_socket and not outbox.put(text, queued_at)  # 送信者には送り返さない
+        ]
+
+        # 送信待ちが溜まりきった接続は切断する（OUTBOX_OVERFLOW_POLICY=disconnect の場合）
+        for connection in lagging:
+            logger.warning(f"Disconnecting slow client from debate {debate_id}")
+            self.slow_disconnects += 1
+            await self.disconnect(connection, debate_id)
+            self._spawn(self._close(connection))
+
+    def _spawn(self, coro):
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._task_done)
+
+    def _task_done(self, task: asyncio.Task):
+        self._tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.error(f"Error in connection cleanup: {task.exception()}")
+
+    @staticmethod
+    async def _close(websocket: WebSocket):
+        try:
+            await websocket.close(code=1013)
+        except Exception:
+            pass
+
+    def stats(self) -> dict:
+        return {
+            "dropped_messages": self.dropped_messages + sum(
+                outbox.dropped for connections in self.active_connections.values() for outbox in connections.values()
+            ),
+            "slow_disconnects": self.slow_disconnects,
+            "fanout_latency": {debate_id: h.snapshot() for debate_id, h in self.fanout_latency.items()},
+            "history": self.history.stats(),
+            "backplane": self.backplane.stats(),
+        }
 
 manager = ConnectionManager()
+# 接続の後始末とハートビート
+registry = ConnectionRegistry("chat")
 
 
 @app.websocket("/ws/debate/{debate_id}/")
-async def websocket_endpoint(websocket: WebSocket, debate_id: str):
-    await manager.connect(websocket, debate_id)
+async def websocket_endpoint(websocket: WebSocket, debate_id: str, since: Optional[int] = Query(None),
+                             heartbeat: bool = Query(False)):
+    # since: 最後に受け取ったメッセージの seq。指定するとそれより後のメッセージだけを送り直す
+    # heartbeat: サーバーからの ping を受け取り、応答がなければ切断してよいクライアント
+    await manager.connect(websocket, debate_id, since)
     
     try:
-        logger.debug(f"New connection established for debate: {debate_id}")
-        
-        while True:
-            try:
-                message = await websocket.receive_json()
-                if not isinstance(message, dict):
-                    logger.error(f"Invalid message format received: {message}")
-                    continue
-
-                # タイムスタンプの追加
-                message["timestamp"] = datetime.now().strftime("%Y/%m/%d %H:%M:%S")
-                logger.debug(f"Received message in debate {debate_id}: {message}")
-                
-                # メッセージのブロードキャスト
-                await manager.broadcast(message, debate_id, websocket)
-                
-            except WebSocketDisconnect:
-                logger.info("WebSocket disconnected")
-                await manager.disconnect(websocket, debate_id)
-                break
-            except json.JSONDecodeError as e:
-                logger.error(f"JSON decode error: {e}")
-            except Exception as e:
-                logger.error(f"Error processing message: {e}")
-                await manager.disconnect(websocket, debate_id)
-                break
+        # どの経路で終わっても接続を manager から外す
+        async with registry.track(debate_id, websocket, lambda: manager.disconnect(websocket, debate_id),
+                                  heartbeat=heartbeat) as entry:
+            logger.debug(f"New connection established for debate: {debate_id}")
+            
+            while True:
+                try:
+                    message = await relay_messaging.receive(websocket)
+                    if await registry.received(entry, message):
+                        continue
+                    if not isinstance(message, dict):
+                        logger.error(f"Invalid message format received: {message}")
+                        continue
+
+                    # タイムスタンプの追加
+                    message["timestamp"] = datetime.now().strftime("%Y/%m/%d %H:%M:%S")
+                    logger.debug(f"Received message in debate {debate_id}: {message}")
+                    
+                    # メッセージのブロードキャスト
+                    await manager.broadcast(message, debate_id, websocket)
+                    
+                except WebSocketDisconnect:
+                    logger.info("WebSocket disconnected")
+                    break
+                except json.JSONDecodeError as e:
+                    logger.error(f"JSON decode error: {e}")
+                except Exception as e:
+                    logger.error(f"Error processing message: {e}")
+                    break
                 
     except Exception as e:
         logger.error(f"Connection error: {e}")
-        await manager.disconnect(websocket, debate_id)
-        if websocket.client_state.CONNECTED:
-            await websocket.close()
+    finally:
+        if (websocket.client_state == WebSocketState.CONNECTED
+                and websocket.application_state == WebSocketState.CONNECTED):
+            try:
+                await websocket.close()
+            except Exception:
+                pass
 
 @app.get("/health")
 async def health_check():
@@ -111,5 +206,9 @@ async def health_check():
         "connections": {
             debate_id: len(connections) 
             for debate_id, connections in manager.active_connections.items()
-        }
+        },
+        # 全てのワーカープロセスの接続数（RELAY_BACKPLANE=unix の場合）
+        "cluster_connections": manager.backplane.rooms(),
+        "broadcast": manager.stats(),
+        "registry": registry.stats()
     }
\ No newline at end of file
@@ -0,0 +1,84 @@
+import asyncio
+import contextlib
+import os
+import time
+from collections import deque
+from typing import Callable, Iterable, Optional
+
+from metrics import LatencyHistogram
+
+# 接続ごとに溜めておける送信待ちメッセージの数
+OUTBOX_MAX_PENDING = int(os.environ.get("OUTBOX_MAX_PENDING", 256))
+# 送信待ちが上限に達した接続の扱い: drop_oldest（古いメッセージから捨てる）/ disconnect（切断する）
+OUTBOX_OVERFLOW_POLICY = os.environ.get("OUTBOX_OVERFLOW_POLICY", "drop_oldest")
+
+
+class ConnectionOutbox:
+    """接続ごとの送信キューと送信タスク
+
+    ブロードキャストは送信待ちに追加するだけで待たないため、遅い接続や止まった接続があっても
+    他の接続への配信は遅れない。送信待ちが max_pending に達したら policy に従って
+    古いメッセージを捨てるか、put() が False を返して呼び出し側に切断させる。
+    backlog（接続時に送り直す履歴など）は送信待ちの上限に数えず、他のメッセージより先に送る。
+    """
+
+    def __init__(self, websocket, latency: Optional[LatencyHistogram] = None,
+                 max_pending: int = OUTBOX_MAX_PENDING, policy: str = OUTBOX_OVERFLOW_POLICY,
+                 on_error: Optional[Callable[["ConnectionOutbox", Exception], None]] = None,
+                 backlog: Iterable[str] = ()):
+        self.websocket = websocket
+        self.latency = latency
+        self.max_pending = max_pending
+        self.policy = policy
+        self.on_error = on_error
+        self._backlog: deque = deque(backlog)
+        self._pending: deque = deque()
+        self._ready = asyncio.Event()
+        self.closed = False
+        self.sent = 0
+        self.dropped = 0
+        self._task = asyncio.create_task(self._run())
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    def put(self, text: str, queued_at: float) -> bool:
+        # queued_at はブロードキャストを始めた時刻（送信までの遅延を計るため）
+        if self.closed:
+            return False
+        if len(self._pending) >= self.max_pending:
+            if self.policy == "disconnect":
+                return False
+            self._pending.popleft()
+            self.dropped += 1
+        self._pending.append((text, queued_at))
+        self._ready.set()
+        return True
+
+    async def _run(self):
+        try:
+            while self._backlog:
+                await self.websocket.send_text(self._backlog.popleft())
+                self.sent += 1
+            while True:
+                if not self._pending:
+                    self._ready.clear()
+                    await self._ready.wait()
+                    continue
+                text, queued_at = self._pending.popleft()
+                await self.websocket.send_text(text)
+                self.sent += 1
+                if self.latency is not None:
+                    self.latency.observe(time.perf_counter() - queued_at)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.closed = True
+            if self.on_error is not None:
+                self.on_error(self, e)
+
+    async def close(self):
+        self.closed = True
+        self._task.cancel()
+        with contextlib.suppress(asyncio.CancelledError, Exception):
+            await self._task
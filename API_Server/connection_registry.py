@@ -0,0 +1,137 @@
+import asyncio
+import contextlib
+import inspect
+import os
+import time
+from typing import Any, Callable, Optional
+
+from starlette.websockets import WebSocketState
+
+import relay_messaging
+
+# ハートビートを有効にした接続に、この秒数だけ何も受信しなかったら ping を送る
+HEARTBEAT_INTERVAL = float(os.environ.get("HEARTBEAT_INTERVAL", 20))
+# ハートビートを有効にした接続から、この秒数だけ何も受信しなかったら切断する
+IDLE_TIMEOUT = float(os.environ.get("IDLE_TIMEOUT", 60))
+# 接続を見回る間隔（秒）
+REAPER_INTERVAL = float(os.environ.get("REAPER_INTERVAL", 5))
+
+
+class ConnectionEntry:
+    __slots__ = ("room", "key", "websocket", "cleanup", "heartbeat", "connected_at", "last_seen",
+                 "ping_sent_at", "closed")
+
+    def __init__(self, room: str, key: Any, websocket, cleanup: Callable, heartbeat: bool):
+        self.room = room
+        self.key = key
+        self.websocket = websocket
+        self.cleanup = cleanup
+        self.heartbeat = heartbeat
+        self.connected_at = self.last_seen = time.monotonic()
+        self.ping_sent_at: Optional[float] = None
+        self.closed = False
+
+
+class ConnectionRegistry:
+    """中継サービス（chat / voice / video）の接続の登録と後始末
+
+    track() で登録した接続は、エンドポイントがどの経路で終わっても cleanup を1回だけ呼ぶ。
+    見回りのタスクが、切断済みなのに残っている接続と、ハートビートを有効にして接続した
+    （heartbeat=true）のに idle_timeout 秒以上何も送ってこない接続を切断して後始末する。
+    ハートビートを有効にした接続には、heartbeat_interval 秒ごとに {"type": "ping"} を送り、
+    その接続からの {"type": "ping"} には {"type": "pong"} を返す。ハートビートを有効にしていない
+    接続の ping / pong は通常のメッセージとしてアプリに渡す。
+    """
+
+    def __init__(self, service: str, heartbeat_interval: float = HEARTBEAT_INTERVAL,
+                 idle_timeout: float = IDLE_TIMEOUT, reaper_interval: float = REAPER_INTERVAL):
+        self.service = service
+        self.heartbeat_interval = heartbeat_interval
+        self.idle_timeout = idle_timeout
+        self.reaper_interval = reaper_interval
+        self._entries: dict[int, ConnectionEntry] = {}
+        self._reaper: Optional[asyncio.Task] = None
+        self.pings_sent = 0
+        self.reaped_idle = 0
+        self.reaped_stale = 0
+        self.cleanup_errors = 0
+
+    @contextlib.asynccontextmanager
+    async def track(self, room: str, websocket, cleanup: Callable, key: Any = None, heartbeat: bool = False):
+        # cleanup は同期関数でも async 関数でもよい
+        entry = ConnectionEntry(room, key, websocket, cleanup, heartbeat)
+        self._entries[id(entry)] = entry
+        if self._reaper is None or self._reaper.done():
+            self._reaper = asyncio.create_task(self._reap_forever())
+        try:
+            yield entry
+        finally:
+            await self.release(entry)
+
+    async def release(self, entry: ConnectionEntry):
+        if entry.closed:
+            return
+        entry.closed = True
+        self._entries.pop(id(entry), None)
+        try:
+            result = entry.cleanup()
+            if inspect.isawaitable(result):
+                await result
+        except Exception as e:
+            self.cleanup_errors += 1
+            print(f"{self.service}: 接続の後始末中にエラー: {e}")
+
+    async def received(self, entry: ConnectionEntry, data) -> bool:
+        """受信したメッセージを記録する。ハートビートの ping / pong なら True を返す（他の接続には送らない）"""
+        entry.last_seen = time.monotonic()
+        entry.ping_sent_at = None
+        if entry.heartbeat and isinstance(data, dict) and data.get("type") in ("ping", "pong"):
+            if data["type"] == "ping":
+                await entry.websocket.send_text(relay_messaging.encode({"type": "pong"}))
+            return True
+        return False
+
+    async def _reap_forever(self):
+        while self._entries:
+            await asyncio.sleep(self.reaper_interval)
+            await self.reap()
+        self._reaper = None
+
+    async def reap(self):
+        now = time.monotonic()
+        for entry in list(self._entries.values()):
+            websocket = entry.websocket
+            if (websocket.client_state == WebSocketState.DISCONNECTED
+                    or websocket.application_state == WebSocketState.DISCONNECTED):
+                self.reaped_stale += 1
+                await self.release(entry)
+                continue
+            if not entry.heartbeat:
+                continue
+            idle = now - entry.last_seen
+            if idle >= self.idle_timeout:
+                print(f"{self.service}: 部屋 {entry.room} の接続から{idle:.0f}秒間応答がないため切断します")
+                self.reaped_idle += 1
+                await self.release(entry)
+                with contextlib.suppress(Exception):
+                    await websocket.close(code=1001)
+            elif idle >= self.heartbeat_interval and entry.ping_sent_at is None:
+                entry.ping_sent_at = now
+                self.pings_sent += 1
+                try:
+                    await websocket.send_text(relay_messaging.encode({"type": "ping"}))
+                except Exception:
+                    self.reaped_stale += 1
+                    await self.release(entry)
+
+    def stats(self) -> dict:
+        rooms = {entry.room for entry in self._entries.values()}
+        return {
+            "live_rooms": len(rooms),
+            "live_sockets": len(self._entries),
+            "heartbeat_sockets": sum(1 for entry in self._entries.values() if entry.heartbeat),
+            "pings_sent": self.pings_sent,
+            "reaped_idle": self.reaped_idle,
+            "reaped_stale": self.reaped_stale,
+            "cleanup_errors": self.cleanup_errors,
+        }
@@ -1,17 +1,29 @@
 # debate_analysis_API.py
 import traceback
-from fastapi import FastAPI, WebSocket
+from fastapi import FastAPI, WebSocket, Query
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.websockets import WebSocketDisconnect
-from openai import OpenAI
 
 import json
-import asyncio
+import hashlib
 from datetime import datetime
 import os
+import time
 from pathlib import Path
+from typing import Optional
 
-app = FastAPI()
+from analysis_cache import AnalysisCache, cache_key
+from analysis_engine import RollingAnalysisEngine
+from analysis_hub import AnalysisHub
+from analysis_scheduler import AnalysisScheduler
+from pre_analysis import PolicyChecker, PreAnalyzer
+from metrics import LatencyHistogram
+from service_resources import ServiceResources
+from tool_stream import ToolArgumentsParser
+
+# OpenAI クライアントは import 時ではなく lifespan で作る（RESOURCE_LOADING）
+resources = ServiceResources("analysis")
+app = FastAPI(lifespan=resources.lifespan)
 
 # CORSミドルウェア設定
 app.add_middleware(
@@ -27,8 +39,56 @@ ROOT_DIR = Path(__file__).parent.absolute()
 with open(os.path.join(ROOT_DIR, "analysis_conf.json")) as f:
     CONFIGS = json.load(f)
 
-# OpenAIクライアントの初期化
-client = OpenAI(api_key=CONFIGS['OPENAI.API_KEY'])
+# 1回の分析で送るプロンプトの上限（概算トークン数）と、文脈として残す直近の発言数
+TOKEN_BUDGET = int(CONFIGS.get('ANALYSIS.TOKEN_BUDGET', 3000))
+WINDOW_MESSAGES = int(CONFIGS.get('ANALYSIS.WINDOW_MESSAGES', 20))
+# LLM の同時呼び出し数の上限（全体 / 討論ごと）
+MAX_CONCURRENCY = int(CONFIGS.get('ANALYSIS.MAX_CONCURRENCY', 8))
+PER_DEBATE_CONCURRENCY = int(CONFIGS.get('ANALYSIS.PER_DEBATE_CONCURRENCY', 1))
+# 接続時に ?stream= を指定しなかった場合に、分析結果をフィールドごとに送るかどうか
+STREAM_BY_DEFAULT = bool(CONFIGS.get('ANALYSIS.STREAM', False))
+# 分析結果のキャッシュ（件数・有効期限（秒）・SQLite ファイル。ファイルを指定しなければメモリのみ）
+CACHE_SIZE = int(CONFIGS.get('ANALYSIS.CACHE_SIZE', 1024))
+CACHE_TTL = float(CONFIGS.get('ANALYSIS.CACHE_TTL', 3600))
+CACHE_PATH = CONFIGS.get('ANALYSIS.CACHE_PATH')
+# 分析を始める条件（溜まった発言数 / 最後の発言からの無発言時間（秒） / 最初の発言からの最大待ち時間（秒））
+TRIGGER_MESSAGES = int(CONFIGS.get('ANALYSIS.TRIGGER_MESSAGES', 5))
+IDLE_SECONDS = float(CONFIGS.get('ANALYSIS.IDLE_SECONDS', 2.0))
+MAX_DELAY = float(CONFIGS.get('ANALYSIS.MAX_DELAY', 10.0))
+# 新しい発言で古くなった実行中の分析を取り消すかどうか
+CANCEL_STALE = bool(CONFIGS.get('ANALYSIS.CANCEL_STALE', True))
+# ローカルの事前分析で使うポリシー違反の語句リストと、LLM の分析を始める発言の最小文字数
+# （これより短い発言は捨てずに、次に分析する発言と一緒に送る）
+POLICY_WORDS_PATH = os.path.join(ROOT_DIR, CONFIGS.get('ANALYSIS.POLICY_WORDS', 'policy_words.json'))
+MIN_MESSAGE_CHARS = int(CONFIGS.get('ANALYSIS.MIN_MESSAGE_CHARS', 8))
+
+# OpenAIクライアントの初期化（OPENAI.BASE_URL で互換サーバーを指定できる）
+# 非同期クライアントで接続をプールし、同時呼び出しの上限と同じ数だけ接続を保持する
+def create_client():
+    # openai の import 自体に時間がかかるので、クライアントを作るときに import する
+    import httpx
+    from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+
+    return AsyncOpenAI(
+        api_key=CONFIGS['OPENAI.API_KEY'],
+        base_url=CONFIGS.get('OPENAI.BASE_URL'),
+        http_client=DefaultAsyncHttpxClient(
+            limits=httpx.Limits(max_connections=MAX_CONCURRENCY, max_keepalive_connections=MAX_CONCURRENCY)
+        ),
+    )
+
+client = resources.add("openai_client", create_client)
+
+SYSTEM_PROMPT = (
+    "あなたは議長です。"
+    "以下のポリシーに従って、議論を分析し、要約してください。"
+    "議長ポリシー："
+    "- 感情的にならず、中立的であること"
+    "- 論理的で批判的な視点を持つこと"
+    "- 議論メンバーの意見を適切に要約、批判、評価すること"
+    "- 議題から外れた発言があれば指摘すること"
+    "- これまでの議論の要約が与えられた場合は、新しい発言を踏まえて要約を更新すること"
+)
 
 TOOLS = [
     {
@@ -67,37 +127,37 @@ TOOLS = [
     }
 ]
 
-async def analyze_debate_content(messages):
+# プロンプトかツール定義を変えると、キャッシュ済みの結果は使われなくなる
+PROMPT_VERSION = hashlib.blake2b(
+    (SYSTEM_PROMPT + json.dumps(TOOLS, ensure_ascii=False, sort_keys=True)).encode("utf-8"), digest_size=8
+).hexdigest()
+
+# 分析の開始から最初のフィールドが届くまで / 分析が完了するまでの時間（ストリーミングの有無別）
+ANALYSIS_BUCKETS_MS = (100, 250, 500, 1000, 2000, 4000, 8000, 15000, 30000)
+analysis_latency = {
+    mode: {"first_field": LatencyHistogram(ANALYSIS_BUCKETS_MS), "complete": LatencyHistogram(ANALYSIS_BUCKETS_MS)}
+    for mode in ("stream", "batch")
+}
+
+async def request_analysis(chat_messages, on_field=None):
+    # on_field を渡した場合はストリーミングで受け取り、完成したフィールドから順に渡す
+    started = time.perf_counter()
     try:
-        formatted_messages = "\n".join([
-            f"{msg['author']}: {msg['content']}" 
-            for msg in messages
-        ])
+        if on_field is not None:
+            result = await stream_analysis(chat_messages, on_field, started)
+            analysis_latency["stream"]["complete"].observe(time.perf_counter() - started)
+            return result
 
-        response = await asyncio.to_thread(
-            client.chat.completions.create,
+        api = await client.get()
+        response = await api.chat.completions.create(
             model=CONFIGS['OPENAI.CHAT_MODEL'],
-            messages=[
-                {
-                    "role": "system",
-                    "content": (
-                        "あなたは議長です。"
-                        "以下のポリシーに従って、議論を分析し、要約してください。"
-                        "議長ポリシー："
-                        "- 感情的にならず、中立的であること"
-                        "- 論理的で批判的な視点を持つこと"
-                        "- 議論メンバーの意見を適切に要約、批判、評価すること"
-                        "- 議題から外れた発言があれば指摘すること"
-                    )
-                },
-                {
-                    "role": "user",
-                    "content": f"次の議論を分析してください：\n{formatted_messages}"
-                }
-            ],
+            messages=chat_messages,
             tools=TOOLS,
             temperature=0.7,
         )
+        elapsed = time.perf_counter() - started
+        analysis_latency["batch"]["first_field"].observe(elapsed)
+        analysis_latency["batch"]["complete"].observe(elapsed)
 
         if response.choices[0].message.tool_calls:
             return json.loads(response.choices[0].message.tool_calls[0].function.arguments)
@@ -106,17 +166,82 @@ async def analyze_debate_content(messages):
     except Exception as e:
         print(f"分析エラー: {str(e)}")
         return {"error": str(e)}
-        
 
+async def stream_analysis(chat_messages, on_field, started):
+    api = await client.get()
+    stream = await api.chat.completions.create(
+        model=CONFIGS['OPENAI.CHAT_MODEL'],
+        messages=chat_messages,
+        tools=TOOLS,
+        temperature=0.7,
+        stream=True,
+    )
+    parser = ToolArgumentsParser()
+    content = []
+    first_field = True
+    async for chunk in stream:
+        if not chunk.choices:
+            continue
+        delta = chunk.choices[0].delta
+        if delta.content:
+            content.append(delta.content)
+        for call in delta.tool_calls or []:
+            # 最初のツール呼び出し（analyze_discussion）の引数だけを読む
+            if call.index != 0 or call.function is None or not call.function.arguments:
+                continue
+            for key, value in parser.feed(call.function.arguments):
+                if first_field:
+                    analysis_latency["stream"]["first_field"].observe(time.perf_counter() - started)
+                    first_field = False
+                await on_field(key, value)
+
+    if parser.text:
+        return parser.result()
+    return {"summary": "".join(content)}
+
+# 討論ごとに直前の要約と直近の発言を保持し、新しい発言の差分だけを送る
+analysis_engine = RollingAnalysisEngine(
+    request_analysis,
+    SYSTEM_PROMPT,
+    token_budget=TOKEN_BUDGET,
+    window_messages=WINDOW_MESSAGES,
+    max_concurrency=MAX_CONCURRENCY,
+    per_debate_concurrency=PER_DEBATE_CONCURRENCY,
+)
+
+# 同じ発言の並びに対する分析結果は、再接続したクライアントや他のワーカーでも使い回す
+analysis_cache = AnalysisCache(
+    CACHE_SIZE,
+    CACHE_TTL,
+    os.path.join(ROOT_DIR, CACHE_PATH) if CACHE_PATH else None,
+)
+# RESOURCE_WARM_CACHE=1 なら、起動時に SQLite に保存済みの分析結果をメモリに読み込む
+resources.add_warmer("analysis_cache", analysis_cache.warm)
+
+# 討論ごとに発言を溜め、まとめて分析する
+analysis_scheduler = AnalysisScheduler(
+    analysis_engine,
+    trigger_messages=TRIGGER_MESSAGES,
+    idle_seconds=IDLE_SECONDS,
+    max_delay=MAX_DELAY,
+    cancel_stale=CANCEL_STALE,
+)
+# 発言ごとにポリシー違反の語句と発言者の統計をローカルで調べ、すぐに配信する
+pre_analyzer = PreAnalyzer(PolicyChecker.from_file(POLICY_WORDS_PATH), min_chars=MIN_MESSAGE_CHARS)
+# 同じ討論の全接続に1つの分析結果を配信する
+analysis_hub = AnalysisHub(analysis_scheduler, analysis_cache, pre_analyzer)
 
 
 @app.websocket("/ws/debate/analysis/{debate_id}/")
-async def websocket_endpoint(websocket: WebSocket, debate_id: str):
+async def websocket_endpoint(websocket: WebSocket, debate_id: str, stream: Optional[bool] = Query(None)):
     await websocket.accept()
     print(f"Analysis WebSocket connected: {debate_id}")
-    
-    # 既に分析したメッセージを追跡するセットを追加
-    analyzed_messages = set()
+    if stream is None:
+        stream = STREAM_BY_DEFAULT
+
+    # 分析結果は討論のハブから配信される（最新の結果があればすぐに送られる）
+    # ストリーミング時は完成したフィールドも analysis_field として順に届く
+    await analysis_hub.join(debate_id, websocket, websocket.send_json, stream)
     
     try:
         while True:
@@ -124,32 +249,29 @@ async def websocket_endpoint(websocket: WebSocket, debate_id: str):
             print(f"受信データ: {data}") 
             messages = data.get("messages", [])
             
-            # メッセージの一意性を確認するためのハッシュを生成
-            message_hashes = [hash((msg['content'], msg['author'], msg['timestamp'])) for msg in messages]
-            
-            # 未分析のメッセージのみを処理
-            unique_messages = [
-                msg for msg, msg_hash in zip(messages, message_hashes) 
-                if msg_hash not in analyzed_messages
-            ]
-            
-            if unique_messages:
-                print(f"ディベート {debate_id} のメッセージを分析中")
-                print(f"メッセージ: {unique_messages}")
-                analysis_result = await analyze_debate_content(unique_messages)
-
-                print(f"分析結果: {analysis_result}") 
-                
-                # 分析済みメッセージのハッシュを追加
-                analyzed_messages.update(message_hashes)
-                
-                # 分析結果を送信
-                await websocket.send_json({
-                    "type": "analysis",
-                    "result": analysis_result,
-                    "timestamp": datetime.now().isoformat()
-                })
-                print(f"ディベート {debate_id} の分析を送信")
+            if not messages:
+                print("新しいメッセージがないため分析をスキップ")
+                continue
+
+            # 同じ発言の並びを分析済みなら LLM を呼ばずにキャッシュの結果を返す
+            key = cache_key(messages, CONFIGS['OPENAI.CHAT_MODEL'], PROMPT_VERSION)
+            cached = await analysis_cache.get(key)
+            if cached is not None:
+                print(f"ディベート {debate_id} のキャッシュ済みの分析を使用")
+                analysis_hub.mark_seen(debate_id, messages)
+                # 接続時に再送した最新の結果と同じなら送り直さない
+                if cached != analysis_hub.latest(debate_id):
+                    await websocket.send_json({
+                        "type": "analysis",
+                        "result": cached,
+                        "timestamp": datetime.now().isoformat()
+                    })
+                continue
+
+            # 分析済みの発言（この接続や他の閲覧者が送ったもの）は討論のハブが除く
+            added = await analysis_hub.publish(debate_id, messages, key)
+            if added:
+                print(f"ディベート {debate_id} のメッセージを分析待ちに追加: {added}件")
             else:
                 print("新しいメッセージがないため分析をスキップ")
     
@@ -158,9 +280,30 @@ async def websocket_endpoint(websocket: WebSocket, debate_id: str):
     except Exception as e:
         print(f"ディベート {debate_id} の詳細な分析エラー: {traceback.format_exc()}")
     finally:
+        analysis_hub.leave(debate_id, websocket)
         if not websocket.client_state.DISCONNECTED:
             await websocket.close()
 
+@app.get("/ready")
+async def read_ready():
+    # OpenAI クライアントを作り終えるまでは 503
+    return resources.ready_response()
+
+@app.get("/metrics")
+async def read_metrics():
+    return {
+        "resources": resources.status(),
+        "analysis": analysis_engine.stats(),
+        "cache": analysis_cache.stats(),
+        "debates": analysis_scheduler.stats(),
+        "hub": analysis_hub.stats(),
+        "pre_analysis": pre_analyzer.stats(),
+        "latency": {
+            mode: {name: histogram.snapshot() for name, histogram in histograms.items()}
+            for mode, histograms in analysis_latency.items()
+        }
+    }
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8005)
\ No newline at end of file
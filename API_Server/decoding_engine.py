@@ -0,0 +1,229 @@
+import asyncio
+import json
+import os
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Awaitable, Callable, Optional
+
+from metrics import LatencyHistogram
+
+# Vosk(Kaldi)のデコードはCPUバウンドなので、イベントループではなく専用スレッドプールで実行する
+# （vosk は cffi 経由で呼び出されるため、デコード中は GIL が解放される）
+DECODER_WORKERS = int(os.environ.get("DECODER_WORKERS", os.cpu_count() or 2))
+# セッションごとに溜めておける未処理の音声チャンク数（block のとき）
+DECODER_MAX_PENDING = int(os.environ.get("DECODER_MAX_PENDING", 8))
+# 溢れたときの方針 "drop_oldest": デコードが遅れたときだけ古い音声を捨てる / "block": 空きが出るまで受信を止める
+DECODER_OVERFLOW_POLICY = os.environ.get("DECODER_OVERFLOW_POLICY", "drop_oldest")
+# drop_oldest で捨て始める未処理の音声の長さ（秒）。溜まっていた音声をまとめて受信しただけでは捨てず、
+# デコードが実時間に追いつかずにこれだけ遅れたときだけ古い音声から捨てる
+DECODER_MAX_QUEUED_SECONDS = float(os.environ.get("DECODER_MAX_QUEUED_SECONDS", 10.0))
+# デコーダに渡す音声（16kHz・16bit モノラル）の1秒あたりのバイト数
+AUDIO_BYTES_PER_SECOND = 16000 * 2
+
+# (種類, テキスト, 元になった処理を投入した時刻) を受け取るコールバック
+ResultCallback = Callable[[str, str, float], Awaitable[None]]
+
+
+def decode_chunk(rec, data: bytes) -> Optional[tuple[str, str]]:
+    # ワーカースレッド上で1チャンクを認識し、("final" | "partial", テキスト) を返す
+    if rec.AcceptWaveform(data):
+        result = json.loads(rec.Result())
+        text = result.get('text', '').strip()
+        if text:
+            return "final", text
+    else:
+        partial = json.loads(rec.PartialResult())
+        text = partial.get('partial', '').strip()
+        if text:
+            return "partial", text
+    return None
+
+
+def finalize_segment(rec) -> Optional[tuple[str, str]]:
+    # セグメント境界: 残っている仮説を確定させてから認識器を初期状態に戻す
+    result = json.loads(rec.FinalResult())
+    rec.Reset()
+    text = result.get('text', '').strip()
+    if text:
+        return "final", text
+    return None
+
+
+class DecoderSession:
+    """1本の音声ストリーム。投入された処理は到着順に1つずつワーカーで実行される"""
+
+    def __init__(self, engine: "DecodingEngine", rec, on_result: ResultCallback, name: str):
+        self.engine = engine
+        self.rec = rec
+        self.name = name
+        self.on_result = on_result
+        self.dropped_chunks = 0
+        # このセッションのデコードに使ったワーカー時間（秒）
+        self.decode_seconds = 0.0
+        self._pending: deque = deque()
+        self._audio_pending = 0
+        self._audio_bytes = 0
+        self._wakeup = asyncio.Event()
+        self._space = asyncio.Event()
+        self._closed = False
+        # 現在のセグメントの最初の音声を投入した時刻と、最初の結果を返したかどうか
+        self._segment_started: Optional[float] = None
+        self._segment_answered = False
+        self._task = asyncio.create_task(self._run())
+
+    @property
+    def pending(self) -> int:
+        return self._audio_pending
+
+    async def feed(self, data: bytes, received_at: Optional[float] = None):
+        # 音声チャンクを投入する。溢れた場合は方針に従って待つか古い音声を捨てる
+        # received_at は音声を受信した時刻（perf_counter）で、結果のコールバックにそのまま渡される
+        if self.engine.overflow_policy == "block":
+            while self._audio_pending >= self.engine.max_pending:
+                self._space.clear()
+                await self._space.wait()
+        else:
+            max_bytes = self.engine.max_queued_seconds * AUDIO_BYTES_PER_SECOND
+            while self._audio_pending and self._audio_bytes + len(data) > max_bytes:
+                self._drop_oldest_audio()
+        self._audio_pending += 1
+        self._audio_bytes += len(data)
+        self._put(("audio", data), received_at)
+
+    async def end_segment(self):
+        # 投入済みの音声の後でセグメントを確定し、認識器をリセットする
+        self._put(("segment_end", finalize_segment))
+
+    async def submit(self, fn: Callable):
+        # fn(rec) をワーカー上で実行する。戻り値が (種類, テキスト) なら結果として通知する
+        self._put(("call", fn))
+
+    async def close(self):
+        # 残りの処理をすべて終えてからセッションを閉じる
+        if not self._closed:
+            self._closed = True
+            self._put(("close", None))
+        await self._task
+
+    def _put(self, item, at: Optional[float] = None):
+        kind, payload = item
+        self._pending.append((kind, payload, at if at is not None else time.perf_counter()))
+        self._wakeup.set()
+
+    def _drop_oldest_audio(self):
+        for i, (kind, payload, _) in enumerate(self._pending):
+            if kind == "audio":
+                del self._pending[i]
+                self._audio_pending -= 1
+                self._audio_bytes -= len(payload)
+                self.dropped_chunks += 1
+                self.engine.chunks_dropped += 1
+                return
+
+    async def _run(self):
+        self.engine.active_sessions += 1
+        try:
+            while True:
+                if not self._pending:
+                    self._wakeup.clear()
+                    await self._wakeup.wait()
+                    continue
+
+                kind, payload, queued_at = self._pending.popleft()
+                if kind == "close":
+                    break
+                if kind == "audio":
+                    self._audio_pending -= 1
+                    self._audio_bytes -= len(payload)
+                    self._space.set()
+                    if self._segment_started is None:
+                        self._segment_started = queued_at
+
+                try:
+                    if kind == "audio":
+                        result, elapsed = await self.engine.run(decode_chunk, self.rec, payload)
+                    else:
+                        result, elapsed = await self.engine.run(payload, self.rec)
+                    self.decode_seconds += elapsed
+                except Exception as e:
+                    print(f"デコードエラー [{self.name}]: {str(e)}")
+                    continue
+
+                if result and self._segment_started is not None and not self._segment_answered:
+                    self._segment_answered = True
+                    self.engine.first_result_latency.observe(time.perf_counter() - self._segment_started)
+                if kind == "segment_end":
+                    self._segment_started = None
+                    self._segment_answered = False
+
+                if result:
+                    try:
+                        await self.on_result(*result, queued_at)
+                    except Exception as e:
+                        print(f"認識結果の送信エラー [{self.name}]: {str(e)}")
+        finally:
+            self.engine.active_sessions -= 1
+
+
+class DecodingEngine:
+    """全セッションで共有するデコード用スレッドプール"""
+
+    def __init__(self, max_workers: int = DECODER_WORKERS, max_pending: int = DECODER_MAX_PENDING,
+                 overflow_policy: str = DECODER_OVERFLOW_POLICY,
+                 max_queued_seconds: float = DECODER_MAX_QUEUED_SECONDS):
+        if overflow_policy not in ("drop_oldest", "block"):
+            raise ValueError(f"不明なオーバーフロー方針です: {overflow_policy}")
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.overflow_policy = overflow_policy
+        self.max_queued_seconds = max_queued_seconds
+        # スレッドは最初の投入時に作る（pre-fork 後のプロセスでも安全に使えるように）
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self.active_sessions = 0
+        self.decode_calls = 0
+        self.chunks_dropped = 0
+        self.decode_seconds = 0.0
+        # セグメントの最初の音声を受け取ってから最初の認識結果が出るまでの時間
+        self.first_result_latency = LatencyHistogram()
+
+    def open_session(self, rec, on_result: ResultCallback, name: str = "") -> DecoderSession:
+        return DecoderSession(self, rec, on_result, name)
+
+    async def run(self, fn: Callable, *args) -> tuple:
+        # fn(*args) をワーカーで実行し、(戻り値, 実行時間) を返す
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="vosk-decoder")
+        loop = asyncio.get_running_loop()
+        result, elapsed, error = await loop.run_in_executor(self._executor, self._timed, fn, args)
+        # 統計はワーカースレッドではなくイベントループで更新する（スレッド間で競合しないように）
+        self.decode_seconds += elapsed
+        self.decode_calls += 1
+        if error is not None:
+            raise error
+        return result, elapsed
+
+    @staticmethod
+    def _timed(fn: Callable, args: tuple) -> tuple:
+        started = time.perf_counter()
+        try:
+            return fn(*args), time.perf_counter() - started, None
+        except Exception as e:
+            return None, time.perf_counter() - started, e
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.max_workers,
+            "overflow_policy": self.overflow_policy,
+            "max_queued_seconds": self.max_queued_seconds,
+            "active_sessions": self.active_sessions,
+            "decode_calls": self.decode_calls,
+            "chunks_dropped": self.chunks_dropped,
+            "avg_decode_ms": round(self.decode_seconds / self.decode_calls * 1000, 3) if self.decode_calls else 0.0,
+            "first_result_latency": self.first_result_latency.snapshot(),
+        }
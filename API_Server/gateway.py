@@ -0,0 +1,238 @@
+"""全サービスをパスの接頭辞でまとめた ASGI ゲートウェイと本番用の起動
+
+start_servers.py --reload のようにサービスごとの uvicorn（ファイル監視付き）を5つ起動する代わりに、
+各サービスの app を1つのアプリにマウントし、負荷の種類ごとのプロセスグループで動かす。
+ファイルの監視（--reload）は行わない。
+
+- web: chat / voice / video / analysis（I/O 待ちが中心）。1つのイベントループを共有する
+- speech: 音声認識。Vosk のデコードで CPU を使うので、web の応答を遅らせないよう別の
+  プロセスグループ（別のポート）で動かす。モデルはグループのマスターで1回だけ読み込んで fork する
+- analysis: web のワーカーが2つ以上のときは、1ワーカーの別グループ（別のポート）で動かす。
+  討論ごとの分析のまとめ（ハブとスケジューラー）はプロセス内にあるので、同じ討論の閲覧者が
+  ワーカーに分かれると、閲覧者の数だけ LLM を呼んでしまうため
+
+    python gateway.py --web-workers 2 --speech-workers 4 --report
+
+接頭辞: /chat, /speech, /voice, /video, /analysis（例: ws://host:8001/chat/ws/debate/1/）
+--speech-workers 0 なら speech も web のプロセスにマウントし、1つのポートで全サービスを提供する。
+web のワーカーが2つ以上のときは RELAY_BACKPLANE=unix にしてバックプレーンのブローカーも起動する
+（部屋の参加者がワーカーに分かれても全員に届くようにするため）。
+
+従来の起動方法との起動時間・メモリ使用量の比較は benchmarks/gateway_startup_bench.py で計測できる。
+"""
+import argparse
+import contextlib
+import gc
+import importlib
+import os
+import signal
+import sys
+import time
+
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse
+from starlette.routing import Mount, Route
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import speech_prefork
+
+# サービス名 -> (接頭辞, モジュール, 応答確認に使うパス)
+SERVICES = {
+    "chat": ("/chat", "chat_websocket", "/health"),
+    "speech": ("/speech", "voice_recognition_websocket", "/"),
+    "voice": ("/voice", "voice_chat_API", "/health"),
+    "video": ("/video", "video_call_API", "/health"),
+    "analysis": ("/analysis", "debate_analysis_API", "/metrics"),
+}
+# バックプレーンで部屋を共有する中継サービス
+RELAY_SERVICES = ("chat", "voice", "video")
+
+GATEWAY_PORT = int(os.environ.get("GATEWAY_PORT", 8001))
+SPEECH_PORT = int(os.environ.get("GATEWAY_SPEECH_PORT", 8002))
+ANALYSIS_PORT = int(os.environ.get("GATEWAY_ANALYSIS_PORT", 8003))
+# 負荷の種類ごとのワーカー数
+WEB_WORKERS = int(os.environ.get("GATEWAY_WEB_WORKERS", 1))
+SPEECH_WORKERS = int(os.environ.get("GATEWAY_SPEECH_WORKERS", os.cpu_count() or 1))
+
+
+def create_app(services) -> Starlette:
+    """services の app を接頭辞でマウントしたアプリを作る"""
+    apps = {name: importlib.import_module(SERVICES[name][1]).app for name in services}
+
+    @contextlib.asynccontextmanager
+    async def lifespan(app):
+        # マウントしたアプリの起動・終了処理は Starlette が呼ばないので、ここでまとめて呼ぶ
+        async with contextlib.AsyncExitStack() as stack:
+            for mounted in apps.values():
+                await stack.enter_async_context(mounted.router.lifespan_context(mounted))
+            yield
+
+    async def read_root(request):
+        return JSONResponse({"status": "OK", "services": {name: SERVICES[name][0] for name in apps}})
+
+    routes = [Route("/", read_root)]
+    routes.extend(Mount(SERVICES[name][0], app=mounted) for name, mounted in apps.items())
+    return Starlette(routes=routes, lifespan=lifespan)
+
+
+def run_group(services, host: str, port: int, workers: int, log_level: str):
+    # 自分のプロセスグループを作る。端末の Ctrl+C はゲートウェイのマスターだけが受け取る
+    os.setpgid(0, 0)
+    if "speech" in services:
+        # デコード用スレッドはコア数をワーカーで分け合う（明示的に指定されていればそれを使う）
+        os.environ.setdefault("DECODER_WORKERS", str(max(1, (os.cpu_count() or 1) // workers)))
+    app = create_app(services)
+    sock = speech_prefork.listen(host, port)
+    if workers == 1:
+        speech_prefork.run_worker(sock, app, log_level)
+        return
+    # モデルなどのリソースはワーカーで共有するため、lifespan を待たずにマスターで読み込む
+    for name in services:
+        resources = getattr(sys.modules[SERVICES[name][1]], "resources", None)
+        if resources is not None:
+            resources.load_sync()
+    # fork 前に既存オブジェクトを GC の対象外にし、ワーカーでのページ複製を減らす
+    gc.collect()
+    gc.freeze()
+    speech_prefork.supervise(sock, app, workers, log_level)
+
+
+def run_broker():
+    import asyncio
+    import relay_backplane
+
+    os.setpgid(0, 0)
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    try:
+        asyncio.run(relay_backplane.serve(relay_backplane.RELAY_BACKPLANE_PATH))
+    except RuntimeError as e:
+        # 既に起動しているブローカーを使う
+        print(e)
+    except KeyboardInterrupt:
+        pass
+
+
+def fork(target, *args) -> int:
+    pid = os.fork()
+    if pid == 0:
+        try:
+            target(*args)
+        finally:
+            os._exit(0)
+    return pid
+
+
+def process_tree(pid: int) -> list[int]:
+    # pid とその子孫のプロセス
+    children: dict[int, list[int]] = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        children.setdefault(ppid, []).append(int(entry))
+    tree, stack = [], [pid]
+    while stack:
+        current = stack.pop()
+        tree.append(current)
+        stack.extend(children.get(current, ()))
+    return tree
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=GATEWAY_PORT, help="web のポート")
+    parser.add_argument("--speech-port", type=int, default=SPEECH_PORT)
+    parser.add_argument("--analysis-port", type=int, default=ANALYSIS_PORT,
+                        help="web のワーカーが2つ以上のときに analysis を動かすポート")
+    parser.add_argument("--web-workers", type=int, default=WEB_WORKERS)
+    parser.add_argument("--speech-workers", type=int, default=SPEECH_WORKERS,
+                        help="0 なら speech を web のプロセスで動かす")
+    parser.add_argument("--services", nargs="+", choices=list(SERVICES), default=list(SERVICES))
+    parser.add_argument("--log-level", default="info")
+    parser.add_argument("--report", action="store_true", help="起動時間とメモリ使用量を表示する")
+    args = parser.parse_args(argv)
+
+    started = time.perf_counter()
+    web = [name for name in args.services if name != "speech" or args.speech_workers == 0]
+    # 分析は討論ごとに1つのプロセスでまとめる必要があるので、web を複数ワーカーにするなら分ける
+    pin_analysis = args.web_workers > 1 and "analysis" in web
+    if pin_analysis:
+        web.remove("analysis")
+    # (名前, サービス, ポート, ワーカー数)
+    groups = []
+    if web:
+        groups.append(("web", web, args.port, max(1, args.web_workers)))
+    if pin_analysis:
+        groups.append(("analysis", ["analysis"], args.analysis_port, 1))
+    if "speech" in args.services and args.speech_workers > 0:
+        groups.append(("speech", ["speech"], args.speech_port, args.speech_workers))
+
+    children = {}
+    if args.web_workers > 1 and any(name in RELAY_SERVICES for name in web):
+        os.environ.setdefault("RELAY_BACKPLANE", "unix")
+    if os.environ.get("RELAY_BACKPLANE") == "unix":
+        children[fork(run_broker)] = "broker"
+    for name, services, port, workers in groups:
+        print(f"{name}: {', '.join(SERVICES[s][0] for s in services)} をポート {port} で起動します（ワーカー {workers}）")
+        children[fork(run_group, services, args.host, port, workers, args.log_level)] = name
+
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+
+    if args.report:
+        probe_host = "127.0.0.1" if args.host in ("0.0.0.0", "") else args.host
+        for name, services, port, _ in groups:
+            for service in services:
+                prefix, _, path = SERVICES[service]
+                if not speech_prefork.wait_until_ready(probe_host, port, path=prefix + path):
+                    print(f"{service} が応答しません")
+        print(f"起動完了（全サービスの最初の応答まで）: {time.perf_counter() - started:.2f}秒")
+        print(f"{'グループ':<8} {'プロセス':>8} {'RSS MB':>8} {'PSS MB':>8}")
+        total_rss = total_pss = 0
+        for pid, name in children.items():
+            pids = process_tree(pid)
+            rss = pss = 0
+            for p in pids:
+                r, s = speech_prefork.read_memory_kb(p)
+                rss, pss = rss + r, pss + s
+            total_rss, total_pss = total_rss + rss, total_pss + pss
+            print(f"{name:<8} {len(pids):>8} {rss / 1024:>8.1f} {pss / 1024:>8.1f}")
+        print(f"合計: RSS {total_rss / 1024:.1f} MB, PSS {total_pss / 1024:.1f} MB")
+
+    # どれかのグループが落ちたら全体を止める（プロセスの再起動は systemd などに任せる）
+    status = 0
+    while children:
+        try:
+            pid, _ = os.wait()
+        except ChildProcessError:
+            break
+        except InterruptedError:
+            continue
+        name = children.pop(pid, None)
+        # ブローカーは既に別のブローカーが起動していれば終了する
+        if not stopping and name not in (None, "broker"):
+            print(f"{name} が終了したため全てのサービスを停止します")
+            status = 1
+            stop(None, None)
+    sys.exit(status)
+
+
+if __name__ == "__main__":
+    main()
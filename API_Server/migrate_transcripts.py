@@ -0,0 +1,63 @@
+"""既存の speech_recognition_*.json を TranscriptStore に取り込む
+
+旧形式のファイルには debate_id が含まれないため、--debate-id で指定した値
+（既定は "legacy"）で登録し、元のファイル名を source として残す。
+取り込んだファイルは二重に取り込まないよう text/migrated/ に移動する（--keep で移動しない）。
+
+    python migrate_transcripts.py [--debate-id legacy] [--keep]
+"""
+import argparse
+import json
+import os
+import shutil
+from pathlib import Path
+
+from transcript_store import TranscriptStore
+
+ROOT_DIR = Path(__file__).parent.absolute()
+TEXT_DIR = os.path.join(ROOT_DIR, "text")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--text-dir", default=TEXT_DIR)
+    parser.add_argument("--debate-id", default="legacy")
+    parser.add_argument("--keep", action="store_true", help="取り込んだファイルを移動せずに残す")
+    args = parser.parse_args()
+
+    files = sorted(Path(args.text_dir).glob("speech_recognition_*.json"))
+    if not files:
+        print("取り込むファイルがありません")
+        return
+
+    records = []
+    imported = []
+    for path in files:
+        try:
+            with open(path, encoding="utf-8") as f:
+                data = json.load(f)
+            records.append({
+                "debate_id": args.debate_id,
+                "timestamp": data["timestamp"],
+                "text": data["text"],
+                "source": path.name,
+            })
+            imported.append(path)
+        except (OSError, json.JSONDecodeError, KeyError) as e:
+            print(f"スキップしました {path.name}: {str(e)}")
+
+    records.sort(key=lambda r: r["timestamp"])
+    store = TranscriptStore(os.path.join(args.text_dir, "store"))
+    store.append_many(records)
+    print(f"{len(records)}件を取り込みました")
+
+    if not args.keep:
+        migrated_dir = os.path.join(args.text_dir, "migrated")
+        os.makedirs(migrated_dir, exist_ok=True)
+        for path in imported:
+            shutil.move(str(path), os.path.join(migrated_dir, path.name))
+        print(f"取り込んだファイルを {migrated_dir} に移動しました")
+
+
+if __name__ == "__main__":
+    main()
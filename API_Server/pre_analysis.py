@@ -0,0 +1,219 @@
+import json
+import re
+import unicodedata
+from collections import OrderedDict, deque
+from typing import Optional
+
+
+def normalize(text: str) -> str:
+    # 全角・半角や大文字・小文字の違いをなくす
+    return unicodedata.normalize("NFKC", text).lower()
+
+
+class AhoCorasick:
+    """複数の語を1回の走査で探す Aho-Corasick オートマトン"""
+
+    def __init__(self, words):
+        # 状態ごとの遷移・失敗遷移・その状態で見つかる語
+        self._goto: list[dict] = [{}]
+        self._fail: list[int] = [0]
+        self._out: list[tuple] = [()]
+        for word in words:
+            self._add(word)
+        self._build()
+
+    def _add(self, word: str):
+        state = 0
+        for c in word:
+            nxt = self._goto[state].get(c)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto[state][c] = nxt
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append(())
+            state = nxt
+        self._out[state] += (word,)
+
+    def _build(self):
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for c, nxt in self._goto[state].items():
+                queue.append(nxt)
+                fail = self._fail[state]
+                while fail and c not in self._goto[fail]:
+                    fail = self._fail[fail]
+                target = self._goto[fail].get(c, 0)
+                self._fail[nxt] = target if target != nxt else 0
+                self._out[nxt] += self._out[self._fail[nxt]]
+
+    def finditer(self, text: str):
+        # (終了位置, 語) を見つかった順に返す
+        goto, fail, out = self._goto, self._fail, self._out
+        state = 0
+        for i, c in enumerate(text):
+            while state and c not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(c, 0)
+            if out[state]:
+                for word in out[state]:
+                    yield i + 1, word
+
+
+class PolicyChecker:
+    """ポリシー違反の語句を検出する
+
+    カテゴリごとの語句は1つの Aho-Corasick オートマトンにまとめ、正規表現は1つに結合して、
+    発言ごとにそれぞれ1回だけ走査する。
+    """
+
+    def __init__(self, categories: dict):
+        self.labels = {name: c.get("label", name) for name, c in categories.items()}
+        self._category_of: dict[str, list[str]] = {}
+        for name, c in categories.items():
+            for word in c.get("words", []):
+                self._category_of.setdefault(normalize(word), []).append(name)
+        self._automaton = AhoCorasick(self._category_of)
+        patterns = [
+            f"(?P<{name}_{i}>{pattern})"
+            for name, c in categories.items() for i, pattern in enumerate(c.get("patterns", []))
+        ]
+        self._pattern = re.compile("|".join(patterns)) if patterns else None
+
+    @classmethod
+    def from_file(cls, path: str) -> "PolicyChecker":
+        with open(path, encoding="utf-8") as f:
+            return cls(json.load(f))
+
+    def check(self, text: str) -> list[tuple[str, str]]:
+        # (カテゴリ, 一致した語句) を返す
+        text = normalize(text)
+        hits = []
+        seen = set()
+        for _, word in self._automaton.finditer(text):
+            for name in self._category_of[word]:
+                if (name, word) not in seen:
+                    seen.add((name, word))
+                    hits.append((name, word))
+        if self._pattern is not None:
+            for m in self._pattern.finditer(text):
+                hits.append((m.lastgroup.rsplit("_", 1)[0], m.group()))
+        return hits
+
+
+class SpeakerStats:
+    """討論ごとの発言者別の発言回数と文字数"""
+
+    def __init__(self):
+        self.turns: dict[str, int] = {}
+        self.chars: dict[str, int] = {}
+        self.total_chars = 0
+        self.last_author: Optional[str] = None
+
+    def add(self, author: str, content: str):
+        # 同じ発言者の連続した発言は1回の発言（ターン）として数える
+        if author != self.last_author:
+            self.turns[author] = self.turns.get(author, 0) + 1
+            self.last_author = author
+        self.chars[author] = self.chars.get(author, 0) + len(content)
+        self.total_chars += len(content)
+
+    def talk_share(self) -> dict[str, float]:
+        if not self.total_chars:
+            return {}
+        return {author: round(n / self.total_chars, 3) for author, n in self.chars.items()}
+
+    def snapshot(self) -> dict:
+        return {"turns": dict(self.turns), "talk_share": self.talk_share()}
+
+
+class PreAnalyzer:
+    """LLM に送る前に発言ごとに行うローカルの分析
+
+    ポリシー違反の語句と発言の偏りを検出して即座に警告し、発言者別の統計を更新する。
+    短い発言（相づちや「反対です」など）だけでは LLM を呼ばず、討論ごとに取っておいて
+    次に分析する発言と一緒に発言順のまま送る。取っておくのは討論ごとに max_held 件まで。
+    """
+
+    def __init__(self, checker: PolicyChecker, min_chars: int = 8, dominance_share: float = 0.6,
+                 dominance_min_turns: int = 10, max_debates: int = 1000, max_held: int = 50):
+        self.checker = checker
+        self.min_chars = min_chars
+        self.dominance_share = dominance_share
+        self.dominance_min_turns = dominance_min_turns
+        self.max_debates = max_debates
+        self.max_held = max_held
+        self._stats: OrderedDict[str, SpeakerStats] = OrderedDict()
+        # 討論ごとの、まだ LLM に送っていない短い発言
+        self._held: dict[str, list[dict]] = {}
+        self.messages = 0
+        self.warnings = 0
+        self.deferred = 0
+        self.held_dropped = 0
+
+    def stats_for(self, debate_id: str) -> SpeakerStats:
+        stats = self._stats.get(debate_id)
+        if stats is None:
+            stats = self._stats[debate_id] = SpeakerStats()
+            while len(self._stats) > self.max_debates:
+                old_id, _ = self._stats.popitem(last=False)
+                self._held.pop(old_id, None)
+        self._stats.move_to_end(debate_id)
+        return stats
+
+    def analyze(self, debate_id: str, messages: list[dict]) -> tuple[list[dict], list[dict]]:
+        # (警告, LLM に送る発言) を返す
+        stats = self.stats_for(debate_id)
+        warnings = []
+        held = self._held.setdefault(debate_id, [])
+        substantive = False
+        for msg in messages:
+            author, content = str(msg.get("author", "")), str(msg.get("content", ""))
+            stats.add(author, content)
+            self.messages += 1
+            for category, match in self.checker.check(content):
+                label = self.checker.labels[category]
+                warnings.append({
+                    "author": author,
+                    "category": category,
+                    "match": match,
+                    "message": f"{author}さんの発言に{label}の可能性があります: 「{match}」",
+                })
+            held.append(msg)
+            if len(content.strip()) >= self.min_chars:
+                substantive = True
+
+        if substantive:
+            # 取っておいた短い発言も、文脈として発言順のまま一緒に送る
+            worth = held
+            del self._held[debate_id]
+        else:
+            worth = []
+            self.deferred += len(messages)
+            if len(held) > self.max_held:
+                self.held_dropped += len(held) - self.max_held
+                del held[:len(held) - self.max_held]
+
+        share = stats.talk_share()
+        total_turns = sum(stats.turns.values())
+        if total_turns >= self.dominance_min_turns:
+            for author in {str(msg.get("author", "")) for msg in messages}:
+                if share.get(author, 0) > self.dominance_share:
+                    warnings.append({
+                        "author": author,
+                        "category": "dominance",
+                        "match": None,
+                        "message": f"{author}さんの発言が全体の{share[author]:.0%}を占めています",
+                    })
+        self.warnings += len(warnings)
+        return warnings, worth
+
+    def stats(self) -> dict:
+        return {
+            "messages": self.messages,
+            "warnings": self.warnings,
+            "deferred_messages": self.deferred,
+            "held_messages": sum(len(h) for h in self._held.values()),
+            "held_dropped": self.held_dropped,
+        }
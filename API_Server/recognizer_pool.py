@@ -0,0 +1,52 @@
+import asyncio
+import os
+from collections import deque
+from typing import Callable
+
+# 待機させておく認識器の上限と、起動時に作っておく数
+RECOGNIZER_POOL_SIZE = int(os.environ.get("RECOGNIZER_POOL_SIZE", 8))
+RECOGNIZER_POOL_PREWARM = int(os.environ.get("RECOGNIZER_POOL_PREWARM", 2))
+
+
+class RecognizerPool:
+    """KaldiRecognizer を作り直さずに使い回すためのプール
+
+    返却される認識器は FinalResult()/Reset() で初期状態に戻してあること。
+    acquire/release はイベントループ上からのみ呼び出す。
+    """
+
+    def __init__(self, factory: Callable, max_idle: int = RECOGNIZER_POOL_SIZE):
+        self._factory = factory
+        self.max_idle = max_idle
+        self._idle: deque = deque()
+        self.hits = 0
+        self.misses = 0
+        self.discarded = 0
+
+    def prewarm(self, count: int = RECOGNIZER_POOL_PREWARM):
+        while len(self._idle) < min(count, self.max_idle):
+            self._idle.append(self._factory())
+
+    async def acquire(self):
+        if self._idle:
+            self.hits += 1
+            return self._idle.pop()
+        # 新規作成は重いのでイベントループの外で行う
+        self.misses += 1
+        return await asyncio.to_thread(self._factory)
+
+    def release(self, rec):
+        if len(self._idle) < self.max_idle:
+            self._idle.append(rec)
+        else:
+            self.discarded += 1
+
+    def stats(self) -> dict:
+        requests = self.hits + self.misses
+        return {
+            "idle": len(self._idle),
+            "hits": self.hits,
+            "misses": self.misses,
+            "discarded": self.discarded,
+            "hit_rate": round(self.hits / requests, 3) if requests else 0.0,
+        }
@@ -0,0 +1,384 @@
+"""部屋の参加者とメッセージの配信をプロセス間で共有するバックプレーン
+
+chat / voice / video の各サービスは、自プロセスの接続には直接送り、同じ部屋の他のプロセスの
+接続にはバックプレーンを通して送る。RELAY_BACKPLANE で実装を選ぶ。
+
+- local: 1プロセスだけで動かす場合（既定）。他のプロセスには何も送らない
+- unix: Unix ソケットのブローカーを通して同じホストの全てのプロセスに配信する。
+  ブローカーを起動してから各サービスを複数のワーカーで起動する
+
+    python relay_backplane.py
+    RELAY_BACKPLANE=unix uvicorn chat_websocket:app --port 8001 --workers 4
+"""
+import argparse
+import asyncio
+import json
+import os
+import struct
+import uuid
+from collections import deque
+from typing import Awaitable, Callable, Optional
+
+# バックプレーンの実装: local / unix
+RELAY_BACKPLANE = os.environ.get("RELAY_BACKPLANE", "local")
+# ブローカーの Unix ソケットのパス
+RELAY_BACKPLANE_PATH = os.environ.get("RELAY_BACKPLANE_PATH", "/tmp/debate_relay.sock")
+# ブローカーに接続できなかったときに再接続するまでの秒数
+RECONNECT_DELAY = 1.0
+# 接続ごとの書き込みバッファがこれを超えたら、書き込みが追いつくまで待つ（ブローカーでは切断する）
+WRITE_BUFFER_LIMIT = 8 * 1024 * 1024
+# 他のプロセスから届き、部屋ごとに配信を待っているメッセージの上限（超えたら古いものから捨てる）
+REMOTE_QUEUE_LIMIT = int(os.environ.get("RELAY_REMOTE_QUEUE_LIMIT", 1000))
+
+# 他のプロセスから届いたメッセージを受け取る関数: (部屋, JSON 文字列, 付加情報)
+MessageHandler = Callable[[str, str, dict], Awaitable[None]]
+
+# フレーム: ヘッダーの長さ・本文の長さ（各4バイト）、ヘッダーの JSON、本文（送信する JSON 文字列）
+_LENGTHS = struct.Struct("!II")
+
+
+def pack(header: dict, payload: str = "") -> bytes:
+    head = json.dumps(header, separators=(",", ":")).encode()
+    body = payload.encode()
+    return _LENGTHS.pack(len(head), len(body)) + head + body
+
+
+async def read_frame(reader: asyncio.StreamReader) -> tuple[dict, bytes, bytes]:
+    # (ヘッダー, 本文, フレーム全体) を返す。ブローカーはフレームをそのまま転送する
+    lengths = await reader.readexactly(_LENGTHS.size)
+    head_len, body_len = _LENGTHS.unpack(lengths)
+    data = await reader.readexactly(head_len + body_len)
+    return json.loads(data[:head_len]), data[head_len:], lengths + data
+
+
+class LocalBackplane:
+    """1プロセス内だけのバックプレーン。部屋の参加者は自プロセスの分だけを数える"""
+
+    def __init__(self, channel: str):
+        self.channel = channel
+        self.node_id = uuid.uuid4().hex[:12]
+        self.on_message: Optional[MessageHandler] = None
+        # 部屋 -> 自プロセスの参加者
+        self._local: dict[str, set] = {}
+        self.published = 0
+        self.received = 0
+
+    async def start(self):
+        pass
+
+    async def wait_connected(self, timeout: float) -> bool:
+        return True
+
+    async def stop(self):
+        pass
+
+    def join(self, room: str, member: str):
+        self._local.setdefault(room, set()).add(member)
+
+    def leave(self, room: str, member: str):
+        members = self._local.get(room)
+        if members is not None:
+            members.discard(member)
+            if not members:
+                del self._local[room]
+
+    def members(self, room: str) -> set:
+        return set(self._local.get(room, ()))
+
+    def rooms(self) -> dict[str, int]:
+        # 部屋ごとの参加者数（全プロセスの合計）
+        return {room: len(self.members(room)) for room in self._local}
+
+    async def publish(self, room: str, text: str, **meta):
+        # 自プロセスの接続には呼び出し側が送るので、他のプロセスに送るものはない
+        self.published += 1
+
+    def stats(self) -> dict:
+        return {
+            "backend": "local",
+            "node": self.node_id,
+            "rooms": len(self._local),
+            "published": self.published,
+            "received": self.received,
+        }
+
+
+class UnixSocketBackplane(LocalBackplane):
+    """Unix ソケットのブローカーを通して、同じチャンネルの他のプロセスと部屋を共有する
+
+    ブローカーに接続できない間は自プロセスの接続にだけ配信し、再接続したら
+    自プロセスの参加者を登録し直す。他のプロセスから届いたメッセージは部屋ごとのタスクで
+    順に配信するので、遅い接続のある部屋が他の部屋への配信や受信を止めることはない。
+    """
+
+    def __init__(self, channel: str, path: str = RELAY_BACKPLANE_PATH):
+        super().__init__(channel)
+        self.path = path
+        # 部屋 -> ノード -> 他のプロセスの参加者
+        self._remote: dict[str, dict[str, set]] = {}
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._task: Optional[asyncio.Task] = None
+        self._connected = asyncio.Event()
+        # ブローカーに接続できないことを通知済みか（接続できるまで1回だけ出す）
+        self._warned = False
+        # 部屋 -> 配信待ちのメッセージと、それを配信しているタスク
+        self._inbox: dict[str, deque] = {}
+        self._delivering: dict[str, asyncio.Task] = {}
+        self.unsent = 0
+        self.reconnects = 0
+        self.remote_dropped = 0
+
+    async def start(self):
+        # 接続のたびに呼ばれる。ブローカーへの接続はバックグラウンドで1回だけ始め、接続を待たない
+        # （接続できるまでは自プロセスの接続にだけ配信する）
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def wait_connected(self, timeout: float) -> bool:
+        # ブローカーに接続するまで最大 timeout 秒待つ（ベンチマークなど、他のプロセスに確実に届けたい場合）
+        try:
+            await asyncio.wait_for(self._connected.wait(), timeout)
+        except asyncio.TimeoutError:
+            return False
+        return True
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+        self._connected.clear()
+        for task in self._delivering.values():
+            task.cancel()
+        self._delivering.clear()
+        self._inbox.clear()
+
+    async def _run(self):
+        while True:
+            try:
+                reader, writer = await asyncio.open_unix_connection(self.path)
+            except OSError:
+                if not self._warned:
+                    self._warned = True
+                    print(f"バックプレーンのブローカー {self.path} に接続できません。このプロセスの接続にだけ配信します")
+                await asyncio.sleep(RECONNECT_DELAY)
+                continue
+            self._warned = False
+            writer.write(pack({"op": "hello", "ch": self.channel, "node": self.node_id}))
+            for room, members in self._local.items():
+                for member in members:
+                    writer.write(pack({"op": "join", "room": room, "member": member, "node": self.node_id}))
+            self._writer = writer
+            self._connected.set()
+            try:
+                while True:
+                    header, body, _ = await read_frame(reader)
+                    await self._dispatch(header, body)
+            except (OSError, asyncio.IncompleteReadError) as e:
+                print(f"バックプレーンのブローカーとの接続が切れました: {e!r}")
+            finally:
+                self._writer = None
+                self._connected.clear()
+                self._remote.clear()
+                writer.close()
+            self.reconnects += 1
+            await asyncio.sleep(RECONNECT_DELAY)
+
+    async def _dispatch(self, header: dict, body: bytes):
+        op = header.get("op")
+        if op == "pub":
+            self.received += 1
+            if self.on_message is not None:
+                self._enqueue(header["room"], body.decode(), header)
+        elif op == "join":
+            self._remote.setdefault(header["room"], {}).setdefault(header["node"], set()).add(header["member"])
+        elif op == "leave":
+            nodes = self._remote.get(header["room"], {})
+            nodes.get(header["node"], set()).discard(header["member"])
+            if not nodes.get(header["node"], True):
+                del nodes[header["node"]]
+            if not nodes:
+                self._remote.pop(header["room"], None)
+        elif op == "gone":
+            # ブローカーから切断したプロセスの参加者を除く
+            for room in list(self._remote):
+                self._remote[room].pop(header["node"], None)
+                if not self._remote[room]:
+                    del self._remote[room]
+
+    def _enqueue(self, room: str, text: str, header: dict):
+        # 受信ループでは配信を待たず、部屋ごとのタスクに渡す
+        inbox = self._inbox.setdefault(room, deque())
+        if len(inbox) >= REMOTE_QUEUE_LIMIT:
+            inbox.popleft()
+            self.remote_dropped += 1
+        inbox.append((text, header))
+        if room not in self._delivering:
+            self._delivering[room] = asyncio.create_task(self._deliver(room))
+
+    async def _deliver(self, room: str):
+        inbox = self._inbox[room]
+        try:
+            while inbox:
+                text, header = inbox.popleft()
+                try:
+                    await self.on_message(room, text, header)
+                except Exception as e:
+                    print(f"バックプレーンのメッセージの配信中にエラー: {e}")
+        finally:
+            if self._delivering.get(room) is asyncio.current_task():
+                del self._delivering[room]
+                if self._inbox.get(room) is inbox and not inbox:
+                    del self._inbox[room]
+
+    def _send(self, frame: bytes) -> bool:
+        if self._writer is None:
+            self.unsent += 1
+            return False
+        self._writer.write(frame)
+        return True
+
+    def join(self, room: str, member: str):
+        super().join(room, member)
+        self._send(pack({"op": "join", "room": room, "member": member, "node": self.node_id}))
+
+    def leave(self, room: str, member: str):
+        super().leave(room, member)
+        self._send(pack({"op": "leave", "room": room, "member": member, "node": self.node_id}))
+
+    def members(self, room: str) -> set:
+        members = super().members(room)
+        for node, remote in self._remote.get(room, {}).items():
+            members.update(f"{node}:{m}" for m in remote)
+        return members
+
+    def rooms(self) -> dict[str, int]:
+        return {room: len(self.members(room)) for room in self._local.keys() | self._remote.keys()}
+
+    async def publish(self, room: str, text: str, **meta):
+        self.published += 1
+        if self._send(pack({"op": "pub", "room": room, **meta}, text)):
+            if self._writer.transport.get_write_buffer_size() > WRITE_BUFFER_LIMIT:
+                await self._writer.drain()
+
+    def stats(self) -> dict:
+        return {
+            **super().stats(),
+            "backend": "unix",
+            "connected": self._connected.is_set(),
+            "rooms": len(self._local.keys() | self._remote.keys()),
+            "unsent": self.unsent,
+            "reconnects": self.reconnects,
+            "delivering_rooms": len(self._delivering),
+            "remote_dropped": self.remote_dropped,
+        }
+
+
+class RelayBroker:
+    """Unix ソケットでつながったプロセス間でメッセージと部屋の参加者を中継する
+
+    メッセージのフレームは中身を読まずに、同じチャンネルの他の接続にそのまま転送する。
+    """
+
+    def __init__(self, path: str = RELAY_BACKPLANE_PATH):
+        self.path = path
+        # 接続 -> (チャンネル, ノード)
+        self._clients: dict[asyncio.StreamWriter, tuple[str, str]] = {}
+        # (チャンネル, 部屋) -> ノード -> 参加者
+        self._members: dict[tuple[str, str], dict[str, set]] = {}
+        self.forwarded = 0
+
+    async def start(self) -> asyncio.AbstractServer:
+        if os.path.exists(self.path):
+            try:
+                _, writer = await asyncio.open_unix_connection(self.path)
+            except OSError:
+                os.unlink(self.path)  # 前回のブローカーが残したソケットファイル
+            else:
+                writer.close()
+                raise RuntimeError(f"ブローカーは既に {self.path} で起動しています")
+        return await asyncio.start_unix_server(self._handle, self.path)
+
+    def _peers(self, channel: str, exclude: asyncio.StreamWriter):
+        return [w for w, (ch, _) in self._clients.items() if ch == channel and w is not exclude]
+
+    def _forward(self, channel: str, frame: bytes, exclude: asyncio.StreamWriter):
+        for writer in self._peers(channel, exclude):
+            if writer.transport.get_write_buffer_size() > WRITE_BUFFER_LIMIT:
+                # 読み取りが追いつかないプロセスは切断する（再接続時に参加者を登録し直す）
+                print(f"バックプレーンの接続 {self._clients[writer][1]} の書き込みが滞っているため切断します")
+                writer.close()
+                continue
+            writer.write(frame)
+            self.forwarded += 1
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            header, _, _ = await read_frame(reader)
+        except (OSError, asyncio.IncompleteReadError):
+            writer.close()
+            return
+        channel, node = header["ch"], header["node"]
+        self._clients[writer] = (channel, node)
+        # 新しい接続には現在の参加者を伝える
+        for (ch, room), nodes in self._members.items():
+            if ch == channel:
+                for other, members in nodes.items():
+                    for member in members:
+                        writer.write(pack({"op": "join", "room": room, "member": member, "node": other}))
+        try:
+            while True:
+                header, _, frame = await read_frame(reader)
+                op = header.get("op")
+                if op in ("join", "leave"):
+                    nodes = self._members.setdefault((channel, header["room"]), {})
+                    if op == "join":
+                        nodes.setdefault(node, set()).add(header["member"])
+                    else:
+                        nodes.get(node, set()).discard(header["member"])
+                        if not nodes.get(node, True):
+                            del nodes[node]
+                        if not nodes:
+                            del self._members[(channel, header["room"])]
+                self._forward(channel, frame, writer)
+        except (OSError, asyncio.IncompleteReadError, asyncio.CancelledError):
+            # CancelledError はブローカーの停止時。接続の後始末をして終える
+            pass
+        finally:
+            del self._clients[writer]
+            for key in [k for k in self._members if k[0] == channel]:
+                self._members[key].pop(node, None)
+                if not self._members[key]:
+                    del self._members[key]
+            self._forward(channel, pack({"op": "gone", "node": node}), writer)
+            writer.close()
+
+    def stats(self) -> dict:
+        return {
+            "clients": len(self._clients),
+            "rooms": len(self._members),
+            "forwarded": self.forwarded,
+        }
+
+
+def create_backplane(channel: str) -> LocalBackplane:
+    if RELAY_BACKPLANE == "unix":
+        return UnixSocketBackplane(channel)
+    return LocalBackplane(channel)
+
+
+async def serve(path: str):
+    broker = RelayBroker(path)
+    server = await broker.start()
+    print(f"バックプレーンのブローカーを {path} で起動しました")
+    async with server:
+        await server.serve_forever()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--path", default=RELAY_BACKPLANE_PATH)
+    args = parser.parse_args()
+    asyncio.run(serve(args.path))
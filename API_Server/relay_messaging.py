@@ -0,0 +1,55 @@
+import json
+import os
+from typing import Iterable
+
+try:
+    import orjson
+except ImportError:  # orjson がなければ標準の json を使う
+    orjson = None
+
+# JSON の変換に使う実装: orjson / json（既定は orjson があれば orjson）
+RELAY_JSON_BACKEND = os.environ.get("RELAY_JSON_BACKEND", "orjson" if orjson is not None else "json")
+
+_use_orjson = RELAY_JSON_BACKEND == "orjson" and orjson is not None
+
+
+def encode(message) -> str:
+    """メッセージを送信用の JSON 文字列にする（WebSocket.send_json と同じ形式）
+
+    ブロードキャストでは1回だけ変換し、同じ文字列を全ての接続に send_text で送る。
+    """
+    if _use_orjson:
+        try:
+            return orjson.dumps(message).decode()
+        except TypeError:
+            # orjson が扱えない値（64ビットを超える整数や文字列以外のキーなど）は標準の json に任せる
+            pass
+    return json.dumps(message, separators=(",", ":"), ensure_ascii=False)
+
+
+def decode(text):
+    # 不正な JSON では json.JSONDecodeError を送出する（orjson.JSONDecodeError はそのサブクラス）
+    if _use_orjson:
+        return orjson.loads(text)
+    return json.loads(text)
+
+
+async def receive(websocket):
+    """WebSocket.receive_json の代わりに、受信した JSON を decode() で読む"""
+    return decode(await websocket.receive_text())
+
+
+async def broadcast_text(connections: Iterable, text: str, exclude=None) -> list:
+    """encode() で JSON にしたメッセージを全ての接続に送り、送れなかった接続を返す
+
+    1つの接続への送信に失敗しても残りの接続への送信は続ける。
+    """
+    failed = []
+    for connection in list(connections):
+        if connection is exclude:
+            continue
+        try:
+            await connection.send_text(text)
+        except Exception:
+            failed.append(connection)
+    return failed
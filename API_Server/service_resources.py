@@ -0,0 +1,212 @@
+"""サービスの重いリソース（音声認識モデル・API クライアントなど）の読み込みと準備状態
+
+import 時に読み込むとサーバーが応答できるようになるまでが遅くなるので、app の lifespan で
+RESOURCE_LOADING に従って読み込む。読み込み中も / などの応答は返し、全てのリソースが
+使えるようになったかどうかは各サービスの /ready（準備中は 503）で分かる。
+
+- background: 起動後すぐにバックグラウンドのスレッドで読み込む（既定）
+- lazy: 最初に使うときに読み込む
+- eager: 読み込み終えてから接続を受け付ける（従来と同じ）
+
+RESOURCE_WARM_CACHE=1 なら、起動時にキャッシュを温める処理（モデルのファイルをページキャッシュに
+先読みする、保存済みの分析結果をメモリに読み込むなど）もバックグラウンドで行う。
+"""
+import asyncio
+import contextlib
+import os
+import threading
+import time
+from typing import Any, Callable, Optional
+
+from starlette.responses import JSONResponse
+
+# リソースを読み込む時機: background / lazy / eager
+RESOURCE_LOADING = os.environ.get("RESOURCE_LOADING", "background")
+# 起動時にキャッシュを温めるかどうか
+RESOURCE_WARM_CACHE = os.environ.get("RESOURCE_WARM_CACHE", "0") == "1"
+
+
+def warm_page_cache(path: str) -> int:
+    # path 以下のファイルを先読みするようカーネルに伝える（読み込みの完了は待たない）。ファイル数を返す
+    count = 0
+    for directory, _, files in os.walk(path):
+        for name in files:
+            try:
+                fd = os.open(os.path.join(directory, name), os.O_RDONLY)
+            except OSError:
+                continue
+            try:
+                os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_WILLNEED)
+                count += 1
+            except (OSError, AttributeError):
+                pass
+            finally:
+                os.close(fd)
+    return count
+
+
+class LazyResource:
+    """1回だけ読み込むリソース
+
+    読み込みはスレッドで行い、同時に要求されても loader は1回しか呼ばない。
+    失敗した場合は次に要求されたときに読み込み直す。
+    """
+
+    def __init__(self, name: str, loader: Callable[[], Any], on_loaded: Optional[Callable[[Any], None]] = None):
+        self.name = name
+        self._loader = loader
+        self._on_loaded = on_loaded
+        self._lock = threading.Lock()
+        self.value: Any = None
+        self.state = "pending"
+        self.error: Optional[str] = None
+        self.load_seconds: Optional[float] = None
+
+    @property
+    def ready(self) -> bool:
+        return self.state == "ready"
+
+    def load_sync(self):
+        # イベントループの外（スレッドや fork 前のマスター）から呼ぶ
+        with self._lock:
+            if self.state != "ready":
+                self.state = "loading"
+                started = time.perf_counter()
+                try:
+                    self.value = self._loader()
+                    if self._on_loaded is not None:
+                        self._on_loaded(self.value)
+                except Exception as e:
+                    self.state = "failed"
+                    self.error = repr(e)
+                    raise
+                self.load_seconds = time.perf_counter() - started
+                self.state = "ready"
+                self.error = None
+        return self.value
+
+    def set(self, value):
+        # 読み込まずに値を差し替える（ベンチマークでスタブのクライアントを使う場合など）
+        with self._lock:
+            self.value = value
+            self.state = "ready"
+            self.error = None
+
+    async def get(self):
+        if self.state == "ready":
+            return self.value
+        return await asyncio.to_thread(self.load_sync)
+
+    def status(self) -> dict:
+        return {
+            "state": self.state,
+            "load_seconds": round(self.load_seconds, 3) if self.load_seconds is not None else None,
+            "error": self.error,
+        }
+
+
+class ServiceResources:
+    """1つのサービスのリソースをまとめて読み込み、準備状態を返す"""
+
+    def __init__(self, service: str, loading: str = RESOURCE_LOADING, warm_cache: bool = RESOURCE_WARM_CACHE):
+        self.service = service
+        self.loading = loading
+        self.warm_cache = warm_cache
+        self._resources: dict[str, LazyResource] = {}
+        self._warmers: dict[str, Callable[[], Any]] = {}
+        self._closers: dict[str, Callable[[], Any]] = {}
+        self._tasks: set[asyncio.Task] = set()
+        self._started: Optional[float] = None
+        # 起動から全てのリソースが使えるようになるまでの秒数
+        self.ready_after: Optional[float] = None
+
+    def add(self, name: str, loader: Callable[[], Any], on_loaded: Optional[Callable[[Any], None]] = None) -> LazyResource:
+        resource = self._resources[name] = LazyResource(name, loader, on_loaded)
+        return resource
+
+    def add_warmer(self, name: str, warmer: Callable[[], Any]):
+        # warm_cache が有効なときに起動時に呼ぶ（async 関数でなければスレッドで呼ぶ）
+        self._warmers[name] = warmer
+
+    def add_closer(self, name: str, closer: Callable[[], Any]):
+        # 終了時に呼ぶ（書き込み待ちのデータを書き終えるなど）。async 関数でもよい
+        self._closers[name] = closer
+
+    def load_sync(self):
+        # 全てのリソースを読み込む（fork 前にマスターで読み込み、ワーカーで共有する場合など）
+        for resource in self._resources.values():
+            resource.load_sync()
+
+    def is_ready(self) -> bool:
+        if self.loading == "lazy":
+            # 使うときに読み込むので、読み込みに失敗していなければ受け付ける
+            return all(r.state != "failed" for r in self._resources.values())
+        return all(r.ready for r in self._resources.values())
+
+    async def _load(self, resource: LazyResource):
+        try:
+            await resource.get()
+            print(f"{self.service}: {resource.name} を読み込みました（{resource.load_seconds:.2f}秒）")
+        except Exception as e:
+            print(f"{self.service}: {resource.name} の読み込みに失敗しました: {e}")
+        self._check_ready()
+
+    async def _warm(self, name: str, warmer: Callable[[], Any]):
+        started = time.perf_counter()
+        try:
+            if asyncio.iscoroutinefunction(warmer):
+                result = await warmer()
+            else:
+                result = await asyncio.to_thread(warmer)
+            print(f"{self.service}: {name} を温めました: {result}（{time.perf_counter() - started:.2f}秒）")
+        except Exception as e:
+            print(f"{self.service}: {name} を温められませんでした: {e}")
+
+    def _check_ready(self):
+        if self.ready_after is None and all(r.ready for r in self._resources.values()):
+            self.ready_after = time.perf_counter() - self._started
+
+    def _spawn(self, coro):
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    @contextlib.asynccontextmanager
+    async def lifespan(self, app):
+        self._started = time.perf_counter()
+        self._check_ready()
+        if self.warm_cache:
+            for name, warmer in self._warmers.items():
+                self._spawn(self._warm(name, warmer))
+        pending = [r for r in self._resources.values() if not r.ready]
+        if self.loading == "eager":
+            for resource in pending:
+                await self._load(resource)
+        elif self.loading != "lazy":
+            for resource in pending:
+                self._spawn(self._load(resource))
+        try:
+            yield
+        finally:
+            # スレッドで実行中の読み込みは止められないので、結果を待たずに終える
+            for task in list(self._tasks):
+                task.cancel()
+            for name, closer in self._closers.items():
+                try:
+                    result = closer()
+                    if asyncio.iscoroutine(result):
+                        await result
+                except Exception as e:
+                    print(f"{self.service}: {name} の終了処理に失敗しました: {e}")
+
+    def status(self) -> dict:
+        return {
+            "service": self.service,
+            "ready": self.is_ready(),
+            "loading": self.loading,
+            "ready_after": round(self.ready_after, 3) if self.ready_after is not None else None,
+            "resources": {name: r.status() for name, r in self._resources.items()},
+        }
+
+    def ready_response(self) -> JSONResponse:
+        return JSONResponse(self.status(), status_code=200 if self.is_ready() else 503)
@@ -0,0 +1,114 @@
+import asyncio
+import os
+from typing import Optional
+
+import relay_messaging
+
+# trickle ICE の候補をまとめて送るまでに待つ秒数（0 ならまとめない）
+ICE_BATCH_WINDOW = float(os.environ.get("ICE_BATCH_WINDOW", 0.02))
+
+# 宛先（target）があれば、その相手だけに送るメッセージ
+TARGETED_TYPES = ("offer", "answer", "ice_candidate")
+# 宛先がなくても部屋の全員に送るメッセージ
+SIGNALING_TYPES = ("offer", "answer", "ice_candidate", "camera_status")
+
+
+class SignalingRouter:
+    """WebRTC のシグナリングメッセージを宛先の相手だけに送る
+
+    offer / answer / ice_candidate は target（相手のユーザー名）があれば、その相手の接続だけに送る
+    （相手が他のワーカープロセスにいればバックプレーンを通して送る）。target のないメッセージは
+    従来どおり部屋の全員に送る。ice_batch を有効にして接続したクライアントには、同じ相手からの
+    ICE 候補を window 秒ごとに1つの ice_candidate_batch メッセージにまとめて送る。
+    """
+
+    def __init__(self, manager, window: float = ICE_BATCH_WINDOW):
+        self.manager = manager
+        self.window = window
+        # (部屋, 宛先, 送信者) -> 送信待ちの ICE 候補（JSON 文字列）
+        self._ice: dict[tuple[str, str, str], list[str]] = {}
+        # (部屋, 宛先, 送信者) -> window 秒後に送信待ちをまとめて送るタスク
+        self._flushes: dict[tuple[str, str, str], asyncio.Task] = {}
+        self.routed = 0
+        self.targeted = 0
+        self.batches = 0
+        self.batched_candidates = 0
+
+    async def route(self, room_id: str, sender: str, data: dict):
+        message_type = data.get("type")
+        if message_type not in SIGNALING_TYPES:
+            return
+        self.routed += 1
+        if message_type == "camera_status" and "camera_on" in data:
+            self.manager.set_camera_status(room_id, sender, bool(data["camera_on"]))
+
+        target = data.get("target") if message_type in TARGETED_TYPES else None
+        text = relay_messaging.encode(data)
+        if target is None:
+            await self.manager.broadcast_text(text, room_id, exclude_user=sender, camera=data.get("camera_on"))
+            return
+        self.targeted += 1
+        if self.manager.is_local(room_id, target):
+            await self.deliver(room_id, target, sender, text, message_type == "ice_candidate")
+        else:
+            await self.manager.backplane.publish(room_id, text, target=target, sender=sender,
+                                                 ice=message_type == "ice_candidate")
+
+    async def deliver(self, room_id: str, target: str, sender: str, text: str, ice: bool = False):
+        # このプロセスに接続している target に送る
+        if ice and self.window > 0 and self.manager.wants_ice_batch(room_id, target):
+            key = (room_id, target, sender)
+            pending = self._ice.get(key)
+            if pending is None:
+                self._ice[key] = [text]
+                # タスクへの参照を持っておかないと、送る前にガベージコレクションで消えることがある
+                self._flushes[key] = asyncio.create_task(self._flush_later(key))
+            else:
+                pending.append(text)
+            return
+        key = (room_id, target, sender)
+        if key in self._ice:
+            # 先に受け取った ICE 候補より後に届くように、送信待ちを先に送る（待っているタスクは止める）
+            self._cancel_flush(key)
+            await self._flush(key)
+        await self.manager.send_to_user(room_id, target, text)
+
+    async def _flush_later(self, key: tuple[str, str, str]):
+        try:
+            await asyncio.sleep(self.window)
+            await self._flush(key)
+        finally:
+            if self._flushes.get(key) is asyncio.current_task():
+                del self._flushes[key]
+
+    def _cancel_flush(self, key: tuple[str, str, str]):
+        task = self._flushes.pop(key, None)
+        if task is not None:
+            task.cancel()
+
+    async def _flush(self, key: tuple[str, str, str]):
+        texts = self._ice.pop(key, None)
+        if not texts:
+            return
+        room_id, target, sender = key
+        self.batches += 1
+        self.batched_candidates += len(texts)
+        # 個々の候補は JSON 文字列のまま並べるので、変換し直さない
+        text = (f'{{"type":"ice_candidate_batch","sender":{relay_messaging.encode(sender)},'
+                f'"target":{relay_messaging.encode(target)},"messages":[{",".join(texts)}]}}')
+        await self.manager.send_to_user(room_id, target, text)
+
+    def forget(self, room_id: str, user: Optional[str] = None):
+        # 切断したユーザー宛ての送信待ちを捨てる
+        for key in [k for k in self._ice.keys() | self._flushes.keys()
+                    if k[0] == room_id and (user is None or k[1] == user)]:
+            self._ice.pop(key, None)
+            self._cancel_flush(key)
+
+    def stats(self) -> dict:
+        return {
+            "routed": self.routed,
+            "targeted": self.targeted,
+            "ice_batches": self.batches,
+            "batched_candidates": self.batched_candidates,
+        }
@@ -0,0 +1,160 @@
+"""音声認識サービスのマルチワーカー起動（pre-fork）
+
+マスタープロセスで Vosk モデルを1回だけ読み込んでからワーカーを fork する。
+モデルは Kaldi 側（ネイティブ）のメモリに置かれ、Python の参照カウントで書き換えられる
+ことがないため、コピーオンライトでワーカー間に共有されたままになる。
+待ち受けソケットはマスターで作成して全ワーカーに引き継ぐので、新しい接続は
+カーネルによって空いているワーカーに振り分けられ、セッションが各コアに分散する。
+
+    python speech_prefork.py --workers 4 --port 8002 --report
+
+--report を付けると、全ワーカーが応答可能になるまでの時間と、各ワーカーの RSS/PSS を表示する。
+従来の起動方法（uvicorn voice_recognition_websocket:app --workers 4）ではモデルの読み込みが
+ワーカーの数だけ行われるため、同じ --report の出力（PSS の合計）と比較できる。
+"""
+import argparse
+import gc
+import http.client
+import os
+import signal
+import socket
+import sys
+import time
+
+
+def read_memory_kb(pid: int) -> tuple[int, int]:
+    # (RSS, PSS) を KB で返す。PSS は共有ページを共有プロセス数で按分した値
+    rss = pss = 0
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as f:
+            for line in f:
+                if line.startswith("Rss:"):
+                    rss = int(line.split()[1])
+                elif line.startswith("Pss:"):
+                    pss = int(line.split()[1])
+    except OSError:
+        pass
+    return rss, pss
+
+
+def wait_until_ready(host: str, port: int, timeout: float = 60.0, path: str = "/") -> bool:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            conn = http.client.HTTPConnection(host, port, timeout=1)
+            conn.request("GET", path)
+            if conn.getresponse().status == 200:
+                return True
+        except OSError:
+            pass
+        time.sleep(0.05)
+    return False
+
+
+def run_worker(sock: socket.socket, app, log_level: str):
+    import uvicorn
+
+    config = uvicorn.Config(app, log_level=log_level)
+    uvicorn.Server(config).run(sockets=[sock])
+
+
+def spawn(sock: socket.socket, app, log_level: str) -> int:
+    pid = os.fork()
+    if pid == 0:
+        try:
+            run_worker(sock, app, log_level)
+        finally:
+            os._exit(0)
+    return pid
+
+
+def listen(host: str, port: int) -> socket.socket:
+    # ワーカーに引き継ぐ待ち受けソケット
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+    return sock
+
+
+def supervise(sock: socket.socket, app, count: int, log_level: str, on_started=None):
+    """count 個のワーカーを fork し、SIGINT/SIGTERM を受けるまで、落ちたワーカーを作り直す"""
+    workers = {spawn(sock, app, log_level) for _ in range(count)}
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in workers:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+
+    if on_started is not None:
+        on_started(workers)
+
+    # ワーカーが落ちた場合は作り直す
+    while workers:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        except InterruptedError:
+            continue
+        workers.discard(pid)
+        if not stopping:
+            print(f"ワーカー {pid} が終了したため再起動します (status={status})")
+            workers.add(spawn(sock, app, log_level))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8002)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--log-level", default="info")
+    parser.add_argument("--report", action="store_true", help="起動時間とワーカーごとのメモリ使用量を表示する")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    # デコード用スレッドはコア数をワーカーで分け合う（明示的に指定されていればそれを使う）
+    os.environ.setdefault("DECODER_WORKERS", str(max(1, (os.cpu_count() or 1) // args.workers)))
+
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import voice_recognition_websocket
+    # ワーカーで共有するため、lifespan を待たずにマスターで読み込む
+    voice_recognition_websocket.resources.load_sync()
+    model_loaded = time.perf_counter() - started
+    print(f"モデル読み込み完了: {model_loaded:.2f}秒")
+
+    sock = listen(args.host, args.port)
+
+    # fork 前に既存オブジェクトを GC の対象外にし、ワーカーでのページ複製を減らす
+    gc.collect()
+    gc.freeze()
+
+    def report(workers: set):
+        probe_host = "127.0.0.1" if args.host in ("0.0.0.0", "") else args.host
+        if wait_until_ready(probe_host, args.port):
+            print(f"起動完了（最初の応答まで）: {time.perf_counter() - started:.2f}秒")
+        master_rss, master_pss = read_memory_kb(os.getpid())
+        print(f"{'pid':>8} {'RSS MB':>8} {'PSS MB':>8}")
+        print(f"{os.getpid():>8} {master_rss / 1024:>8.1f} {master_pss / 1024:>8.1f}  (master)")
+        total_pss = master_pss
+        for pid in sorted(workers):
+            rss, pss = read_memory_kb(pid)
+            total_pss += pss
+            print(f"{pid:>8} {rss / 1024:>8.1f} {pss / 1024:>8.1f}")
+        print(f"PSS合計: {total_pss / 1024:.1f} MB")
+
+    supervise(sock, voice_recognition_websocket.app, args.workers, args.log_level,
+              on_started=report if args.report else None)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,21 @@
+import argparse
 import subprocess
 import sys
 from concurrent.futures import ProcessPoolExecutor
 
+# 開発用にサービスごとに起動する uvicorn: サービス名 -> (モジュール, ホスト, ポート)
+DEV_SERVERS = {
+    "chat": ("chat_websocket", "localhost", 8001),
+    "speech": ("voice_recognition_websocket", "0.0.0.0", 8002),
+    "voice": ("voice_chat_API", "0.0.0.0", 8003),
+    "video": ("video_call_API", "0.0.0.0", 8004),
+    "analysis": ("debate_analysis_API", "0.0.0.0", 8005),
+}
+
+def dev_command(service):
+    module, host, port = DEV_SERVERS[service]
+    return f"uvicorn {module}:app --host {host} --port {port} --reload"
+
 def run_server(command):
     try:
         subprocess.run(command, shell=True, check=True)
@@ -10,23 +24,16 @@ def run_server(command):
     except KeyboardInterrupt:
         print("Server stopped by user")
 
-def main():
+def run_dev():
     # サーバーコマンドのリスト
-    commands = [
-        "uvicorn chat_websocket:app --host localhost --port 8001 --reload",
-        "uvicorn voice_recognition_websocket:app --host 0.0.0.0 --port 8002 --reload",
-        "uvicorn voice_chat_API:app --host 0.0.0.0 --port 8003 --reload",
-        "uvicorn video_call_API:app --host 0.0.0.0 --port 8004 --reload",
-        "uvicorn debate_analysis_API:app --host 0.0.0.0 --port 8005 --reload",
-
-    ]
+    commands = [dev_command(service) for service in DEV_SERVERS]
 
     # ProcessPoolExecutorを使用して複数のサーバーを並行して実行
     with ProcessPoolExecutor(max_workers=len(commands)) as executor:
         try:
             # 各サーバーを別々のプロセスで実行
             futures = [executor.submit(run_server, cmd) for cmd in commands]
-            
+
             # すべてのプロセスが完了するまで待機
             for future in futures:
                 future.result()
@@ -34,5 +41,17 @@ def main():
             print("\nStopping all servers...")
             sys.exit(0)
 
+def main():
+    # 本番ではゲートウェイ（gateway.py）で全サービスを起動する。残りの引数はゲートウェイに渡す
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--reload", action="store_true",
+                        help="開発用: サービスごとに uvicorn を --reload 付きで起動する（ポート 8001〜8005）")
+    args, rest = parser.parse_known_args()
+    if args.reload:
+        run_dev()
+    else:
+        import gateway
+        gateway.main(rest)
+
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
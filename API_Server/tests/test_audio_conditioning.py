@@ -0,0 +1,60 @@
+"""AudioConditioner の出力が旧実装（process_audio_data）とビット単位で一致することの確認
+
+    python -m pytest tests
+"""
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from audio_conditioning import AudioConditioner  # noqa: E402
+
+CHUNK_SAMPLES = 8192
+# 無音・小音量・中音量・通常音量・ゼロ・クリップ気味の入力
+LEVELS = [0.0, 0.0005, 0.005, 0.0099, 0.02, 0.04, 0.0499, 0.2, 3.0]
+
+
+def legacy_process_audio_data(data: bytes) -> bytes:
+    # 置き換え前の process_audio_data（ログ出力を除く）
+    if len(data) < 32768:
+        return data
+    float_data = np.frombuffer(data, dtype=np.float32).copy()
+    rms = np.sqrt(np.mean(float_data**2))
+    if rms < 0.01:
+        gain = min(20.0, 1.0 / (rms + 0.0001))
+        float_data *= gain
+    elif rms < 0.05:
+        gain = min(10.0, 0.5 / (rms + 0.001))
+        float_data *= gain
+    max_amplitude = np.max(np.abs(float_data))
+    if max_amplitude > 0:
+        float_data = np.clip(float_data / max_amplitude * 0.99, -0.99, 0.99)
+    int_data = (float_data * 32767).astype(np.int16)
+    return int_data.tobytes()
+
+
+@pytest.mark.parametrize("seed", [0, 1, 2, 3])
+def test_condition_matches_legacy(seed):
+    rng = np.random.default_rng(seed)
+    conditioner = AudioConditioner(CHUNK_SAMPLES, debug=False)
+    # 同じ conditioner を使い回し、内部バッファの再利用で結果が変わらないことも確かめる
+    for i in range(50):
+        level = LEVELS[i % len(LEVELS)]
+        chunk = (rng.standard_normal(CHUNK_SAMPLES) * level).astype(np.float32)
+        expected = legacy_process_audio_data(chunk.tobytes())
+        rms = conditioner.rms(chunk)
+        assert rms == np.sqrt(np.mean(chunk**2))
+        assert conditioner.condition(chunk, rms).tobytes() == expected, f"level={level} の入力で一致しません"
+
+
+def test_condition_matches_legacy_on_dc_offset():
+    # 片側に振れた入力（max と -min が異なる）でも最大振幅の扱いが一致する
+    rng = np.random.default_rng(42)
+    conditioner = AudioConditioner(CHUNK_SAMPLES, debug=False)
+    for offset in (0.003, -0.003, 0.5, -0.5):
+        chunk = (rng.standard_normal(CHUNK_SAMPLES) * 0.001 + offset).astype(np.float32)
+        rms = conditioner.rms(chunk)
+        assert conditioner.condition(chunk, rms).tobytes() == legacy_process_audio_data(chunk.tobytes())
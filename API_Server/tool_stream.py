@@ -0,0 +1,76 @@
+import json
+
+
+class ToolArgumentsParser:
+    """ストリーミングで届くツール呼び出しの引数（JSON オブジェクト）の逐次パーサー
+
+    feed() に引数の断片を渡すと、値が閉じたトップレベルのフィールドを (キー, 値) で返す。
+    文字列の中の区切り文字や入れ子の配列・オブジェクトは走査中の状態で読み飛ばす。
+    """
+
+    def __init__(self):
+        self.text = ""
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        # key: キーを待つ / colon: ':' を待つ / value: 値の途中 / after: ',' を待つ
+        self._state = "key"
+        self._key = None
+        self._start = 0
+
+    def feed(self, fragment: str) -> list[tuple[str, object]]:
+        self.text += fragment
+        fields = []
+        text = self.text
+        for pos in range(self._pos, len(text)):
+            c = text[pos]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif c == "\\":
+                    self._escape = True
+                elif c == '"':
+                    self._in_string = False
+                    if self._depth == 1:
+                        if self._state == "key":
+                            self._key = json.loads(text[self._start:pos + 1])
+                            self._state = "colon"
+                        elif self._state == "value":
+                            fields.append(self._emit(pos + 1))
+                continue
+
+            if c == '"':
+                self._in_string = True
+                if self._depth == 1 and self._state in ("key", "value"):
+                    if self._state == "key" or not text[self._start:pos].strip():
+                        self._start = pos
+            elif c in "[{":
+                self._depth += 1
+                if self._depth == 2 and self._state == "value" and not text[self._start:pos].strip():
+                    self._start = pos
+            elif c in "]}":
+                self._depth -= 1
+                if self._depth == 1 and self._state == "value":
+                    fields.append(self._emit(pos + 1))
+                elif self._depth == 0 and self._state == "value":
+                    # 数値や true/false などの最後のフィールド
+                    fields.append(self._emit(pos))
+            elif self._depth == 1:
+                if c == ":" and self._state == "colon":
+                    self._state = "value"
+                    self._start = pos + 1
+                elif c == ",":
+                    if self._state == "value":
+                        fields.append(self._emit(pos))
+                    self._state = "key"
+        self._pos = len(text)
+        return fields
+
+    def _emit(self, end: int) -> tuple[str, object]:
+        value = json.loads(self.text[self._start:end])
+        self._state = "after"
+        return self._key, value
+
+    def result(self) -> dict:
+        return json.loads(self.text)
@@ -0,0 +1,116 @@
+import bisect
+import threading
+import unicodedata
+from array import array
+from typing import Optional
+
+from transcript_store import TranscriptStore
+
+
+def normalize(text: str) -> str:
+    # 全角・半角や大文字・小文字の違いをなくし、Vosk が単語の間に入れる空白を取り除く
+    return "".join(unicodedata.normalize("NFKC", text).lower().split())
+
+
+def ngrams(text: str, n: int) -> set[str]:
+    if len(text) < n:
+        return {text} if text else set()
+    return {text[i:i + n] for i in range(len(text) - n + 1)}
+
+
+class TranscriptIndex:
+    """保存済みの文字起こしに対する転置インデックス
+
+    日本語は分かち書きを前提にできないため、1文字と2文字の n-gram を索引にする。
+    検索語の n-gram の転置リストを積集合で絞り込み、最後に部分一致で確かめる。
+    TranscriptStore に新しい記録が加わるたびに差分だけを索引に追加する。
+    構築は全記録を読むので、イベントループの外（サービスのリソースの読み込み）で行う。
+    """
+
+    def __init__(self, store: TranscriptStore):
+        self.store = store
+        # 文書番号 -> 索引エントリ / 正規化したテキスト
+        self._entries: list[dict] = []
+        self._texts: list[str] = []
+        self._indexed: set[str] = set()
+        # n-gram -> 文書番号の昇順リスト
+        self._postings: dict[str, array] = {}
+        # 構築中に他のスレッドの refresh から新しい記録が届くことがあるので、追加は1つずつ行う
+        self._lock = threading.Lock()
+        # 先に登録し、走査中に加わった記録も取りこぼさないようにする（重複は _add で除く）
+        store.add_listener(self._on_new_entries)
+        for entry, record in store.scan():
+            self._add(entry, record)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _on_new_entries(self, entries: list[dict]):
+        for entry in entries:
+            if entry["id"] not in self._indexed:
+                self._add(entry, self.store.read(entry))
+
+    def _add(self, entry: dict, record: dict):
+        with self._lock:
+            if entry["id"] not in self._indexed:
+                self._add_locked(entry, record)
+
+    def _add_locked(self, entry: dict, record: dict):
+        doc = len(self._entries)
+        text = normalize(record.get("text", ""))
+        self._entries.append({**entry, "seq": record.get("seq"), "text": record.get("text", "")})
+        self._texts.append(text)
+        self._indexed.add(entry["id"])
+        for gram in ngrams(text, 1) | ngrams(text, 2):
+            postings = self._postings.get(gram)
+            if postings is None:
+                postings = self._postings[gram] = array("I")
+            postings.append(doc)
+
+    def _candidates(self, query: str):
+        # 全 n-gram を含む文書番号を新しい順に返す（必要な件数だけ取り出せるようジェネレータにする）
+        grams = ngrams(query, 2) if len(query) >= 2 else ngrams(query, 1)
+        lists = []
+        for gram in grams:
+            postings = self._postings.get(gram)
+            if postings is None:
+                return
+            lists.append(postings)
+        lists.sort(key=len)
+        smallest, others = lists[0], lists[1:]
+        for doc in reversed(smallest):
+            for postings in others:
+                i = bisect.bisect_left(postings, doc)
+                if i == len(postings) or postings[i] != doc:
+                    break
+            else:
+                yield doc
+
+    def search(self, query: str, debate_id: Optional[str] = None, since: Optional[str] = None,
+               until: Optional[str] = None, limit: int = 50) -> list[dict]:
+        # 新しいものから順に、条件に合う記録を limit 件まで返す
+        # 新しい記録をファイルから読むので、イベントループからは asyncio.to_thread で呼ぶ
+        self.store.refresh()
+        query = normalize(query)
+        if not query:
+            return []
+        hits = []
+        with self._lock:
+            for doc in self._candidates(query):
+                entry = self._entries[doc]
+                if debate_id is not None and entry["debate_id"] != debate_id:
+                    continue
+                if (since and entry["timestamp"] < since) or (until and entry["timestamp"] > until):
+                    continue
+                if query not in self._texts[doc]:
+                    continue
+                hits.append(entry)
+                if len(hits) >= limit:
+                    break
+        return [
+            {k: entry[k] for k in ("id", "debate_id", "timestamp", "seq", "text")}
+            for entry in sorted(hits, key=lambda e: e["timestamp"], reverse=True)
+        ]
+
+    def stats(self) -> dict:
+        return {"documents": len(self._entries), "terms": len(self._postings)}
@@ -0,0 +1,351 @@
+import asyncio
+import bisect
+import contextlib
+import json
+import os
+import re
+import threading
+from datetime import datetime
+from typing import Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows ではプロセス間のロックを行わない
+    fcntl = None
+
+# 1つのセグメントファイルの上限サイズ。超えたら次のファイルに切り替える
+STORE_SEGMENT_MAX_BYTES = int(os.environ.get("STORE_SEGMENT_MAX_BYTES", 16 * 1024 * 1024))
+# 書き込みをまとめる待ち時間（秒）。この間に届いた記録は1回の fsync で書き込まれる
+STORE_FLUSH_INTERVAL = float(os.environ.get("STORE_FLUSH_INTERVAL", 0.05))
+
+
+class TranscriptStore:
+    """認識結果の追記専用ストア
+
+    記録は segment-NNNNNN.jsonl に1行ずつ追記し、その位置を index.jsonl に追記する。
+    書き込みはバックグラウンドのタスクがまとめて行い、バッチごとに1回だけ fsync する。
+    インデックスはメモリに読み込み、debate_id と時刻で引けるようにしておく。
+    複数のワーカープロセスが同じディレクトリに書き込めるよう、書き込みはファイルロックで
+    直列化し、他のプロセスが追記した索引は読み出し時に取り込む。
+    sequence=True で投入した記録には、書き込むときにロックの中で討論ごとの通し番号 seq と
+    文字オフセット offset を付ける（どのプロセスが書いても番号が重ならない）。
+    """
+
+    def __init__(self, directory: str, segment_max_bytes: int = STORE_SEGMENT_MAX_BYTES,
+                 flush_interval: float = STORE_FLUSH_INTERVAL):
+        self.directory = directory
+        self.segment_max_bytes = segment_max_bytes
+        self.flush_interval = flush_interval
+        os.makedirs(directory, exist_ok=True)
+        self._index_path = os.path.join(directory, "index.jsonl")
+        self._lock_path = os.path.join(directory, "write.lock")
+        # debate_id -> 時刻順の索引エントリ
+        self._index: dict[str, list[dict]] = {}
+        # 索引ファイルのどこまでを読み込んだか
+        self._index_pos = 0
+        self._last_entry: Optional[dict] = None
+        # 新しい記録が索引に加わったときに呼ぶ関数（全文検索の索引などが登録する）
+        self._listeners: list = []
+        # refresh はイベントループの外（スレッド）から呼ぶので、同時に読み込まないようにする
+        self._refresh_lock = threading.Lock()
+        with self._locked():
+            self.refresh()
+            self._recover(self._last_entry)
+        self._queue: Optional[asyncio.Queue] = None
+        self._writer: Optional[asyncio.Task] = None
+        # debate_id -> 書き込みキューにあってまだ書き終えていない記録の Future
+        self._unwritten: dict[str, set] = {}
+        # 書き込み側で読んだ索引の位置と、debate_id -> (最後の索引エントリ, 記録数)（書き込みのロック中だけ使う）
+        self._sequence_pos = 0
+        self._sequence_last: dict[str, tuple[dict, int]] = {}
+        self.batches = 0
+        self.records = 0
+
+    def _segment_path(self, segment: int) -> str:
+        return os.path.join(self.directory, f"segment-{segment:06d}.jsonl")
+
+    @contextlib.contextmanager
+    def _locked(self):
+        with open(self._lock_path, "a") as lock:
+            if fcntl is not None:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def refresh(self):
+        # 索引ファイルに追記された分（他のプロセスの書き込みを含む）を読み込む
+        # ファイルを読むので、イベントループからは asyncio.to_thread で呼ぶ
+        with self._refresh_lock:
+            self._refresh()
+
+    def _refresh(self):
+        try:
+            if os.path.getsize(self._index_path) <= self._index_pos:
+                return
+        except OSError:
+            return
+        added = []
+        with open(self._index_path, "rb") as f:
+            f.seek(self._index_pos)
+            for line in f:
+                if not line.endswith(b"\n"):
+                    # 書き込み途中の行は次回に読む
+                    break
+                self._index_pos += len(line)
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                self._add_to_index(entry)
+                self._last_entry = entry
+                added.append(entry)
+        for listener in self._listeners:
+            listener(added)
+
+    def add_listener(self, listener):
+        # listener(entries) は以降に索引へ加わった記録のエントリを受け取る
+        self._listeners.append(listener)
+
+    def scan(self):
+        # 全記録を (エントリ, 記録) の組で返す。セグメントファイルを先頭から順に読む
+        self.refresh()
+        with self._refresh_lock:
+            entries = sorted((e for es in self._index.values() for e in es),
+                             key=lambda e: (e["segment"], e["offset"]))
+        handle, current = None, None
+        try:
+            for entry in entries:
+                if entry["segment"] != current:
+                    if handle is not None:
+                        handle.close()
+                    current = entry["segment"]
+                    handle = open(self._segment_path(current), "rb")
+                handle.seek(entry["offset"])
+                yield entry, json.loads(handle.read(entry["length"]))
+        finally:
+            if handle is not None:
+                handle.close()
+
+    def _current_segment(self) -> int:
+        # 最も新しいセグメント番号を返す。上限サイズに達していれば次の番号にする
+        numbers = [int(m.group(1)) for name in os.listdir(self.directory)
+                   if (m := re.fullmatch(r"segment-(\d{6})\.jsonl", name))]
+        segment = max(numbers, default=1)
+        path = self._segment_path(segment)
+        if os.path.exists(path) and os.path.getsize(path) >= self.segment_max_bytes:
+            segment += 1
+        return segment
+
+    def _recover(self, last: Optional[dict]):
+        # 索引の書き込み前に停止した場合、データファイルに残った記録を索引に戻す
+        # 最後に索引に載った記録の続きと、それより新しいセグメントファイルを全て読む
+        numbers = sorted(int(m.group(1)) for name in os.listdir(self.directory)
+                         if (m := re.fullmatch(r"segment-(\d{6})\.jsonl", name)))
+        recovered = []
+        for segment in numbers:
+            if last is not None and segment < last["segment"]:
+                continue
+            offset = last["offset"] + last["length"] if last is not None and segment == last["segment"] else 0
+            with open(self._segment_path(segment), "rb") as f:
+                f.seek(offset)
+                for line in f:
+                    if not line.endswith(b"\n"):
+                        break
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        break
+                    recovered.append(self._make_entry(record, segment, offset, len(line)))
+                    offset += len(line)
+        if recovered:
+            self._write_index(recovered)
+            self.refresh()
+            print(f"索引に復旧した記録: {len(recovered)}件")
+
+    @staticmethod
+    def _make_entry(record: dict, segment: int, offset: int, length: int) -> dict:
+        entry = {
+            "id": f"{segment:06d}:{offset}",
+            "debate_id": record["debate_id"],
+            "timestamp": record["timestamp"],
+            "segment": segment,
+            "offset": offset,
+            "length": length,
+        }
+        if "seq" in record and "offset" in record:
+            # 次の記録の番号と文字オフセットを索引だけで決められるようにしておく
+            entry["seq"] = record["seq"]
+            entry["text_end"] = record["offset"] + len(record["text"]) + 1
+        return entry
+
+    def _next_sequence(self, debate_id: str) -> tuple[int, int]:
+        # 書き込みのロック中に呼ぶ。討論の次の (seq, 文字オフセット) を返す
+        # 他のプロセスが書いた分も含め、前回から索引に追記されたエントリを読む
+        if os.path.exists(self._index_path):
+            with open(self._index_path, "rb") as f:
+                f.seek(self._sequence_pos)
+                for line in f:
+                    if not line.endswith(b"\n"):
+                        break
+                    self._sequence_pos += len(line)
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+                    _, count = self._sequence_last.get(entry["debate_id"], (None, 0))
+                    self._sequence_last[entry["debate_id"]] = (entry, count + 1)
+        last, count = self._sequence_last.get(debate_id, (None, 0))
+        if last is None:
+            return 0, 0
+        if "seq" in last:
+            return last["seq"] + 1, last["text_end"]
+        # 索引に番号を載せる前に書かれた記録は、記録そのものを読む
+        record = self.read(last)
+        return record.get("seq", count - 1) + 1, record.get("offset", 0) + len(record.get("text", "")) + 1
+
+    def _add_to_index(self, entry: dict):
+        entries = self._index.setdefault(entry["debate_id"], [])
+        if entries and entries[-1]["timestamp"] > entry["timestamp"]:
+            bisect.insort(entries, entry, key=lambda e: e["timestamp"])
+        else:
+            entries.append(entry)
+
+    def submit(self, debate_id: str, record: dict, sequence: bool = False) -> asyncio.Future:
+        # 記録を書き込みキューに入れる。返す Future は fsync が終わると索引エントリで完了する
+        # sequence=True なら、書き込むときに seq と offset を付ける（索引エントリの seq で分かる）
+        if self._writer is None or self._writer.done():
+            self._queue = asyncio.Queue()
+            self._writer = asyncio.create_task(self._write_loop())
+        record = {"debate_id": debate_id, "timestamp": datetime.now().isoformat(), **record}
+        done = asyncio.get_running_loop().create_future()
+        unwritten = self._unwritten.setdefault(debate_id, set())
+        unwritten.add(done)
+        done.add_done_callback(lambda f: self._written(debate_id, f))
+        self._queue.put_nowait((record, sequence, done))
+        return done
+
+    def _written(self, debate_id: str, future: asyncio.Future):
+        unwritten = self._unwritten.get(debate_id)
+        if unwritten is not None:
+            unwritten.discard(future)
+            if not unwritten:
+                del self._unwritten[debate_id]
+
+    async def wait_written(self, debate_id: str):
+        # 討論の記録のうち、書き込みキューにあるものを書き終えるまで待つ（失敗したものは待たない）
+        unwritten = self._unwritten.get(debate_id)
+        if unwritten:
+            await asyncio.gather(*unwritten, return_exceptions=True)
+
+    def append_many(self, records: list[dict]) -> list[dict]:
+        # 移行ツールなどイベントループの外から同期的に書き込む（debate_id と timestamp は呼び出し側で設定する）
+        entries = self._write_batch(records)
+        self.refresh()
+        self.batches += 1
+        self.records += len(entries)
+        return entries
+
+    async def close(self):
+        # キューに残っている記録を書き終えてから書き込みタスクを止める
+        if self._writer is not None and not self._writer.done():
+            await self._queue.put(None)
+            await self._writer
+
+    async def _write_loop(self):
+        stop = False
+        while not stop:
+            batch = [await self._queue.get()]
+            await asyncio.sleep(self.flush_interval)
+            while not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+            if None in batch:
+                stop = True
+                batch = [item for item in batch if item is not None]
+            if not batch:
+                continue
+
+            try:
+                entries = await asyncio.to_thread(self._write_batch, [record for record, _, _ in batch],
+                                                  [sequence for _, sequence, _ in batch])
+            except Exception as e:
+                print(f"認識結果の書き込みエラー: {str(e)}")
+                for _, _, done in batch:
+                    if not done.done():
+                        done.set_exception(e)
+                continue
+
+            await asyncio.to_thread(self.refresh)
+            for entry, (_, _, done) in zip(entries, batch):
+                if not done.done():
+                    done.set_result(entry)
+            self.batches += 1
+            self.records += len(entries)
+
+    def _write_batch(self, records: list[dict], sequences: Optional[list[bool]] = None) -> list[dict]:
+        # ワーカースレッドで実行される。データを書いて fsync してから索引を書く
+        entries = []
+        with self._locked():
+            if sequences is not None:
+                # 番号はロックの中で付けるので、複数のプロセスが同じ討論に書いても重ならない
+                positions = {}
+                for record, sequence in zip(records, sequences):
+                    if not sequence:
+                        continue
+                    debate_id = record["debate_id"]
+                    if debate_id not in positions:
+                        positions[debate_id] = self._next_sequence(debate_id)
+                    seq, offset = positions[debate_id]
+                    record["seq"], record["offset"] = seq, offset
+                    positions[debate_id] = (seq + 1, offset + len(record["text"]) + 1)
+            segment = self._current_segment()
+            with open(self._segment_path(segment), "ab") as f:
+                offset = f.tell()
+                for record in records:
+                    line = (json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8")
+                    f.write(line)
+                    entries.append(self._make_entry(record, segment, offset, len(line)))
+                    offset += len(line)
+                f.flush()
+                os.fsync(f.fileno())
+            self._write_index(entries)
+        return entries
+
+    def _write_index(self, entries: list[dict]):
+        with open(self._index_path, "a", encoding="utf-8") as f:
+            for entry in entries:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def debate_ids(self) -> list[str]:
+        self.refresh()
+        with self._refresh_lock:
+            return sorted(self._index)
+
+    def entries(self, debate_id: str, since: Optional[str] = None, until: Optional[str] = None) -> list[dict]:
+        # since/until は ISO 形式の時刻（文字列比較で範囲を絞る）
+        self.refresh()
+        with self._refresh_lock:
+            entries = self._index.get(debate_id, [])
+            start = bisect.bisect_left(entries, since, key=lambda e: e["timestamp"]) if since else 0
+            end = bisect.bisect_right(entries, until, key=lambda e: e["timestamp"]) if until else len(entries)
+            return entries[start:end]
+
+    def read(self, entry: dict) -> dict:
+        with open(self._segment_path(entry["segment"]), "rb") as f:
+            f.seek(entry["offset"])
+            return json.loads(f.read(entry["length"]))
+
+    async def fetch(self, debate_id: str, since: Optional[str] = None, until: Optional[str] = None) -> list[dict]:
+        return await asyncio.to_thread(lambda: [self.read(e) for e in self.entries(debate_id, since, until)])
+
+    def stats(self) -> dict:
+        return {
+            "debates": len(self._index),
+            "records": self.records,
+            "batches": self.batches,
+            "pending": self._queue.qsize() if self._queue is not None else 0,
+        }
@@ -0,0 +1,89 @@
+import os
+
+import numpy as np
+
+# フレーム長（サンプル数）。16kHzで16ms。各ストリーミングモードのチャンク長（8192 / 2048 サンプル）を
+# 割り切れる必要があるので、10〜30ms にするなら 256（16ms）か 512（32ms）を使う（160 や 320 は不可）
+VAD_FRAME_SAMPLES = int(os.environ.get("VAD_FRAME_SAMPLES", 256))
+# ノイズフロアの何倍のエネルギーを発話候補とみなすか
+VAD_ENERGY_RATIO = float(os.environ.get("VAD_ENERGY_RATIO", 4.0))
+# 発話終了後も発話として扱い続ける時間（秒）
+VAD_HANGOVER = float(os.environ.get("VAD_HANGOVER", 0.3))
+
+
+class StreamingVAD:
+    """エネルギーとゼロ交差率による逐次の発話区間検出
+
+    ノイズフロアは非発話フレームのエネルギーから追従させ、発話の切れ目はハングオーバーで
+    埋める。入力は音量補正前の float32 のチャンク（長さはフレーム長の倍数）。
+    """
+
+    def __init__(self, sample_rate: int = 16000, frame_samples: int = VAD_FRAME_SAMPLES,
+                 energy_ratio: float = VAD_ENERGY_RATIO, hangover: float = VAD_HANGOVER,
+                 min_energy: float = 1e-7, max_zcr: float = 0.4, noise_adapt: float = 0.05):
+        self.sample_rate = sample_rate
+        self.frame_samples = frame_samples
+        self.energy_ratio = energy_ratio
+        self.hangover_frames = round(hangover * sample_rate / frame_samples)
+        self.min_energy = min_energy
+        self.max_zcr = max_zcr
+        self.noise_adapt = noise_adapt
+        self.noise_floor = None
+        self._hangover_left = 0
+        # 最後の発話フレーム以降に続いている非発話フレーム数
+        self._silent_frames = 0
+        self.speech_frames = 0
+        self.total_frames = 0
+
+    @property
+    def silence_seconds(self) -> float:
+        return self._silent_frames * self.frame_samples / self.sample_rate
+
+    def process(self, chunk: np.ndarray) -> np.ndarray:
+        # フレームごとの発話判定（bool配列）を返す
+        if len(chunk) % self.frame_samples:
+            raise ValueError("チャンク長はフレーム長の倍数である必要があります")
+        frames = chunk.reshape(-1, self.frame_samples)
+        energy = np.einsum("ij,ij->i", frames, frames) / self.frame_samples
+        signs = np.signbit(frames)
+        zcr = np.count_nonzero(signs[:, 1:] != signs[:, :-1], axis=1) / self.frame_samples
+
+        speech = np.zeros(len(frames), dtype=bool)
+        for i, (e, z) in enumerate(zip(energy.tolist(), zcr.tolist())):
+            if self.noise_floor is None:
+                self.noise_floor = max(e, self.min_energy)
+
+            threshold = max(self.noise_floor * self.energy_ratio, self.min_energy)
+            # 高いゼロ交差率は雑音とみなすが、十分に大きい摩擦音は発話として残す
+            candidate = e > threshold and (z < self.max_zcr or e > threshold * 4)
+
+            if candidate:
+                self._hangover_left = self.hangover_frames
+                # 背景雑音が上がったまま発話扱いが続かないよう、発話中もゆっくり追従させる
+                self.noise_floor += self.noise_adapt / 50 * (e - self.noise_floor)
+            else:
+                # 非発話フレームでノイズフロアを更新する（下がるときは即座に追従）
+                if e < self.noise_floor:
+                    self.noise_floor = max(e, self.min_energy)
+                else:
+                    self.noise_floor += self.noise_adapt * (e - self.noise_floor)
+
+            if candidate or self._hangover_left > 0:
+                if not candidate:
+                    self._hangover_left -= 1
+                speech[i] = True
+                self._silent_frames = 0
+            else:
+                self._silent_frames += 1
+
+        self.speech_frames += int(speech.sum())
+        self.total_frames += len(frames)
+        return speech
+
+    def stats(self) -> dict:
+        return {
+            "speech_frames": self.speech_frames,
+            "total_frames": self.total_frames,
+            "speech_ratio": round(self.speech_frames / self.total_frames, 3) if self.total_frames else 0.0,
+            "noise_floor": self.noise_floor,
+        }
@@ -1,10 +1,15 @@
 # API_Server/video_call_API.py
 
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect
+from fastapi import FastAPI, WebSocket, WebSocketDisconnect, Query
 from fastapi.middleware.cors import CORSMiddleware
 import json
 from typing import Dict, Set
 
+import relay_backplane
+import relay_messaging
+from connection_registry import ConnectionRegistry
+from signaling_router import SignalingRouter
+
 app = FastAPI()
 
 app.add_middleware(
@@ -19,17 +24,32 @@ class ConnectionManager:
     def __init__(self):
         # 部屋ごとの接続を管理
         self.rooms: Dict[str, Dict[str, Dict]] = {}
+        # 部屋ごとの、他のワーカープロセスに接続しているユーザーのカメラの状態
+        self.remote_camera: Dict[str, Dict[str, bool]] = {}
+        # 同じ部屋の、他のワーカープロセスの接続とメッセージをやり取りする
+        self.backplane = relay_backplane.create_backplane("video")
+        self.backplane.on_message = self._on_remote_message
+        self.router = SignalingRouter(self)
 
-    async def connect(self, websocket: WebSocket, room_id: str, user: str):
+    async def connect(self, websocket: WebSocket, room_id: str, user: str, ice_batch: bool = False):
         await websocket.accept()
+        await self.backplane.start()
         
         if room_id not in self.rooms:
             self.rooms[room_id] = {}
         
         self.rooms[room_id][user] = {
             "websocket": websocket,
-            "camera_on": False
+            "camera_on": False,
+            "ice_batch": ice_batch
         }
+        self.backplane.join(room_id, user)
+
+        # 部屋にいるユーザーとカメラの状態を1つのメッセージでまとめて送る
+        await websocket.send_text(relay_messaging.encode({
+            "type": "room_snapshot",
+            "users": self.snapshot(room_id, exclude_user=user)
+        }))
         
         # カメラステータスの変更をブロードキャスト
         await self.broadcast({
@@ -40,25 +60,86 @@ class ConnectionManager:
         
         print(f"ユーザー {user} が部屋 {room_id} に接続しました")
 
-    def disconnect(self, room_id: str, user: str):
+    def disconnect(self, room_id: str, user: str, websocket: WebSocket = None):
         if room_id in self.rooms and user in self.rooms[room_id]:
+            # 同じユーザーが再接続した後なら、新しい接続は残す
+            if websocket is not None and self.rooms[room_id][user]["websocket"] is not websocket:
+                return
             del self.rooms[room_id][user]
+            self.backplane.leave(room_id, user)
+            self.router.forget(room_id, user)
+            # 誰もいなくなった部屋は削除する
+            if not self.rooms[room_id]:
+                del self.rooms[room_id]
+                self.remote_camera.pop(room_id, None)
             print(f"ユーザー {user} が部屋 {room_id} から切断されました")
 
+    def snapshot(self, room_id: str, exclude_user: str = None) -> list:
+        users = {
+            user: connection["camera_on"]
+            for user, connection in self.rooms.get(room_id, {}).items()
+        }
+        # 他のワーカープロセスのユーザーは、バックプレーンの参加者（"ノード:ユーザー"）にいる間だけ含める
+        remote_users = {m.split(":", 1)[1] for m in self.backplane.members(room_id) if ":" in m}
+        for user, camera_on in self.remote_camera.get(room_id, {}).items():
+            if user in remote_users:
+                users.setdefault(user, camera_on)
+        users.pop(exclude_user, None)
+        return [{"user": user, "camera_on": camera_on} for user, camera_on in users.items()]
+
+    def is_local(self, room_id: str, user: str) -> bool:
+        return user in self.rooms.get(room_id, {})
+
+    def wants_ice_batch(self, room_id: str, user: str) -> bool:
+        return self.rooms.get(room_id, {}).get(user, {}).get("ice_batch", False)
+
+    def set_camera_status(self, room_id: str, user: str, camera_on: bool):
+        if room_id in self.rooms and user in self.rooms[room_id]:
+            self.rooms[room_id][user]["camera_on"] = camera_on
+
     async def broadcast(self, message: dict, room_id: str, exclude_user: str = None):
+        # JSON への変換は1回だけ行い、同じ文字列を全員に送る
+        await self.broadcast_text(relay_messaging.encode(message), room_id, exclude_user,
+                                  camera=message.get("camera_on"))
+
+    async def broadcast_text(self, text: str, room_id: str, exclude_user: str = None, camera: bool = None):
+        await self._send_to_room(text, room_id, exclude_user)
+        await self.backplane.publish(room_id, text, exclude=exclude_user, camera=camera)
+
+    async def send_to_user(self, room_id: str, user: str, text: str):
+        connection = self.rooms.get(room_id, {}).get(user)
+        if connection is None:
+            return
+        try:
+            await connection["websocket"].send_text(text)
+        except Exception as e:
+            print(f"ユーザー {user} への送信中にエラー: {e}")
+
+    async def _on_remote_message(self, room_id: str, text: str, meta: dict):
+        if meta.get("target") is not None:
+            if self.is_local(room_id, meta["target"]):
+                await self.router.deliver(room_id, meta["target"], meta.get("sender"), text, meta.get("ice", False))
+            return
+        if meta.get("camera") is not None and meta.get("exclude") is not None:
+            self.remote_camera.setdefault(room_id, {})[meta["exclude"]] = meta["camera"]
+        await self._send_to_room(text, room_id, meta.get("exclude"))
+
+    async def _send_to_room(self, text: str, room_id: str, exclude_user: str = None):
         if room_id not in self.rooms:
             return
 
-        for user, connection in self.rooms[room_id].items():
-            if exclude_user is None or user != exclude_user:
-                try:
-                    await connection["websocket"].send_json(message)
-                except Exception as e:
-                    print(f"ブロードキャスト中にエラー: {e}")
+        connections = [
+            connection["websocket"]
+            for user, connection in self.rooms[room_id].items()
+            if exclude_user is None or user != exclude_user
+        ]
+        failed = await relay_messaging.broadcast_text(connections, text)
+        if failed:
+            print(f"ブロードキャスト中にエラー: {len(failed)}件の接続に送信できませんでした")
 
     async def update_camera_status(self, room_id: str, user: str, camera_on: bool):
         if room_id in self.rooms and user in self.rooms[room_id]:
-            self.rooms[room_id][user]["camera_on"] = camera_on
+            self.set_camera_status(room_id, user, camera_on)
             await self.broadcast({
                 "type": "user_status_change", 
                 "user": user,
@@ -66,42 +147,62 @@ class ConnectionManager:
             }, room_id, exclude_user=user)
 
 manager = ConnectionManager()
+# 接続の後始末とハートビート
+registry = ConnectionRegistry("video")
 
 @app.websocket("/ws/debate/{debate_id}")
 async def websocket_endpoint(
     websocket: WebSocket, 
     debate_id: str, 
-    user: str
+    user: str,
+    ice_batch: bool = Query(False),
+    heartbeat: bool = Query(False)
 ):
+    # ice_batch: ICE 候補を ice_candidate_batch メッセージにまとめて受け取る
+    # heartbeat: サーバーからの ping を受け取り、応答がなければ切断してよいクライアント
     try:
-        await manager.connect(websocket, debate_id, user)
-        
-        while True:
-            try:
-                data = await websocket.receive_json()
-                
-                # 送信者情報を追加
-                data['sender'] = user
-                
-                # 特定のメッセージタイプのみブロードキャスト
-                broadcast_types = ['offer', 'answer', 'ice_candidate', 'camera_status']
-                if data.get('type') in broadcast_types:
-                    await manager.broadcast(data, debate_id, exclude_user=user)
-                
-            except WebSocketDisconnect:
-                break
-            except Exception as e:
-                print(f"メッセージ処理中にエラー: {e}")
-                break
+        # どの経路でループを抜けても接続を部屋から外す
+        async with registry.track(debate_id, websocket, lambda: manager.disconnect(debate_id, user, websocket),
+                                  key=user, heartbeat=heartbeat) as entry:
+            await manager.connect(websocket, debate_id, user, ice_batch)
+            
+            while True:
+                try:
+                    data = await relay_messaging.receive(websocket)
+                    if await registry.received(entry, data):
+                        continue
+                    
+                    # 送信者情報を追加
+                    data['sender'] = user
+                    
+                    # シグナリングのメッセージだけを送る。target があればその相手だけに送る
+                    await manager.router.route(debate_id, user, data)
+                    
+                except WebSocketDisconnect:
+                    break
+                except Exception as e:
+                    print(f"メッセージ処理中にエラー: {e}")
+                    break
     
     except WebSocketDisconnect:
-        manager.disconnect(debate_id, user)
+        pass
     
     finally:
         try:
             await websocket.close()
         except:
             pass
+
+@app.get("/health")
+async def health_check():
+    return {
+        "status": "healthy",
+        "rooms": {room_id: len(users) for room_id, users in manager.rooms.items()},
+        "signaling": manager.router.stats(),
+        "registry": registry.stats(),
+        "backplane": manager.backplane.stats()
+    }
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8004)
\ No newline at end of file
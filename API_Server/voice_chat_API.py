@@ -1,8 +1,13 @@
 from fastapi import FastAPI, WebSocket, WebSocketDisconnect, Query
 from fastapi.middleware.cors import CORSMiddleware
+from starlette.websockets import WebSocketState
 import json
 from typing import Dict, Set, Optional
 
+import relay_backplane
+import relay_messaging
+from connection_registry import ConnectionRegistry
+
 app = FastAPI()
 
 app.add_middleware(
@@ -16,44 +21,53 @@ app.add_middleware(
 class ConnectionManager:
     def __init__(self):
         self.rooms: Dict[str, Set[WebSocket]] = {}
+        # 同じ部屋の、他のワーカープロセスの接続とメッセージをやり取りする
+        self.backplane = relay_backplane.create_backplane("voice")
+        self.backplane.on_message = self._on_remote_message
 
     async def connect(self, websocket: WebSocket, room_id: str, user: Optional[str] = None):
         await websocket.accept()
+        await self.backplane.start()
         if room_id not in self.rooms:
             self.rooms[room_id] = set()
         self.rooms[room_id].add(websocket)
+        self.backplane.join(room_id, str(id(websocket)))
         print(f"User {user} connected to room {room_id}")
 
     def disconnect(self, websocket: WebSocket, room_id: str):
-        if room_id in self.rooms:
+        if room_id in self.rooms and websocket in self.rooms[room_id]:
             self.rooms[room_id].discard(websocket)
+            self.backplane.leave(room_id, str(id(websocket)))
             if not self.rooms[room_id]:
                 del self.rooms[room_id]
 
     async def broadcast_to_room(self, message: dict, room_id: str, sender: WebSocket):
+        # JSON への変換は1回だけ行い、同じ文字列を全員に送る
+        text = relay_messaging.encode(message)
+        await self._send_to_room(text, room_id, sender)
+        await self.backplane.publish(room_id, text)
+
+    async def _on_remote_message(self, room_id: str, text: str, meta: dict):
+        await self._send_to_room(text, room_id, None)
+
+    async def _send_to_room(self, text: str, room_id: str, sender: Optional[WebSocket]):
         if room_id in self.rooms:
-            for connection in self.rooms[room_id]:
-                if connection != sender:
-                    await connection.send_json(message)
+            failed = await relay_messaging.broadcast_text(self.rooms[room_id], text, exclude=sender)
+            for connection in failed:
+                self.disconnect(connection, room_id)
 
 manager = ConnectionManager()
+# 接続の後始末とハートビート
+registry = ConnectionRegistry("voice")
 
 @app.websocket("/ws/debate/{debate_id}")
 async def websocket_endpoint(
     websocket: WebSocket, 
     debate_id: str, 
-    user: Optional[str] = Query(None)
+    user: Optional[str] = Query(None),
+    heartbeat: bool = Query(False)
 ):
-    try:
-        await manager.connect(websocket, debate_id, user)
-        
-        while True:
-            data = await websocket.receive_json()
-            # ユーザー情報を含めてブロードキャスト
-            broadcast_data = {**data, "sender": user}
-            await manager.broadcast_to_room(broadcast_data, debate_id, websocket)
-            
-    except WebSocketDisconnect:
+    async def cleanup():
         manager.disconnect(websocket, debate_id)
         # 切断通知を送信
         await manager.broadcast_to_room(
@@ -65,9 +79,38 @@ async def websocket_endpoint(
             debate_id,
             websocket
         )
+
+    try:
+        # どの経路で終わっても接続を外して切断通知を送る
+        async with registry.track(debate_id, websocket, cleanup, key=user, heartbeat=heartbeat) as entry:
+            await manager.connect(websocket, debate_id, user)
+            
+            while True:
+                data = await relay_messaging.receive(websocket)
+                if await registry.received(entry, data):
+                    continue
+                # ユーザー情報を含めてブロードキャスト（受信した dict にそのまま追加する）
+                data["sender"] = user
+                await manager.broadcast_to_room(data, debate_id, websocket)
+            
+    except WebSocketDisconnect:
+        pass
     except Exception as e:
         print(f"WebSocket error: {e}")
-        await websocket.close()
+        if websocket.client_state == WebSocketState.CONNECTED:
+            try:
+                await websocket.close()
+            except Exception:
+                pass
+
+@app.get("/health")
+async def health_check():
+    return {
+        "status": "healthy",
+        "rooms": {room_id: len(connections) for room_id, connections in manager.rooms.items()},
+        "registry": registry.stats(),
+        "backplane": manager.backplane.stats()
+    }
 
 if __name__ == "__main__":
     import uvicorn
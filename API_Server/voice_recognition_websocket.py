@@ -1,14 +1,26 @@
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect
+from fastapi import FastAPI, WebSocket, WebSocketDisconnect, Query, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
 from vosk import Model, KaldiRecognizer
-import json
 import os
-from datetime import datetime
 from pathlib import Path
+from typing import Optional
 import asyncio
-import numpy as np
+import time
+import uuid
 
-app = FastAPI()
+from audio_buffer import AudioRingBuffer
+from audio_conditioning import AudioConditioner
+from decoding_engine import DecodingEngine
+from metrics import LatencyHistogram
+from recognizer_pool import RecognizerPool
+from service_resources import ServiceResources, warm_page_cache
+from transcript_index import TranscriptIndex
+from transcript_store import TranscriptStore
+from vad import VAD_FRAME_SAMPLES, StreamingVAD
+
+# 音声認識モデルは import 時ではなく lifespan で読み込む（RESOURCE_LOADING）
+resources = ServiceResources("speech")
+app = FastAPI(lifespan=resources.lifespan)
 
 # CORSミドルウェア設定
 app.add_middleware(
@@ -24,141 +36,191 @@ ROOT_DIR = Path(__file__).parent.absolute()
 TEXT_DIR = os.path.join(ROOT_DIR, "text")
 os.makedirs(TEXT_DIR, exist_ok=True)
 
-print(f"認識結果の保存先: {TEXT_DIR}")
+# 認識結果は text/store/ 以下に追記していく（旧形式のファイルは migrate_transcripts.py で取り込める）
+transcript_store = TranscriptStore(os.path.join(TEXT_DIR, "store"))
+print(f"認識結果の保存先: {transcript_store.directory}")
+# 終了時に書き込みキューに残っている認識結果を書き終える
+resources.add_closer("transcript_store", transcript_store.close)
+MODEL_PATH = os.path.join(ROOT_DIR, "model-large-ja")
+decoding_engine = DecodingEngine()
+# 認識器は接続・セグメントごとに作り直さず、リセットして使い回す
+recognizer_pool = RecognizerPool(lambda: KaldiRecognizer(model.value, 16000))
 
-model = Model(os.path.join(ROOT_DIR, "model-large-ja"))
+def load_model():
+   # Vosk はモデルがないとプロセスごと異常終了するので、先に確かめる
+   if not os.path.isdir(MODEL_PATH):
+       raise FileNotFoundError(f"音声認識モデルがありません: {MODEL_PATH}")
+   return Model(MODEL_PATH)
 
-def save_recognition_result(text: str) -> tuple[bool, str]:
-   try:
-       timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-       filename = f'speech_recognition_{timestamp}.json'
-       filepath = os.path.join(TEXT_DIR, filename)
-       
-       data = {
-           "timestamp": datetime.now().isoformat(),
-           "text": text
-       }
-       
-       with open(filepath, 'w', encoding='utf-8') as f:
-           json.dump(data, f, ensure_ascii=False, indent=2)
-       
-       print(f"認識結果を保存しました: {filepath}")
-       return True, filename
-   except Exception as e:
-       print(f"保存中にエラーが発生しました: {str(e)}")
-       return False, str(e)
+# モデルを読み込んだら、最初の接続のために認識器をいくつか作っておく
+model = resources.add("model", load_model, on_loaded=lambda _: recognizer_pool.prewarm())
+resources.add_warmer("model_files", lambda: warm_page_cache(MODEL_PATH))
+# 保存済みの文字起こしの全文検索用インデックス（新しい記録は自動で追加される）
+# 全記録を読んで構築するので、モデルと同じく lifespan で読み込む
+transcript_index = resources.add("transcript_index", lambda: TranscriptIndex(transcript_store))
+# VADで判定したフレーム数（全セッション合計）
+vad_totals = {"frames": 0, "speech_frames": 0}
 
+# ストリーミングモード。接続時に ?mode= で選択する
+# chunk_size: デコード単位（float32のバイト数）、partial_interval: 部分結果を送る最短間隔（秒）
+STREAMING_MODES = {
+   "default": {"chunk_size": 32768, "partial_interval": 0.0},
+   "low_latency": {"chunk_size": 8192, "partial_interval": 0.2},
+}
+DEFAULT_STREAMING_MODE = os.environ.get("SPEECH_STREAMING_MODE", "default")
+# VAD はチャンクをフレームに分けて判定するので、全モードのチャンク長がフレーム長で割り切れる必要がある
+# （起動時に確かめ、接続のたびにエラーになるのを防ぐ）
+for _name, _profile in STREAMING_MODES.items():
+   if (_profile["chunk_size"] // 4) % VAD_FRAME_SAMPLES:
+       raise ValueError(
+           f"VAD_FRAME_SAMPLES={VAD_FRAME_SAMPLES} はモード {_name} のチャンク長 "
+           f"{_profile['chunk_size'] // 4} サンプルを割り切れません（128 / 256 / 512 などを指定してください）"
+       )
+# モードごとの、音声受信から結果送信までの遅延と、音声・デコード時間の合計
+streaming_stats = {
+   name: {"partial": LatencyHistogram(), "final": LatencyHistogram(), "audio_seconds": 0.0, "decode_seconds": 0.0}
+   for name in STREAMING_MODES
+}
 
+@app.websocket("/ws/debate/{debate_id}/")
+async def websocket_endpoint(
+   websocket: WebSocket,
+   debate_id: str,
+   mode: Optional[str] = Query(None),
+   since: Optional[int] = Query(None),
+   speaker: Optional[str] = Query(None)
+):
+   await websocket.accept()
+   mode = mode or DEFAULT_STREAMING_MODE
+   if mode not in STREAMING_MODES:
+       print(f"不明なストリーミングモードのため default を使用します [{debate_id}]: {mode}")
+       mode = "default"
+   profile = STREAMING_MODES[mode]
+   stats = streaming_stats[mode]
+   try:
+       # モデルの読み込みが終わっていなければ待つ
+       await model.get()
+   except Exception as e:
+       print(f"音声認識モデルを読み込めません [{debate_id}]: {e}")
+       await websocket.close(code=1011)
+       return
+   rec = await recognizer_pool.acquire()
+   # 確定したセグメントはその都度ストアに書き込み、メモリには溜めない
+   session_id = uuid.uuid4().hex[:12]
+   pending_saves = set()
+   saved_segments = 0
+   CHUNK_SIZE = profile["chunk_size"]
+   buffer = AudioRingBuffer(CHUNK_SIZE)
+   conditioner = AudioConditioner(CHUNK_SIZE // 4)
+   vad = StreamingVAD()
+   segment_has_speech = False
+   MIN_SILENCE_DURATION = 0.5  # セグメントを区切る無音の長さ（秒）
 
-def process_audio_data(data: bytes) -> bytes:
-    try:
-        # バッファサイズチェック
-        if len(data) < 32768:
-            return data
-           
-        # バイトデータをfloat32配列に変換
-        float_data = np.frombuffer(data, dtype=np.float32).copy()
-        
-        # RMS値を計算して音量レベルを評価
-        rms = np.sqrt(np.mean(float_data**2))
-        print(f"元の音声データ特性 - RMS: {rms:.4f}")
+   last_partial = ""
+   last_partial_at = 0.0
 
-        # 極端な音量不足時の処理
-        if rms < 0.01:
-            # 最大20倍まで増幅可能
-            # 音量が非常に小さいほど、より大きく増幅
-            gain = min(20.0, 1.0 / (rms + 0.0001))
-            float_data *= gain
-            print(f"音量を {gain:.2f}倍 に大幅増幅しました")
-        elif rms < 0.05:
-            # 中程度に小さい場合は10倍まで増幅
-            gain = min(10.0, 0.5 / (rms + 0.001))
-            float_data *= gain
-            print(f"音量を {gain:.2f}倍 に増幅しました")
-        
-        # 増幅後の音量を再評価
-        post_gain_rms = np.sqrt(np.mean(float_data**2))
-        print(f"増幅後の音声データ特性 - RMS: {post_gain_rms:.4f}")
+   def on_saved(future):
+       nonlocal saved_segments
+       pending_saves.discard(future)
+       if future.cancelled() or future.exception() is not None:
+           print(f"セグメントの保存に失敗 [{debate_id}]")
+       else:
+           saved_segments += 1
 
-        # クリッピング防止と正規化
-        max_amplitude = np.max(np.abs(float_data))
-        if max_amplitude > 0:
-            # より緩やかな正規化
-            float_data = np.clip(float_data / max_amplitude * 0.99, -0.99, 0.99)
+   async def send_result(result_type: str, text: str, received_at: float):
+       nonlocal last_partial, last_partial_at
+       message = {
+           "type": result_type,
+           "text": text,
+           "debate_id": debate_id
+       }
+       if result_type == "final":
+           last_partial = ""
+           segment = {"text": text, "session": session_id}
+           if speaker is not None:
+               segment["speaker"] = speaker
+           # seq と offset はストアが書き込むときに（他のワーカーの書き込みと重ならないように）付けるので、
+           # 書き終えてから送る
+           future = transcript_store.submit(debate_id, segment, sequence=True)
+           pending_saves.add(future)
+           future.add_done_callback(on_saved)
+           print(f"認識されたテキスト [{debate_id}]: {text}")
+           try:
+               entry = await future
+               message.update(seq=entry["seq"], offset=entry["text_end"] - len(text) - 1)
+           except Exception:
+               # 保存の失敗は on_saved で表示する。結果は seq なしで送る
+               pass
+       else:
+           # 前回と同じ部分結果や、間隔が短すぎる部分結果は送らない
+           now = time.perf_counter()
+           if text == last_partial or now - last_partial_at < profile["partial_interval"]:
+               return
+           last_partial, last_partial_at = text, now
+           print(f"部分的な認識テキスト [{debate_id}]: {text}")
+       await websocket.send_json(message)
+       stats[result_type].observe(time.perf_counter() - received_at)
 
-        # float32からint16に変換
-        int_data = (float_data * 32767).astype(np.int16)
-        
-        return int_data.tobytes()
-    
-    except Exception as e:
-        print(f"音声データ処理中にエラー: {str(e)}")
-        return data
+   # 認識処理はデコードエンジンのワーカースレッドで順番に実行される
+   session = decoding_engine.open_session(rec, send_result, debate_id)
 
-@app.websocket("/ws/debate/{debate_id}/")
-async def websocket_endpoint(websocket: WebSocket, debate_id: str):
-   await websocket.accept()
-   rec = KaldiRecognizer(model, 16000)
-   accumulated_text = []
-   buffer = bytearray()
-   CHUNK_SIZE = 32768
-   silence_duration = 0
-   MIN_SILENCE_DURATION = 8192  # 無音判定の閾値
-
-   print(f"WebSocket接続開始 [{debate_id}]")
+   print(f"WebSocket接続開始 [{debate_id}] モード: {mode}")
 
    try:
+       if since is not None:
+           # 再接続したクライアントに、受け取っていないセグメント（seq が since より後）を再送する
+           # seq は討論全体の通し番号なので、speaker を指定しなければ他の話者のセグメントも再送する
+           # 書き込みキューに残っているセグメントも再送できるよう、書き終えるのを待ってから読む
+           await transcript_store.wait_written(debate_id)
+           resume_seq = since
+           for segment in await transcript_store.fetch(debate_id):
+               seq = segment.get("seq", -1)
+               if seq <= since:
+                   continue
+               resume_seq = max(resume_seq, seq)
+               if speaker is not None and segment.get("speaker") != speaker:
+                   continue
+               await websocket.send_json({
+                   "type": "final",
+                   "text": segment["text"],
+                   "debate_id": debate_id,
+                   "seq": seq,
+                   "offset": segment["offset"],
+                   "replay": True
+               })
+           # 再送を終えた位置（次に再接続するときの since）
+           await websocket.send_json({"type": "resume", "debate_id": debate_id, "seq": resume_seq})
+
        while True:
            try:
                data = await websocket.receive_bytes()
-               buffer.extend(data)
+               received_at = time.perf_counter()
+               buffer.write(data)
 
-               if len(buffer) >= CHUNK_SIZE:
-                   chunk = buffer[:CHUNK_SIZE]
-                   buffer = buffer[CHUNK_SIZE:]
-                   
-                   # 無音検出
-                   float_data = np.frombuffer(chunk, dtype=np.float32)
-                   rms = np.sqrt(np.mean(float_data**2))
-                   
-                   if rms < 0.01:  # 無音判定
-                       silence_duration += len(chunk)
-                       if silence_duration >= MIN_SILENCE_DURATION:
-                           # 長い無音があった場合、新しい認識セグメントを開始
-                           rec = KaldiRecognizer(model, 16000)
-                           silence_duration = 0
-                   else:
-                       silence_duration = 0
+               # 溜まったチャンクをコピーせずに順に取り出す
+               while (float_data := buffer.pop_chunk()) is not None:
+                   # 発話区間検出（非発話フレームはデコーダに渡さない）
+                   speech = vad.process(float_data)
+                   stats["audio_seconds"] += len(float_data) / 16000
+                   vad_totals["frames"] += len(speech)
+                   speech_frames = int(speech.sum())
+                   vad_totals["speech_frames"] += speech_frames
 
-                   processed_data = process_audio_data(bytes(chunk))
+                   if speech_frames == 0:
+                       if segment_has_speech and vad.silence_seconds >= MIN_SILENCE_DURATION:
+                           # 長い無音があった場合、現在のセグメントを確定して新しいセグメントを開始
+                           await session.end_segment()
+                           segment_has_speech = False
+                       continue
+                   segment_has_speech = True
 
-                   if rec.AcceptWaveform(processed_data):
-                       result = json.loads(rec.Result())
-                       if result.get('text'):
-                           text = result['text'].strip()
-                           if text:
-                               accumulated_text.append(text)
-                               print(f"認識されたテキスト [{debate_id}]: {text}")
-                               await websocket.send_json({
-                                   "type": "final",
-                                   "text": text,
-                                   "debate_id": debate_id
-                               })
-                   else:
-                       partial = json.loads(rec.PartialResult())
-                       if partial.get('partial'):
-                           partial_text = partial['partial'].strip()
-                           if partial_text:
-                               print(f"部分的な認識テキスト [{debate_id}]: {partial_text}")
-                               await websocket.send_json({
-                                   "type": "partial",
-                                   "text": partial_text,
-                                   "debate_id": debate_id
-                               })
+                   rms = conditioner.rms(float_data)
+                   processed_data = conditioner.condition(float_data, rms)
+                   if speech_frames < len(speech):
+                       processed_data = processed_data.reshape(-1, vad.frame_samples)[speech]
+                   # Vosk は bytes しか受け取らないため、ワーカーへの受け渡しでのみコピーする
+                   await session.feed(processed_data.tobytes(), received_at)
 
-           except json.JSONDecodeError as e:
-               print(f"JSON解析エラー [{debate_id}]: {str(e)}")
-               continue
            except ConnectionResetError:
                print(f"接続リセット [{debate_id}]")
                break
@@ -171,133 +233,111 @@ async def websocket_endpoint(websocket: WebSocket, debate_id: str):
    except Exception as e:
        print(f"予期せぬエラー [{debate_id}]: {str(e)}")
    finally:
-       # 残りのバッファを処理
-       if buffer and len(buffer) >= CHUNK_SIZE:
-           try:
-               processed_data = process_audio_data(bytes(buffer))
-               if rec.AcceptWaveform(processed_data):
-                   result = json.loads(rec.Result())
-                   if result.get('text'):
-                       text = result['text'].strip()
-                       if text:
-                           accumulated_text.append(text)
-           except Exception as e:
-               print(f"最終バッファ処理エラー [{debate_id}]: {str(e)}")
+       # 受信ループは毎回チャンクを取り出し切るので、残りはチャンク未満の端数のみ
+       if buffer.overrun_bytes:
+           print(f"受信バッファ溢れで破棄した音声 [{debate_id}]: {buffer.overrun_bytes}バイト")
+
+       # 投入済みの音声をすべて認識し、認識器をリセットしてからプールに戻す
+       await session.end_segment()
+       await session.close()
+       recognizer_pool.release(session.rec)
+       stats["decode_seconds"] += session.decode_seconds
 
-       if accumulated_text:
-           full_text = " ".join(accumulated_text)
-           success, filename = save_recognition_result(full_text)
-           if success:
-               try:
-                   await websocket.send_json({
-                       "type": "save",
-                       "message": f"認識結果を保存しました: {filename}",
-                       "debate_id": debate_id
-                   })
-               except:
-                   print(f"保存通知の送信に失敗 [{debate_id}]")
+       # 書き込み待ちのセグメントが保存されるのを待ってから通知する
+       if pending_saves:
+           await asyncio.gather(*pending_saves, return_exceptions=True)
+       if saved_segments:
+           print(f"認識結果を保存しました [{debate_id}]: {saved_segments}件のセグメント")
+           try:
+               await websocket.send_json({
+                   "type": "save",
+                   "message": f"認識結果を保存しました: {saved_segments}件のセグメント",
+                   "debate_id": debate_id
+               })
+           except:
+               print(f"保存通知の送信に失敗 [{debate_id}]")
        try:
            await websocket.close()
            print(f"WebSocket接続を終了 [{debate_id}]")
        except:
            pass
-@app.websocket("/ws/debate/{debate_id}/")
-async def websocket_endpoint(websocket: WebSocket, debate_id: str):
-   await websocket.accept()
-   rec = KaldiRecognizer(model, 16000)
-   accumulated_text = []
-   buffer = bytearray()
-   CHUNK_SIZE = 32768  # バッファサイズを32KBに増加
-
-   print(f"WebSocket接続開始 [{debate_id}]")
-
-   try:
-       while True:
-           try:
-               data = await websocket.receive_bytes()
-               buffer.extend(data)
 
-               # バッファが十分なサイズになったら処理
-               if len(buffer) >= CHUNK_SIZE:
-                   chunk = buffer[:CHUNK_SIZE]
-                   buffer = buffer[CHUNK_SIZE:]
-                   
-                   processed_data = process_audio_data(bytes(chunk))
+@app.get("/transcripts")
+async def list_transcripts(since: Optional[str] = None, until: Optional[str] = None):
+   # since/until は ISO 形式の時刻。期間内にセグメントがある討論を返す
+   def collect():
+       debates = []
+       for debate_id in transcript_store.debate_ids():
+           entries = transcript_store.entries(debate_id, since, until)
+           if entries:
+               debates.append({
+                   "debate_id": debate_id,
+                   "segments": len(entries),
+                   "first": entries[0]["timestamp"],
+                   "last": entries[-1]["timestamp"]
+               })
+       return debates
 
-                   if rec.AcceptWaveform(processed_data):
-                       result = json.loads(rec.Result())
-                       if result.get('text'):
-                           text = result['text'].strip()
-                           if text:  # 空文字列でない場合のみ処理
-                               accumulated_text.append(text)
-                               print(f"認識されたテキスト [{debate_id}]: {text}")
-                               await websocket.send_json({
-                                   "type": "final",
-                                   "text": text,
-                                   "debate_id": debate_id
-                               })
-                   else:
-                       partial = json.loads(rec.PartialResult())
-                       if partial.get('partial'):
-                           partial_text = partial['partial'].strip()
-                           if partial_text:  # 空文字列でない場合のみ処理
-                               print(f"部分的な認識テキスト [{debate_id}]: {partial_text}")
-                               await websocket.send_json({
-                                   "type": "partial",
-                                   "text": partial_text,
-                                   "debate_id": debate_id
-                               })
+   # 他のプロセスが追記した索引をファイルから読むので、イベントループの外で集める
+   return {"debates": await asyncio.to_thread(collect)}
 
-           except json.JSONDecodeError as e:
-               print(f"JSON解析エラー [{debate_id}]: {str(e)}")
-               continue
-           except ConnectionResetError:
-               print(f"接続リセット [{debate_id}]")
-               break
-           except Exception as e:
-               print(f"データ処理エラー [{debate_id}]: {str(e)}")
-               break
+@app.get("/transcripts/search")
+async def search_transcripts(
+   q: str,
+   debate_id: Optional[str] = None,
+   since: Optional[str] = None,
+   until: Optional[str] = None,
+   limit: int = Query(50, ge=1, le=500)
+):
+   # インデックスの構築が終わっていなければ待つ
+   index = await transcript_index.get()
+   results = await asyncio.to_thread(index.search, q, debate_id, since, until, limit)
+   return {"query": q, "results": results}
 
-   except WebSocketDisconnect as e:
-       print(f"WebSocket切断 [{debate_id}]: コード {e.code}")
-   except Exception as e:
-       print(f"予期せぬエラー [{debate_id}]: {str(e)}")
-   finally:
-       # 残りのバッファを処理
-       if buffer:
-           try:
-               processed_data = process_audio_data(bytes(buffer))
-               if rec.AcceptWaveform(processed_data):
-                   result = json.loads(rec.Result())
-                   if result.get('text'):
-                       text = result['text'].strip()
-                       if text:
-                           accumulated_text.append(text)
-           except Exception as e:
-               print(f"最終バッファ処理エラー [{debate_id}]: {str(e)}")
+@app.get("/transcripts/{debate_id}")
+async def get_transcript(debate_id: str, since: Optional[str] = None, until: Optional[str] = None):
+   segments = await transcript_store.fetch(debate_id, since, until)
+   if not segments:
+       raise HTTPException(status_code=404, detail="文字起こしが見つかりません")
+   return {
+       "debate_id": debate_id,
+       "text": " ".join(segment["text"] for segment in segments),
+       "segments": segments
+   }
 
-       if accumulated_text:
-           full_text = " ".join(accumulated_text)
-           success, filename = save_recognition_result(full_text)
-           if success:
-               try:
-                   await websocket.send_json({
-                       "type": "save",
-                       "message": f"認識結果を保存しました: {filename}",
-                       "debate_id": debate_id
-                   })
-               except:
-                   print(f"保存通知の送信に失敗 [{debate_id}]")
-       try:
-           await websocket.close()
-           print(f"WebSocket接続を終了 [{debate_id}]")
-       except:
-           pass
+@app.get("/metrics")
+async def read_metrics():
+   return {
+       "resources": resources.status(),
+       "decoder": decoding_engine.stats(),
+       "recognizer_pool": recognizer_pool.stats(),
+       "transcript_store": transcript_store.stats(),
+       "transcript_index": transcript_index.value.stats() if transcript_index.ready else None,
+       "streaming": {
+           name: {
+               "partial_latency": s["partial"].snapshot(),
+               "final_latency": s["final"].snapshot(),
+               "audio_seconds": round(s["audio_seconds"], 3),
+               # 音声1秒あたりのデコード時間
+               "decode_per_audio_second": round(s["decode_seconds"] / s["audio_seconds"], 4) if s["audio_seconds"] else 0.0
+           }
+           for name, s in streaming_stats.items()
+       },
+       "vad": {
+           **vad_totals,
+           "dropped_ratio": round(1 - vad_totals["speech_frames"] / vad_totals["frames"], 3) if vad_totals["frames"] else 0.0
+       }
+   }
 
 @app.get("/")
 async def read_root():
    return {"status": "OK", "message": "Speech Recognition API is running"}
 
+@app.get("/ready")
+async def read_ready():
+   # モデルと検索用インデックスを読み込み終えるまでは 503
+   return resources.ready_response()
+
 if __name__ == "__main__":
    import uvicorn
    uvicorn.run(app, host="0.0.0.0", port=8002)
\ No newline at end of file